@@ -0,0 +1,235 @@
+"""
+Bulk transfer of numpy and scipy.sparse data between the driver and Spark.
+
+Data is moved as Arrow record batches in chunks,
+python objects are not created for every row.
+"""
+from functools import reduce
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyspark.sql import DataFrame
+from pyspark.sql.pandas.types import from_arrow_schema
+from scipy.sparse import coo_matrix, csr_matrix, spmatrix
+
+from replay.session_handler import State
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def _to_arrow_array(values: np.ndarray) -> pa.Array:
+    """
+    1-dimensional arrays become primitive arrays,
+    rows of 2-dimensional arrays become lists
+    """
+    values = np.ascontiguousarray(values)
+    if values.ndim == 1:
+        return pa.array(values)
+    if values.ndim == 2:
+        width = values.shape[1]
+        offsets = np.arange(
+            0, (values.shape[0] + 1) * width, width, dtype=np.int32
+        )
+        return pa.ListArray.from_arrays(
+            pa.array(offsets), pa.array(values.ravel())
+        )
+    raise ValueError("Only 1 and 2-dimensional arrays can be transferred")
+
+
+def _record_batches(
+    columns: Dict[str, np.ndarray], chunk_size: int
+) -> Iterator[pa.RecordBatch]:
+    sizes = {len(values) for values in columns.values()}
+    if len(sizes) != 1:
+        raise ValueError("All columns must have the same length")
+    size = sizes.pop()
+    names = list(columns)
+    for start in range(0, max(size, 1), chunk_size):
+        yield pa.RecordBatch.from_arrays(
+            [
+                _to_arrow_array(columns[name][start : start + chunk_size])
+                for name in names
+            ],
+            names=names,
+        )
+
+
+def numpy_to_spark(
+    columns: Dict[str, np.ndarray], chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> DataFrame:
+    """
+    Create Spark DataFrame from numpy arrays.
+    2-dimensional arrays are converted to array columns.
+
+    >>> df = numpy_to_spark({"item_idx": np.array([1, 2], dtype=np.int32),
+    ...                      "vector": np.array([[1., 2.], [3., 4.]])})
+    >>> df.dtypes
+    [('item_idx', 'int'), ('vector', 'array<double>')]
+    >>> df.orderBy("item_idx").show()
+    +--------+----------+
+    |item_idx|    vector|
+    +--------+----------+
+    |       1|[1.0, 2.0]|
+    |       2|[3.0, 4.0]|
+    +--------+----------+
+    <BLANKLINE>
+
+    :param columns: dictionary column name -> array of values,
+        all arrays must have the same length
+    :param chunk_size: number of rows in an Arrow record batch
+    :return: Spark DataFrame
+    """
+    batches = list(_record_batches(columns, chunk_size))
+    spark = State().session
+    try:
+        return _create_from_arrow(batches)
+    except AttributeError:  # pragma: no cover
+        # internal pyspark API is not available, fallback to pandas
+        return reduce(
+            DataFrame.unionByName,
+            [
+                spark.createDataFrame(
+                    batch.to_pandas(),
+                    schema=from_arrow_schema(batch.schema),
+                )
+                for batch in batches
+            ],
+        )
+
+
+def _create_from_arrow(batches: List[pa.RecordBatch]) -> DataFrame:
+    """
+    Send record batches to JVM the same way
+    ``createDataFrame`` does for pandas with Arrow enabled
+    """
+    # pylint: disable=protected-access, import-outside-toplevel
+    from pyspark.serializers import ArrowStreamSerializer
+
+    spark = State().session
+    jsql_context = spark._wrapped._jsqlContext
+    schema = from_arrow_schema(batches[0].schema)
+
+    def reader_func(temp_filename):
+        return spark._jvm.PythonSQLUtils.readArrowStreamFromFile(
+            jsql_context, temp_filename
+        )
+
+    def create_rdd_server():
+        return spark._jvm.ArrowRDDServer(jsql_context)
+
+    jrdd = spark.sparkContext._serialize_to_jvm(
+        batches, ArrowStreamSerializer(), reader_func, create_rdd_server
+    )
+    jdf = spark._jvm.PythonSQLUtils.toDataFrame(
+        jrdd, schema.json(), jsql_context
+    )
+    return DataFrame(jdf, spark._wrapped)
+
+
+def _collect_batches(dataframe: DataFrame) -> List[pa.RecordBatch]:
+    try:
+        # pylint: disable=protected-access
+        return dataframe._collect_as_arrow()
+    except AttributeError:  # pragma: no cover
+        return [pa.RecordBatch.from_pandas(dataframe.toPandas())]
+
+
+def _column_to_numpy(column: pa.ChunkedArray) -> np.ndarray:
+    if pa.types.is_list(column.type):
+        column = column.combine_chunks()
+        lengths = np.diff(column.offsets.to_numpy())
+        values = column.flatten().to_numpy(zero_copy_only=False)
+        if len(lengths) == 0:
+            return values.reshape(0, 0)
+        if (lengths != lengths[0]).any():
+            raise ValueError("Array columns must have the same length")
+        return values.reshape(len(lengths), lengths[0])
+    return column.to_numpy()
+
+
+def spark_to_numpy(
+    dataframe: DataFrame, columns: Optional[Sequence[str]] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Collect Spark DataFrame columns to numpy arrays.
+    Array columns are converted to 2-dimensional arrays.
+
+    >>> from replay.session_handler import State
+    >>> df = State().session.createDataFrame(
+    ...     [(1, [1.0, 2.0]), (2, [3.0, 4.0])], "id int, vector array<double>"
+    ... )
+    >>> result = spark_to_numpy(df)
+    >>> result["id"]
+    array([1, 2], dtype=int32)
+    >>> result["vector"]
+    array([[1., 2.],
+           [3., 4.]])
+
+    :param dataframe: Spark DataFrame
+    :param columns: columns to collect, all by default
+    :return: dictionary column name -> array of values
+    """
+    if columns is not None:
+        dataframe = dataframe.select(*columns)
+    batches = _collect_batches(dataframe)
+    if batches:
+        table = pa.Table.from_batches(batches)
+    else:
+        table = pa.Table.from_pandas(
+            pd.DataFrame(columns=dataframe.columns), preserve_index=False
+        )
+    return {
+        name: _column_to_numpy(table.column(name)) for name in dataframe.columns
+    }
+
+
+def sparse_to_spark(
+    matrix: spmatrix,
+    column_names: Tuple[str, str, str] = ("user_idx", "item_idx", "relevance"),
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> DataFrame:
+    """
+    Convert non-zero elements of a sparse matrix to Spark DataFrame
+
+    :param matrix: scipy sparse matrix
+    :param column_names: names of row index, column index and value columns
+    :param chunk_size: number of rows in an Arrow record batch
+    :return: Spark DataFrame with 3 columns
+    """
+    coo = coo_matrix(matrix)
+    row_name, col_name, value_name = column_names
+    return numpy_to_spark(
+        {
+            row_name: coo.row.astype(np.int32),
+            col_name: coo.col.astype(np.int32),
+            value_name: coo.data.astype(np.float64),
+        },
+        chunk_size,
+    )
+
+
+def spark_to_csr(
+    dataframe: DataFrame,
+    shape: Optional[Tuple[int, int]] = None,
+    column_names: Tuple[str, str, str] = ("user_idx", "item_idx", "relevance"),
+) -> csr_matrix:
+    """
+    Collect Spark DataFrame to a sparse matrix
+
+    :param dataframe: Spark DataFrame
+    :param shape: matrix shape, inferred from maximum indexes by default
+    :param column_names: names of row index, column index and value columns
+    :return: csr matrix
+    """
+    row_name, col_name, value_name = column_names
+    data = spark_to_numpy(dataframe, [row_name, col_name, value_name])
+    if shape is None:
+        shape = (
+            int(data[row_name].max()) + 1 if len(data[row_name]) else 0,
+            int(data[col_name].max()) + 1 if len(data[col_name]) else 0,
+        )
+    return csr_matrix(
+        (data[value_name], (data[row_name], data[col_name])), shape=shape,
+    )
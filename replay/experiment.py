@@ -1,14 +1,28 @@
-from typing import Any, Dict, Optional
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
 from replay.constants import IntOrList, NumType
+from replay.session_handler import State
 from replay.utils import convert2spark
 from replay.metrics.base_metric import (
+    EnrichmentCache,
     Metric,
     RecOnlyMetric,
     get_enriched_recommendations,
+    get_metric_distributions,
+    get_metric_statistics,
 )
+from replay.metrics.bootstrap import (
+    bootstrap_means,
+    paired_p_values,
+    percentile_interval,
+)
+from replay.metrics.numpy_backend import get_enriched_arrays, to_pandas
 
 
 # pylint: disable=too-few-public-methods
@@ -18,6 +32,8 @@ class Experiment:
     Initialize it with test data and a dictionary mapping metrics to their depth cut-offs.
 
     Results are available with ``pandas_df`` attribute.
+    Metrics are calculated in memory with numpy when both test data
+    and predictions are pandas DataFrames, see ``Metric.use_numpy``.
 
     Example:
 
@@ -38,6 +54,12 @@ class Experiment:
                NDCG@2  NDCG@3 Surprisal@3
     baseline        –       –           –
     model     -36.91%  13.09%     -33.33%
+    >>> ex = Experiment(test, {NDCG(): [2, 3], Surprisal(log): 3})
+    >>> ex.add_results({"baseline": recs, "model": pred}, n_jobs=2)
+    >>> ex.results
+                NDCG@2    NDCG@3  Surprisal@3
+    baseline  0.613147  0.469279     1.000000
+    model     0.386853  0.530721     0.666667
     >>> ex = Experiment(test, {Precision(): [3]}, calc_median=True, calc_conf_interval=0.95)
     >>> ex.add_result("baseline", recs)
     >>> ex.add_result("model", pred)
@@ -52,8 +74,18 @@ class Experiment:
               Coverage@3  Coverage@3_median  Coverage@3_0.95_conf_interval
     baseline         1.0                1.0                            0.0
     model            1.0                1.0                            0.0
+    >>> ex = Experiment(test, {NDCG(): 2}, bootstrap=100)
+    >>> ex.add_results({"baseline": recs, "model": pred})
+    >>> ex.bootstrap_intervals()
+              NDCG@2_0.95_low  NDCG@2_0.95_high
+    baseline         0.613147          0.613147
+    model            0.386853          0.386853
     """
 
+    #: ``poisson`` or ``multinomial`` resampling for bootstrap
+    bootstrap_method: str = "poisson"
+    bootstrap_seed: Optional[int] = 42
+
     # pylint: disable=too-many-arguments
     def __init__(
         self,
@@ -61,6 +93,7 @@ class Experiment:
         metrics: Dict[Metric, IntOrList],
         calc_median: bool = False,
         calc_conf_interval: Optional[float] = None,
+        bootstrap: Optional[int] = None,
     ):
         """
         :param test: test DataFrame
@@ -69,12 +102,18 @@ class Experiment:
         :param calc_median: flag to calculate median value across users
         :param calc_conf_interval: quantile value for the calculation of the confidence interval.
             Resulting value is the half of confidence interval.
+        :param bootstrap: number of bootstrap samples. If it is set,
+            per user metric values are kept in ``user_values`` to get
+            ``bootstrap_intervals`` and p-values in ``compare``.
         """
+        self._test = test
         self.test = convert2spark(test)
         self.results = pd.DataFrame()
         self.metrics = metrics
         self.calc_median = calc_median
         self.calc_conf_interval = calc_conf_interval
+        self.bootstrap = bootstrap
+        self.user_values: Dict[str, pd.DataFrame] = {}
 
     def add_result(self, name: str, pred: Any) -> None:
         """
@@ -83,40 +122,212 @@ class Experiment:
         :param name: name of the run to store in the resulting DataFrame
         :param pred: model recommendations
         """
-        recs = get_enriched_recommendations(pred, self.test).cache()
-        for metric, k_list in sorted(
-            self.metrics.items(), key=lambda x: str(x[0])
+        self._add_statistics(name, *self._evaluate(pred))
+
+    def add_results(
+        self, preds: Dict[str, Any], n_jobs: Optional[int] = None
+    ) -> None:
+        """
+        Calculate metrics for several models concurrently.
+        Each model is evaluated in its own thread.
+        With ``PYSPARK_PIN_THREAD=true`` every thread submits Spark jobs
+        to its own scheduler pool, so they share the cluster
+        when Spark runs with ``spark.scheduler.mode=FAIR``.
+        Without pinned threads local properties are shared by all
+        Python threads, so jobs go to the default pool.
+
+        :param preds: run name mapped to model recommendations
+        :param n_jobs: number of models evaluated at the same time,
+            all of them by default
+        """
+        if n_jobs is not None and n_jobs < 1:
+            raise ValueError("n_jobs must be a positive number")
+        if not preds:
+            return
+        with ThreadPoolExecutor(max_workers=n_jobs or len(preds)) as pool:
+            futures = {
+                name: pool.submit(self._evaluate_in_pool, name, pred)
+                for name, pred in preds.items()
+            }
+            for name, future in futures.items():
+                self._add_statistics(name, *future.result())
+
+    def _evaluate_in_pool(self, name: str, pred: Any) -> Tuple:
+        """Evaluate predictions in a separate scheduler pool"""
+        if os.environ.get("PYSPARK_PIN_THREAD", "false").lower() != "true":
+            return self._evaluate(pred)
+        spark_context = State().session.sparkContext
+        spark_context.setLocalProperty(
+            "spark.scheduler.pool", f"replay_{name}"
+        )
+        try:
+            return self._evaluate(pred)
+        finally:
+            spark_context.setLocalProperty("spark.scheduler.pool", None)
+
+    def _evaluate(self, pred: Any) -> Tuple[Dict, Optional[pd.DataFrame]]:
+        """
+        :param pred: model recommendations
+        :return: ``(metric, k)`` mapped to ``(mean, median, conf_interval)``
+            and per user values if bootstrap is used
+        """
+        metrics = {
+            metric: [k_list] if isinstance(k_list, int) else list(k_list)
+            for metric, k_list in self.metrics.items()
+        }
+        shared: Dict[bool, Dict[Metric, list]] = {True: {}, False: {}}
+        for metric, k_list in metrics.items():
+            if metric._vectorized and not isinstance(metric, RecOnlyMetric):
+                shared[self._use_numpy(metric, pred)][metric] = k_list
+        recs = None
+        if any(
+            not isinstance(metric, RecOnlyMetric)
+            and not self._use_numpy(metric, pred)
+            for metric in metrics
         ):
-            enriched = None
+            recs = get_enriched_recommendations(pred, self.test).cache()
+        rec_only = [
+            metric
+            for metric in metrics
+            if isinstance(metric, RecOnlyMetric)
+            and not self._use_numpy(metric, pred)
+        ]
+        enrichment = EnrichmentCache(pred, rec_only) if rec_only else None
+
+        stats: Dict = {}
+        values: List[pd.DataFrame] = []
+        if shared[True]:
+            stats.update(
+                self._statistics(
+                    get_enriched_arrays(pred, self._test), shared[True], values
+                )
+            )
+        if shared[False]:
+            stats.update(self._statistics(recs, shared[False], values))
+        for metric, k_list in metrics.items():
+            if metric in shared[True] or metric in shared[False]:
+                continue
+            enriched = recs
             if isinstance(metric, RecOnlyMetric):
-                enriched = metric._get_enriched_recommendations(
-                    pred, self.test
+                if metric in rec_only:
+                    enriched = enrichment[metric]
+                else:
+                    enriched = metric._get_enriched_arrays(pred, None)
+            if metric._vectorized:
+                stats.update(
+                    self._statistics(enriched, {metric: k_list}, values)
                 )
-
-            values, median, conf_interval = self._calculate(
-                metric, enriched or recs, k_list
+                continue
+            means, median, conf_interval = self._calculate(
+                metric, enriched, k_list
             )
+            for k in k_list:
+                stats[metric, k] = (
+                    means[k],
+                    None if median is None else median[k],
+                    None if conf_interval is None else conf_interval[k],
+                )
+
+        if recs is not None:
+            recs.unpersist()
+        if enrichment is not None:
+            enrichment.unpersist()
+        return stats, pd.concat(values, axis=1) if values else None
 
+    def _add_statistics(
+        self, name: str, stats: Dict, values: Optional[pd.DataFrame] = None
+    ) -> None:
+        """
+        Store evaluated statistics in ``results``
+
+        :param name: name of the run
+        :param stats: statistics from ``_evaluate``
+        :param values: per user values from ``_evaluate``
+        """
+        if values is not None:
+            self.user_values[name] = values
+        for metric, k_list in sorted(
+            self.metrics.items(), key=lambda x: str(x[0])
+        ):
             if isinstance(k_list, int):
-                self._add_metric(  # type: ignore
-                    name,
-                    metric,
-                    k_list,
-                    values,  # type: ignore
-                    median,  # type: ignore
-                    conf_interval,  # type: ignore
-                )
-            else:
-                for k, val in sorted(values.items(), key=lambda x: x[0]):
-                    self._add_metric(
-                        name,
-                        metric,
-                        k,
-                        val,
-                        None if median is None else median[k],
-                        None if conf_interval is None else conf_interval[k],
-                    )
-        recs.unpersist()
+                k_list = [k_list]
+            for k in sorted(set(k_list)):
+                self._add_metric(name, metric, k, *stats[metric, k])
+
+    def _use_numpy(self, metric: Metric, pred: Any) -> bool:
+        """Whether metric is calculated in memory for these predictions"""
+        if isinstance(metric, RecOnlyMetric):
+            return metric._numpy_backend(pred)
+        return metric._numpy_backend(pred, self._test)
+
+    def _statistics(self, enriched, metrics, values):
+        """
+        Calculate all requested statistics in a single pass,
+        per user values are collected to ``values`` for bootstrap
+        """
+        if self.bootstrap is not None:
+            columns = {
+                f"{metric}@{k}": (metric, k)
+                for metric, k_list in metrics.items()
+                for k in k_list
+            }
+            values.append(
+                to_pandas(get_metric_distributions(enriched, columns))
+                .set_index("user_id")
+                .astype(np.float32)
+            )
+        return get_metric_statistics(
+            enriched, metrics, self.calc_median, self.calc_conf_interval
+        )
+
+    def _warn_not_bootstrapped(self, columns: List[str]) -> None:
+        """Log metrics without per user values, e.g. ``Coverage``"""
+        excluded = [
+            column
+            for column in columns
+            if not any(
+                column in values.columns
+                for values in self.user_values.values()
+            )
+        ]
+        if excluded:
+            logging.getLogger("replay").warning(
+                "Metrics without per user values are not bootstrapped, "
+                "their intervals and p-values are NaN: %s",
+                ", ".join(excluded),
+            )
+
+    def bootstrap_intervals(self, alpha: float = 0.95) -> pd.DataFrame:
+        """
+        Percentile bootstrap intervals of metrics averaged by users.
+        Metrics without per user values, e.g. ``Coverage``,
+        get ``NaN`` bounds.
+
+        :param alpha: confidence level
+        :return: lower and upper bounds for each run
+        """
+        if self.bootstrap is None:
+            raise ValueError("Experiment was created without bootstrap")
+        columns = [
+            column for column in self.results.columns if column[-1].isdigit()
+        ]
+        self._warn_not_bootstrapped(columns)
+        res = pd.DataFrame()
+        for name, values in self.user_values.items():
+            samples = bootstrap_means(
+                values.to_numpy(),
+                self.bootstrap,
+                self.bootstrap_method,
+                self.bootstrap_seed,
+            )
+            bounds = dict(
+                zip(values.columns, zip(*percentile_interval(samples, alpha)))
+            )
+            for column in columns:
+                lower, upper = bounds.get(column, (np.nan, np.nan))
+                res.at[name, f"{column}_{alpha}_low"] = lower
+                res.at[name, f"{column}_{alpha}_high"] = upper
+        return res
 
     def _calculate(self, metric, enriched, k_list):
         median = None
@@ -161,11 +372,13 @@ class Experiment:
             ] = conf_interval
 
     # pylint: disable=not-an-iterable
-    def compare(self, name: str) -> pd.DataFrame:
+    def compare(self, name: str, p_values: bool = False) -> pd.DataFrame:
         """
         Show results as a percentage difference to record ``name``.
 
         :param name: name of the baseline record
+        :param p_values: add bootstrap p-values of paired differences
+            with the baseline calculated on common users
         :return: results table in a percentage format
         """
         if name not in self.results.index:
@@ -183,4 +396,43 @@ class Experiment:
                 ]
             else:
                 data_frame.loc[name] = ["–"] * len(baseline)
+        if p_values:
+            data_frame = self._add_p_values(data_frame, name)
         return data_frame
+
+    def _add_p_values(self, data_frame: pd.DataFrame, name: str):
+        """Add paired bootstrap p-values to ``compare`` table"""
+        if self.bootstrap is None:
+            raise ValueError("Experiment was created without bootstrap")
+        self._warn_not_bootstrapped(list(data_frame.columns))
+        base_values = self.user_values[name]
+        columns = list(data_frame.columns)
+        bootstrapped = [
+            column for column in columns if column in base_values.columns
+        ]
+        res = {}
+        for idx in data_frame.index:
+            if idx == name:
+                res[idx] = ["–"] * len(columns)
+                continue
+            model_values = self.user_values[idx]
+            users = base_values.index.intersection(model_values.index)
+            p_values = dict(
+                zip(
+                    bootstrapped,
+                    paired_p_values(
+                        base_values.loc[users, bootstrapped].to_numpy(),
+                        model_values.loc[users, bootstrapped].to_numpy(),
+                        self.bootstrap,
+                        self.bootstrap_method,
+                        self.bootstrap_seed,
+                    ),
+                )
+            )
+            res[idx] = [p_values.get(column, np.nan) for column in columns]
+        p_values = pd.DataFrame.from_dict(
+            res,
+            orient="index",
+            columns=[f"{column}_p_value" for column in columns],
+        )
+        return data_frame.join(p_values)
@@ -2,10 +2,12 @@
 Select or remove data by some criteria
 """
 from datetime import datetime, timedelta
+import pandas as pd
+from pyspark.ml.feature import StringIndexer
 from pyspark.sql import DataFrame, Window, functions as sf
 from pyspark.sql.functions import col
 from pyspark.sql.types import TimestampType
-from typing import Union, Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 from replay.constants import AnyDataFrame
 from replay.utils import convert2spark
@@ -49,7 +51,7 @@ def min_rating(
     data_frame: AnyDataFrame, value: float, column="relevance"
 ) -> DataFrame:
     """
-    Remove records with records less than ``value`` in ``column``.
+    Remove records with ``column`` values not greater than ``value``.
 
     >>> import pandas as pd
     >>> data_frame = pd.DataFrame({"relevance": [1, 5, 3, 4]})
@@ -376,3 +378,361 @@ def filter_by_duration(
         f"INTERVAL {duration_days} days"
     )
     return log.filter(col(date_column) > start_date)
+
+
+class FilterPipeline:
+    """
+    Applies several filters in one pass over the log.
+    Filters are added with methods named after the functions of this module.
+    Record filters are applied first, then all filters based on user
+    and item statistics are checked together on statistics
+    calculated in one window per user and one per item,
+    so every such filter sees the same log, unlike a chain of functions.
+    K-core filtering is applied last.
+
+    >>> import pandas as pd
+    >>> from replay.utils import convert2spark
+    >>> log_pd = pd.DataFrame({"user_id": ["u1", "u2", "u2", "u3", "u3", "u3"],
+    ...                     "item_id": ["i1", "i2","i3", "i1", "i2","i3"],
+    ...                     "rel": [1., 0.5, 3, 1, 0, 1],
+    ...                     "timestamp": ["2020-01-01 23:59:59", "2020-02-01",
+    ...                                   "2020-02-01", "2020-01-01 00:04:15",
+    ...                                   "2020-01-02 00:04:14", "2020-01-05 23:59:59"]},
+    ...             )
+    >>> log_pd["timestamp"] = pd.to_datetime(log_pd["timestamp"])
+    >>> log_sp = convert2spark(log_pd)
+    >>> pipeline = (
+    ...     FilterPipeline()
+    ...     .min_rating(0.1, column="rel")
+    ...     .min_entries(2)
+    ...     .filter_user_interactions(1, first=False)
+    ... )
+    >>> pipeline.transform(log_sp).orderBy("user_id").show()
+    +-------+-------+---+-------------------+
+    |user_id|item_id|rel|          timestamp|
+    +-------+-------+---+-------------------+
+    |     u2|     i3|3.0|2020-02-01 00:00:00|
+    |     u3|     i3|1.0|2020-01-05 23:59:59|
+    +-------+-------+---+-------------------+
+    <BLANKLINE>
+    """
+
+    def __init__(
+        self,
+        user_col: str = "user_id",
+        item_col: str = "item_id",
+        date_col: str = "timestamp",
+    ):
+        """
+        :param user_col: user column
+        :param item_col: item column, it also sorts simultaneous interactions
+        :param date_col: date column
+        """
+        self.user_col = user_col
+        self.item_col = item_col
+        self.date_col = date_col
+        self.record_conditions: List[str] = []
+        self.user_conditions: List[str] = []
+        self.item_conditions: List[str] = []
+        self.log_conditions: List[str] = []
+        self.rank_users = False
+        self.k_core_entries: Optional[Tuple[int, int]] = None
+        self.k_core_rounds: Optional[pd.DataFrame] = None
+
+    def min_entries(self, num_entries: int) -> "FilterPipeline":
+        """
+        Remove users with less than ``num_entries`` ratings.
+        """
+        self.user_conditions.append(f"_user_count >= {num_entries}")
+        return self
+
+    def min_item_entries(self, num_entries: int) -> "FilterPipeline":
+        """
+        Remove items with less than ``num_entries`` ratings.
+        """
+        self.item_conditions.append(f"_item_count >= {num_entries}")
+        return self
+
+    def min_rating(
+        self, value: float, column: str = "relevance"
+    ) -> "FilterPipeline":
+        """
+        Remove records with ``column`` values not greater than ``value``.
+        """
+        self.record_conditions.append(f"`{column}` > {value}")
+        return self
+
+    def filter_user_interactions(
+        self, num_interactions: int = 10, first: bool = True
+    ) -> "FilterPipeline":
+        """
+        Get first/last ``num_interactions`` interactions for each user.
+        """
+        self.rank_users = True
+        if first:
+            self.user_conditions.append(f"_user_rank <= {num_interactions}")
+        else:
+            self.user_conditions.append(
+                f"_user_rank > _user_count - {num_interactions}"
+            )
+        return self
+
+    def filter_by_user_duration(
+        self, days: int = 10, first: bool = True
+    ) -> "FilterPipeline":
+        """
+        Get first/last ``days`` of user interactions.
+        """
+        if first:
+            self.user_conditions.append(
+                f"`{self.date_col}` < _user_min_date + INTERVAL {days} days"
+            )
+        else:
+            self.user_conditions.append(
+                f"`{self.date_col}` > _user_max_date - INTERVAL {days} days"
+            )
+        return self
+
+    def filter_between_dates(
+        self,
+        start_date: Optional[Union[str, datetime]] = None,
+        end_date: Optional[Union[str, datetime]] = None,
+    ) -> "FilterPipeline":
+        """
+        Select a part of data between ``[start_date, end_date)``.
+        """
+        if start_date is not None:
+            self.record_conditions.append(
+                f"`{self.date_col}` >= CAST('{start_date}' AS TIMESTAMP)"
+            )
+        if end_date is not None:
+            self.record_conditions.append(
+                f"`{self.date_col}` < CAST('{end_date}' AS TIMESTAMP)"
+            )
+        return self
+
+    def filter_by_duration(
+        self, duration_days: int, first: bool = True
+    ) -> "FilterPipeline":
+        """
+        Select first/last days from log.
+        Log dates are substituted into ``{min_date}`` and ``{max_date}``.
+        """
+        if first:
+            self.log_conditions.append(
+                f"`{self.date_col}` < CAST('{{min_date}}' AS TIMESTAMP)"
+                f" + INTERVAL {duration_days} days"
+            )
+        else:
+            self.log_conditions.append(
+                f"`{self.date_col}` > CAST('{{max_date}}' AS TIMESTAMP)"
+                f" - INTERVAL {duration_days} days"
+            )
+        return self
+
+    def k_core(
+        self, min_user_entries: int, min_item_entries: int
+    ) -> "FilterPipeline":
+        """
+        Iteratively remove users with less than ``min_user_entries``
+        and items with less than ``min_item_entries`` ratings
+        until all of the remaining have enough, see ``k_core``.
+        Removal counts are kept in ``k_core_rounds``.
+        """
+        self.k_core_entries = (min_user_entries, min_item_entries)
+        return self
+
+    def transform(self, log: AnyDataFrame) -> DataFrame:
+        """
+        Apply all filters.
+
+        :param log: historical DataFrame
+        :return: filtered DataFrame
+        """
+        log = convert2spark(log)
+        columns = log.columns
+        for condition in self.record_conditions:
+            log = log.filter(condition)
+        conditions = []
+        if self.log_conditions:
+            dates = log.agg(
+                sf.min(self.date_col).alias("min_date"),
+                sf.max(self.date_col).alias("max_date"),
+            ).first()
+            conditions += [
+                condition.format(**dates.asDict())
+                for condition in self.log_conditions
+            ]
+        if self.user_conditions:
+            user_window = Window.partitionBy(self.user_col)
+            if self.rank_users:
+                log = log.withColumn(
+                    "_user_rank",
+                    sf.row_number().over(
+                        user_window.orderBy(self.date_col, self.item_col)
+                    ),
+                )
+            log = (
+                log.withColumn("_user_count", sf.count("*").over(user_window))
+                .withColumn(
+                    "_user_min_date", sf.min(self.date_col).over(user_window)
+                )
+                .withColumn(
+                    "_user_max_date", sf.max(self.date_col).over(user_window)
+                )
+            )
+            conditions += self.user_conditions
+        if self.item_conditions:
+            log = log.withColumn(
+                "_item_count",
+                sf.count("*").over(Window.partitionBy(self.item_col)),
+            )
+            conditions += self.item_conditions
+        if conditions:
+            log = log.filter(
+                " AND ".join(f"({condition})" for condition in conditions)
+            )
+        log = log.select(*columns)
+        if self.k_core_entries is not None:
+            log = self._k_core(log, *self.k_core_entries)
+        return log
+
+    def _k_core(
+        self, log: DataFrame, min_user_entries: int, min_item_entries: int
+    ) -> DataFrame:
+        """
+        Apply ``k_core`` and keep its rounds in ``k_core_rounds``.
+
+        :param log: historical DataFrame
+        :param min_user_entries: minimal number of ratings for a user
+        :param min_item_entries: minimal number of ratings for an item
+        :return: filtered DataFrame
+        """
+        log, self.k_core_rounds = k_core(
+            log,
+            min_user_entries,
+            min_item_entries,
+            user_col=self.user_col,
+            item_col=self.item_col,
+        )
+        return log
+
+
+def _release_checkpoint(frame: DataFrame) -> None:
+    """
+    Remove blocks of a DataFrame saved with ``localCheckpoint``,
+    ``DataFrame.unpersist`` does not release them
+
+    :param frame: DataFrame returned by ``localCheckpoint``
+    """
+    # pylint: disable=protected-access
+    frame._jdf.queryExecution().analyzed().rdd().unpersist(False)
+
+
+def _k_core_sizes(pairs: DataFrame) -> Dict[str, int]:
+    """
+    :param pairs: DataFrame ``[user_idx, item_idx]``
+    :return: number of interactions, users and items
+    """
+    return pairs.agg(
+        sf.count("*").alias("interactions"),
+        sf.countDistinct("user_idx").alias("users"),
+        sf.countDistinct("item_idx").alias("items"),
+    ).first().asDict()
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def k_core(
+    log: AnyDataFrame,
+    min_user_entries: int = 5,
+    min_item_entries: int = 5,
+    max_rounds: Optional[int] = None,
+    user_col: str = "user_id",
+    item_col: str = "item_id",
+) -> Tuple[DataFrame, pd.DataFrame]:
+    """
+    Iteratively remove users with less than ``min_user_entries``
+    and items with less than ``min_item_entries`` ratings
+    until all of the remaining have enough.
+    Rounds run on integer user and item codes only,
+    every round is saved with ``localCheckpoint`` to cut the lineage
+    and the previous round is released.
+    Records with null user or item are dropped.
+
+    >>> import pandas as pd
+    >>> log = pd.DataFrame({"user_id": [1, 1, 2, 2, 3, 3],
+    ...                     "item_id": [1, 2, 1, 2, 1, 3]})
+    >>> filtered, rounds = k_core(log, 2, 2)
+    >>> filtered.orderBy("user_id", "item_id").toPandas()
+       user_id  item_id
+    0        1        1
+    1        1        2
+    2        2        1
+    3        2        2
+    >>> rounds
+       round  interactions  users  items
+    0      1             1      0      1
+    1      2             1      1      0
+    2      3             0      0      0
+
+    :param log: historical DataFrame
+    :param min_user_entries: minimal number of ratings for a user
+    :param min_item_entries: minimal number of ratings for an item
+    :param max_rounds: stop after this number of rounds
+        even if some users or items still have less ratings
+    :param user_col: user column
+    :param item_col: item column
+    :return: filtered DataFrame and the number of interactions,
+        users and items removed in each round
+    """
+    log = convert2spark(log).filter(
+        col(user_col).isNotNull() & col(item_col).isNotNull()
+    )
+    indexers = [
+        StringIndexer(inputCol=user_col, outputCol="user_idx").fit(log),
+        StringIndexer(inputCol=item_col, outputCol="item_idx").fit(log),
+    ]
+    indexed = (
+        indexers[1]
+        .transform(indexers[0].transform(log))
+        .withColumn("user_idx", col("user_idx").cast("int"))
+        .withColumn("item_idx", col("item_idx").cast("int"))
+    )
+    pairs = indexed.select("user_idx", "item_idx").localCheckpoint()
+    sizes = _k_core_sizes(pairs)
+    rounds: List[Dict[str, int]] = []
+    user_window = Window.partitionBy("user_idx")
+    item_window = Window.partitionBy("item_idx")
+    while max_rounds is None or len(rounds) < max_rounds:
+        remaining = (
+            pairs.withColumn("_user_count", sf.count("*").over(user_window))
+            .withColumn("_item_count", sf.count("*").over(item_window))
+            .filter(
+                (col("_user_count") >= min_user_entries)
+                & (col("_item_count") >= min_item_entries)
+            )
+            .drop("_user_count", "_item_count")
+            .localCheckpoint()
+        )
+        remaining_sizes = _k_core_sizes(remaining)
+        _release_checkpoint(pairs)
+        removed = {name: sizes[name] - remaining_sizes[name] for name in sizes}
+        rounds.append({"round": len(rounds) + 1, **removed})
+        State().logger.info(
+            "k-core round %s removed %s interactions",
+            len(rounds),
+            removed["interactions"],
+        )
+        pairs, sizes = remaining, remaining_sizes
+        if removed["interactions"] == 0:
+            break
+    else:
+        State().logger.warning(
+            "k-core has not converged in %s rounds", max_rounds
+        )
+    filtered = indexed.join(
+        pairs.distinct(), on=["user_idx", "item_idx"], how="left_semi"
+    ).drop("user_idx", "item_idx")
+    return filtered, pd.DataFrame(
+        rounds, columns=["round", "interactions", "users", "items"]
+    )
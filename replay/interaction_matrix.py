@@ -0,0 +1,346 @@
+"""
+Interaction matrices shared between models.
+
+Matrix-based models need the same ``users x items`` sparse matrix
+built from the same indexed log. It is collected once
+and kept in a driver-side LRU cache keyed by a fingerprint
+of the log plan, input files and indexers.
+Models release their matrices in ``_clear_cache``.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import uuid
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pyspark.ml.feature import StringIndexerModel
+from pyspark.sql import DataFrame
+from scipy.sparse import csc_matrix, csr_matrix
+
+from replay.arrow_transfer import spark_to_numpy
+
+
+class InteractionMatrix:
+    """
+    Sparse ``users x items`` matrix with CSR and CSC views.
+    Views are shared, they must not be modified in place.
+    """
+
+    def __init__(self, matrix: csr_matrix):
+        """
+        :param matrix: interaction matrix
+        """
+        self._csr = matrix.tocsr()
+        self._csc: Optional[csc_matrix] = None
+        self.spill_dir: Optional[str] = None
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def from_log(
+        cls,
+        log: DataFrame,
+        shape: Optional[Tuple[Optional[int], Optional[int]]] = None,
+        value_col: Optional[str] = "relevance",
+        dtype: Optional[np.dtype] = None,
+    ) -> "InteractionMatrix":
+        """
+        Collect interaction matrix from log
+
+        :param log: indexed log ``[user_idx, item_idx, relevance]``
+        :param shape: matrix shape, dimensions set to ``None``
+            are inferred from maximum indexes
+        :param value_col: column with matrix values,
+            ``None`` means that all interactions are equal to 1
+        :param dtype: type of matrix values, type of ``value_col`` by default
+        :return: interaction matrix
+        """
+        columns = ["user_idx", "item_idx"]
+        if value_col is not None:
+            columns.append(value_col)
+        data = spark_to_numpy(log, columns)
+        if value_col is None:
+            values = np.ones(len(data["user_idx"]), dtype=dtype or np.float64)
+        else:
+            values = data[value_col]
+            if dtype is not None:
+                values = values.astype(dtype, copy=False)
+        rows, cols = shape or (None, None)
+        if rows is None:
+            rows = int(data["user_idx"].max()) + 1 if len(values) else 0
+        if cols is None:
+            cols = int(data["item_idx"].max()) + 1 if len(values) else 0
+        return cls(
+            csr_matrix(
+                (values, (data["user_idx"], data["item_idx"])),
+                shape=(int(rows), int(cols)),
+            )
+        )
+
+    @property
+    def csr(self) -> csr_matrix:
+        """
+        :return: CSR view, rows are users
+        """
+        return self._csr
+
+    @property
+    def csc(self) -> csc_matrix:
+        """
+        :return: CSC view, built on first access
+        """
+        if self._csc is None:
+            self._csc = self._csr.tocsc()
+        return self._csc
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """
+        :return: matrix shape
+        """
+        return self._csr.shape
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: memory occupied by in-memory views
+        """
+        total = 0
+        in_memory = [self._csc] if self.spill_dir else [self._csr, self._csc]
+        for matrix in in_memory:
+            if matrix is not None:
+                total += (
+                    matrix.data.nbytes
+                    + matrix.indices.nbytes
+                    + matrix.indptr.nbytes
+                )
+        return total
+
+    def spill(self, directory: str) -> None:
+        """
+        Move CSR view to memory-mapped files and drop CSC view
+
+        :param directory: directory to save arrays to
+        """
+        os.makedirs(directory, exist_ok=True)
+        arrays = {}
+        for name in ["data", "indices", "indptr"]:
+            path = os.path.join(directory, f"{name}.npy")
+            np.save(path, getattr(self._csr, name))
+            arrays[name] = np.load(path, mmap_mode="r")
+        self._csr = csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=self._csr.shape,
+            copy=False,
+        )
+        self._csc = None
+        self.spill_dir = directory
+
+    def release(self) -> None:
+        """Remove spilled files"""
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+
+class InteractionMatrixCache:
+    """
+    LRU cache of interaction matrices.
+    When matrices in memory exceed ``max_bytes``, least recently used ones
+    are spilled to memory-mapped files if ``spill`` is set,
+    otherwise they are dropped.
+    Matrices requested with an ``owner`` are dropped as soon as
+    all their owners release them or are garbage collected.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 2 * 1024 ** 3,
+        spill: bool = False,
+        spill_dir: Optional[str] = None,
+    ):
+        """
+        :param max_bytes: memory limit for matrices kept in memory
+        :param spill: spill evicted matrices to disk instead of dropping them
+        :param spill_dir: directory for spilled matrices,
+            system temporary directory by default
+        """
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self._matrices: "OrderedDict[str, InteractionMatrix]" = OrderedDict()
+        self._label_digests: Dict[Tuple[str, int], str] = {}
+        self._owners: Dict[str, "weakref.WeakSet[Any]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._matrices)
+
+    def clear(self, owner: Optional[Any] = None) -> None:
+        """
+        Drop cached matrices
+
+        :param owner: release only matrices requested by ``owner``,
+            matrices shared with other owners are kept.
+            All matrices are dropped by default.
+        """
+        if owner is None:
+            for matrix in self._matrices.values():
+                matrix.release()
+            self._matrices.clear()
+            self._owners.clear()
+            return
+        for owners in self._owners.values():
+            owners.discard(owner)
+        self._drop_orphans()
+
+    def _drop(self, key: str) -> None:
+        self._matrices.pop(key).release()
+        self._owners.pop(key, None)
+
+    def _drop_orphans(self) -> None:
+        for key, owners in list(self._owners.items()):
+            if not owners:
+                self._drop(key)
+
+    def _labels_digest(self, indexer: StringIndexerModel) -> str:
+        labels = indexer.labels
+        key = (indexer.uid, len(labels))
+        if key not in self._label_digests:
+            self._label_digests[key] = hashlib.sha1(
+                "\0".join(labels).encode()
+            ).hexdigest()
+        return self._label_digests[key]
+
+    @staticmethod
+    def _files_digest(log: DataFrame) -> str:
+        """
+        Sizes and modification times of files the log is read from,
+        so that data overwritten at the same path gets a new fingerprint
+        """
+        # pylint: disable=protected-access
+        files = sorted(log._jdf.inputFiles())
+        if not files:
+            return ""
+        context = log.sql_ctx._sc
+        hadoop_conf = context._jsc.hadoopConfiguration()
+        by_dir: Dict[str, List[str]] = defaultdict(list)
+        for file in files:
+            path = context._jvm.org.apache.hadoop.fs.Path(file)
+            by_dir[path.getParent().toString()].append(path.getName())
+        parts = []
+        for directory, names in sorted(by_dir.items()):
+            path = context._jvm.org.apache.hadoop.fs.Path(directory)
+            filesystem = path.getFileSystem(hadoop_conf)
+            statuses = {
+                status.getPath().getName(): (
+                    f"{status.getLen()}:{status.getModificationTime()}"
+                )
+                for status in filesystem.listStatus(path)
+            }
+            parts.extend(
+                f"{directory}/{name}:{statuses.get(name)}" for name in names
+            )
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+    def fingerprint(
+        self,
+        log: DataFrame,
+        indexers: Optional[Sequence[StringIndexerModel]] = None,
+    ) -> str:
+        """
+        Log fingerprint.
+        Plan is compared without expression ids and data sources
+        are compared by their semantic hash,
+        sizes and modification times of their files.
+        If ``indexers`` are provided, the same log indexed by the same
+        indexers in different calls gets the same fingerprint.
+        Otherwise the whole plan semantic hash is used,
+        which distinguishes separate indexing calls.
+
+        :param log: indexed log
+        :param indexers: indexers used to get ``user_idx`` and ``item_idx``
+        :return: fingerprint string
+        """
+        # pylint: disable=protected-access
+        plan = log._jdf.queryExecution().analyzed()
+        leaves = plan.collectLeaves()
+        parts = [re.sub(r"#\d+L?", "", plan.toString())]
+        parts.extend(
+            str(leaves.apply(i).semanticHash()) for i in range(leaves.size())
+        )
+        parts.append(self._files_digest(log))
+        if indexers is None:
+            parts.append(str(plan.semanticHash()))
+        else:
+            parts.extend(self._labels_digest(indexer) for indexer in indexers)
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+    # pylint: disable=too-many-arguments
+    def get(
+        self,
+        log: DataFrame,
+        shape: Optional[Tuple[Optional[int], Optional[int]]] = None,
+        value_col: Optional[str] = "relevance",
+        dtype: Optional[np.dtype] = None,
+        indexers: Optional[Sequence[StringIndexerModel]] = None,
+        owner: Optional[Any] = None,
+    ) -> InteractionMatrix:
+        """
+        Get interaction matrix for log, collect it if it is not cached
+
+        :param log: indexed log ``[user_idx, item_idx, relevance]``
+        :param shape: matrix shape, dimensions set to ``None``
+            are inferred from maximum indexes
+        :param value_col: column with matrix values,
+            ``None`` means that all interactions are equal to 1
+        :param dtype: type of matrix values, e.g. ``np.float32``
+        :param indexers: user and item indexers used to index the log
+        :param owner: object using the matrix, e.g. a model,
+            the matrix is dropped when all its owners release it
+        :return: interaction matrix
+        """
+        self._drop_orphans()
+        key = "|".join(
+            [
+                self.fingerprint(log, indexers),
+                str(shape),
+                str(value_col),
+                str(None if dtype is None else np.dtype(dtype)),
+            ]
+        )
+        if key in self._matrices:
+            self._matrices.move_to_end(key)
+        else:
+            self._matrices[key] = InteractionMatrix.from_log(
+                log, shape, value_col, dtype
+            )
+        if owner is not None:
+            self._owners.setdefault(key, weakref.WeakSet()).add(owner)
+        matrix = self._matrices[key]
+        self._evict()
+        return matrix
+
+    def _evict(self) -> None:
+        in_memory = sum(matrix.nbytes for matrix in self._matrices.values())
+        for key in list(self._matrices)[:-1]:
+            if in_memory <= self.max_bytes:
+                break
+            matrix = self._matrices[key]
+            in_memory -= matrix.nbytes
+            if self.spill:
+                if matrix.spill_dir is None:
+                    matrix.spill(
+                        os.path.join(
+                            self.spill_dir or tempfile.gettempdir(),
+                            f"interactions_{uuid.uuid4().hex}",
+                        )
+                    )
+            else:
+                self._drop(key)
+
+
+interaction_cache = InteractionMatrixCache()
@@ -0,0 +1,410 @@
+"""
+Mergeable metric states for incremental evaluation.
+Accumulators are updated batch by batch and can be merged,
+so values of different partitions or days can be combined
+without rescanning the data.
+"""
+import pickle
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from pyspark.sql import DataFrame
+from scipy.stats import norm
+
+from replay.constants import AnyDataFrame, IntOrList, NumType
+from replay.metrics.base_metric import (
+    Metric,
+    RecOnlyMetric,
+    get_enriched_recommendations,
+    get_metric_distributions,
+)
+from replay.metrics.coverage import Coverage
+from replay.metrics.numpy_backend import to_pandas
+from replay.utils import convert2spark
+
+
+class MomentsAccumulator:
+    """
+    Running count, mean and variance.
+    Batches are combined with parallel Welford (Chan et al.) update.
+
+    >>> first = MomentsAccumulator().update([1.0, 2.0])
+    >>> second = MomentsAccumulator().update([3.0, 4.0])
+    >>> merged = first.merge(second)
+    >>> merged.count, merged.mean, round(merged.variance, 4)
+    (4, 2.5, 1.6667)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _combine(self, count: int, mean: float, m2: float) -> None:
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def update(self, values: Iterable[float]) -> "MomentsAccumulator":
+        """
+        :param values: new observations
+        :return: self
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) > 0:
+            mean = values.mean()
+            self._combine(
+                len(values), float(mean), float(((values - mean) ** 2).sum())
+            )
+        return self
+
+    def merge(self, other: "MomentsAccumulator") -> "MomentsAccumulator":
+        """
+        :param other: accumulator to add to this one
+        :return: self
+        """
+        self._combine(other.count, other.mean, other.m2)
+        return self
+
+    @property
+    def variance(self) -> float:
+        """Sample variance, zero for less than two observations"""
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    def conf_interval(self, alpha: float = 0.95) -> Optional[float]:
+        """
+        Half of the normal confidence interval for the mean,
+        the same as ``Metric.conf_interval``.
+
+        :param alpha: quantile value
+        :return: ``None`` if there are no observations
+        """
+        if self.count == 0:
+            return None
+        quantile = norm.ppf((1 + alpha) / 2)
+        return quantile * self.variance ** 0.5 / self.count ** 0.5
+
+
+class QuantileSketch:
+    """
+    KLL quantile sketch. It keeps ``O(k)`` weighted samples
+    with rank error of about ``1.7 / k`` and is exact
+    until the first compaction.
+
+    >>> sketch = QuantileSketch(seed=0).update(np.arange(1, 101))
+    >>> sketch.merge(QuantileSketch(seed=1).update([101, 102])).quantile(0.5)
+    51.0
+    """
+
+    def __init__(self, k: int = 200, seed: Optional[int] = None):
+        """
+        :param k: size of the top level compactor
+        :param seed: random seed for compactions
+        """
+        self.k = k
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                cut = len(items) - len(items) % 2
+                leftover, items = items[cut:], items[:cut]
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], items[self._rng.integers(2) :: 2]]
+                )
+                self.levels[level] = leftover
+            level += 1
+
+    def update(self, values: Iterable[float]) -> "QuantileSketch":
+        """
+        :param values: new observations
+        :return: self
+        """
+        self.levels[0] = np.concatenate(
+            [self.levels[0], np.asarray(values, dtype=np.float64)]
+        )
+        self._compress()
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """
+        :param other: sketch to add to this one
+        :return: self
+        """
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+        return self
+
+    @property
+    def count(self) -> int:
+        """Number of observations"""
+        return sum(
+            len(items) << level for level, items in enumerate(self.levels)
+        )
+
+    def quantile(self, percentage: float) -> Optional[float]:
+        """
+        The smallest sample with at least ``percentage`` of observations
+        less or equal to it, like ``percentile_approx``.
+
+        :param percentage: percentage in ``[0, 1]``
+        """
+        items = np.concatenate(self.levels)
+        if len(items) == 0:
+            return None
+        weights = np.concatenate(
+            [
+                np.full(len(items), 1 << level)
+                for level, items in enumerate(self.levels)
+            ]
+        )
+        order = np.argsort(items, kind="stable")
+        ranks = np.cumsum(weights[order])
+        target = max(np.ceil(percentage * ranks[-1]), 1)
+        return float(items[order][np.searchsorted(ranks, target)])
+
+
+class MetricAccumulator:
+    """
+    Mergeable state of a metric for several cut-offs.
+    Per user values are folded into moments and quantile sketches,
+    so mean, median and confidence interval can be updated incrementally.
+
+    >>> from replay.metrics import HitRate
+    >>> day_one = pd.DataFrame({"user_id": [1], "item_id": [1], "relevance": [1]})
+    >>> day_two = pd.DataFrame({"user_id": [2], "item_id": [2], "relevance": [1]})
+    >>> acc = MetricAccumulator(HitRate(), [1, 2]).update(day_one, day_one)
+    >>> acc.update(day_two, day_one.assign(user_id=2)).mean()
+    {1: 0.5, 2: 0.5}
+    """
+
+    def __init__(
+        self,
+        metric: Metric,
+        k: IntOrList,
+        sketch_size: int = 200,
+        seed: Optional[int] = None,
+    ):
+        """
+        :param metric: metric with vectorized implementation
+        :param k: depth cut-off or a list of them
+        :param sketch_size: size of quantile sketches
+        :param seed: random seed for quantile sketches
+        """
+        if not metric._vectorized:
+            raise ValueError(
+                f"{metric} can't be accumulated, use CoverageAccumulator "
+                "for Coverage"
+            )
+        self.metric = metric
+        self.k = k
+        self.k_list = [k] if isinstance(k, int) else list(k)
+        self.sketch_size = sketch_size
+        self.seed = seed
+        self.moments = {k: MomentsAccumulator() for k in self.k_list}
+        self.sketches = {
+            k: QuantileSketch(sketch_size, seed) for k in self.k_list
+        }
+
+    def _columns(self) -> Dict[str, tuple]:
+        return {f"value_{k}": (self.metric, k) for k in self.k_list}
+
+    def add_values(self, k: int, values: Iterable[float]) -> None:
+        """
+        :param k: depth cut-off
+        :param values: metric values of new users
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.moments[k].update(values)
+        self.sketches[k].update(values)
+
+    def update(
+        self,
+        recommendations: AnyDataFrame,
+        ground_truth: Optional[AnyDataFrame] = None,
+    ) -> "MetricAccumulator":
+        """
+        Add a batch of users. Each user has to be in one batch only.
+
+        :param recommendations: model predictions
+        :param ground_truth: test data of the same users,
+            not used for ``RecOnlyMetric``
+        :return: self
+        """
+        frames = [recommendations]
+        if not isinstance(self.metric, RecOnlyMetric):
+            frames.append(ground_truth)
+        if self.metric._numpy_backend(*frames):
+            recs = self.metric._get_enriched_arrays(
+                recommendations, ground_truth
+            )
+            dist = get_metric_distributions(recs, self._columns())
+            for k in self.k_list:
+                self.add_values(k, dist[f"value_{k}"])
+            return self
+
+        if isinstance(self.metric, RecOnlyMetric):
+            recs = self.metric._get_enriched_recommendations(
+                recommendations, ground_truth
+            )
+        else:
+            recs = get_enriched_recommendations(recommendations, ground_truth)
+        k_list, sketch_size, seed = self.k_list, self.sketch_size, self.seed
+
+        def accumulate(
+            batches: Iterable[pd.DataFrame],
+        ) -> Iterable[pd.DataFrame]:
+            moments = {k: MomentsAccumulator() for k in k_list}
+            sketches = {k: QuantileSketch(sketch_size, seed) for k in k_list}
+            for batch in batches:
+                for k in k_list:
+                    moments[k].update(batch[f"value_{k}"])
+                    sketches[k].update(batch[f"value_{k}"])
+            yield pd.DataFrame({"state": [pickle.dumps((moments, sketches))]})
+
+        states = (
+            get_metric_distributions(recs, self._columns())
+            .mapInPandas(accumulate, "state binary")
+            .collect()
+        )
+        for row in states:
+            moments, sketches = pickle.loads(row["state"])
+            for k in self.k_list:
+                self.moments[k].merge(moments[k])
+                self.sketches[k].merge(sketches[k])
+        return self
+
+    def merge(self, other: "MetricAccumulator") -> "MetricAccumulator":
+        """
+        :param other: accumulator of the same metric and cut-offs
+        :return: self
+        """
+        if str(other.metric) != str(self.metric) or set(other.k_list) != set(
+            self.k_list
+        ):
+            raise ValueError(
+                "Accumulators of different metrics can't be merged"
+            )
+        for k in self.k_list:
+            self.moments[k].merge(other.moments[k])
+            self.sketches[k].merge(other.sketches[k])
+        return self
+
+    def _result(self, values: Dict[int, NumType]):
+        if isinstance(self.k, int):
+            return values[self.k]
+        return values
+
+    def mean(self) -> Union[Dict[int, NumType], NumType]:
+        """Metric value averaged by users"""
+        return self._result({k: self.moments[k].mean for k in self.k_list})
+
+    def median(self) -> Union[Dict[int, NumType], NumType]:
+        """Approximate median of user values"""
+        return self._result(
+            {k: self.sketches[k].quantile(0.5) for k in self.k_list}
+        )
+
+    def conf_interval(
+        self, alpha: float = 0.95
+    ) -> Union[Dict[int, NumType], NumType]:
+        """
+        :param alpha: quantile value
+        :return: half of the confidence interval
+        """
+        return self._result(
+            {k: self.moments[k].conf_interval(alpha) for k in self.k_list}
+        )
+
+
+class CoverageAccumulator:
+    """
+    Mergeable state of ``Coverage``. It keeps the best position of each
+    item in recommendation lists, which works as a bitset over items
+    for every cut-off at once.
+    """
+
+    def __init__(self, metric: Coverage, k: IntOrList):
+        """
+        :param metric: coverage metric with item catalogue
+        :param k: depth cut-off or a list of them
+        """
+        self.k = k
+        self.k_list = [k] if isinstance(k, int) else list(k)
+        self.item_count = metric.item_count
+        self.items = pd.Index(to_pandas(metric.items)["item_id"])
+        self.best_positions = np.full(
+            len(self.items), np.iinfo(np.int64).max, dtype=np.int64
+        )
+
+    def _add(self, items: pd.Series, positions: np.ndarray) -> None:
+        unknown = pd.unique(items[~items.isin(self.items)])
+        if len(unknown) > 0:
+            self.items = self.items.append(pd.Index(unknown))
+            self.best_positions = np.concatenate(
+                [
+                    self.best_positions,
+                    np.full(len(unknown), np.iinfo(np.int64).max),
+                ]
+            )
+        np.minimum.at(
+            self.best_positions, self.items.get_indexer(items), positions
+        )
+
+    def update(self, recommendations: AnyDataFrame) -> "CoverageAccumulator":
+        """
+        Add a batch of users. Each user has to be in one batch only.
+
+        :param recommendations: model predictions
+        :return: self
+        """
+        if isinstance(recommendations, DataFrame):
+            best = to_pandas(
+                Coverage._best_positions(convert2spark(recommendations))
+            )
+            self._add(best["item_id"], best["best_position"].to_numpy())
+            return self
+        recs = recommendations.sort_values(
+            "relevance", ascending=False, kind="stable"
+        )
+        positions = recs.groupby("user_id").cumcount().to_numpy() + 1
+        self._add(recs["item_id"], positions)
+        return self
+
+    def merge(self, other: "CoverageAccumulator") -> "CoverageAccumulator":
+        """
+        :param other: accumulator of the same catalogue
+        :return: self
+        """
+        self._add(pd.Series(other.items), other.best_positions)
+        return self
+
+    def mean(self) -> Union[Dict[int, NumType], NumType]:
+        """Coverage value"""
+        values = {
+            k: float((self.best_positions <= k).sum() / self.item_count)
+            for k in self.k_list
+        }
+        if isinstance(self.k, int):
+            return values[self.k]
+        return values
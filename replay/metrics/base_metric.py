@@ -3,15 +3,24 @@ Base classes for quality and diversity metrics.
 """
 import operator
 from abc import ABC, abstractmethod
-from typing import Dict, Union
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
-from pyspark.sql import DataFrame
+from pyspark.sql import Column, DataFrame
 from pyspark.sql import functions as sf
 from pyspark.sql import types as st
 from scipy.stats import norm
 
 from replay.constants import AnyDataFrame, IntOrList, NumType
+from replay.metrics import numpy_backend
+from replay.metrics.numpy_backend import (
+    EnrichedArrays,
+    contains,
+    fit_width,
+    get_enriched_arrays,
+    to_pandas,
+)
 from replay.utils import convert2spark
 
 
@@ -35,6 +44,186 @@ def sorter(items, index=1):
     return list_res
 
 
+BY_RELEVANCE = (
+    "(a, b) -> CASE WHEN a.relevance > b.relevance THEN -1 "
+    "WHEN a.relevance < b.relevance THEN 1 ELSE 0 END"
+)
+
+
+def get_sorted_lists(
+    recommendations: DataFrame, values: Optional[List[str]] = None
+) -> DataFrame:
+    """
+    Collect items of each user sorted by relevance in descending order
+    and keep the first occurrence of each item. Sorting is done once
+    natively with a stable ``array_sort`` on structs,
+    so ties keep the order of rows like in ``sorter``.
+
+    :param recommendations: ``[user_id, item_id, relevance, *values]``
+    :param values: columns to collect in the same order as items,
+        their values must be the same for all occurrences of an item
+    :return: ``[user_id, pred, *values]``
+    """
+    fields = ["item_id"] + (values or [])
+    entries = ", ".join(f"'{name}', {name}" for name in fields)
+    lists = (
+        "array_distinct(transform(array_sort(collect_list(named_struct("
+        f"'relevance', relevance, {entries})), {BY_RELEVANCE}), "
+        "x -> named_struct("
+        + ", ".join(f"'{name}', x.{name}" for name in fields)
+        + ")))"
+    )
+    return (
+        recommendations.groupby("user_id")
+        .agg(sf.expr(lists).alias("lists"))
+        .select(
+            "user_id",
+            sf.expr("transform(lists, x -> x.item_id)").alias("pred"),
+            *[
+                sf.expr(f"transform(lists, x -> x.{name})").alias(name)
+                for name in values or []
+            ],
+        )
+    )
+
+
+def to_matrix(values: pd.Series, width: int) -> np.ndarray:
+    """
+    Pack a column of arrays into a matrix padded with zeros.
+
+    >>> to_matrix(pd.Series([[1, 2], [3]]), 3)
+    array([[1, 2, 0],
+           [3, 0, 0]])
+
+    :param values: series of arrays no longer than ``width``
+    :param width: number of columns
+    :return: matrix with a row for each array
+    """
+    lengths = values.map(len).to_numpy()
+    flat = (
+        np.concatenate(values.to_list())
+        if lengths.sum() > 0
+        else np.array([])
+    )
+    matrix = np.zeros((len(values), width), dtype=flat.dtype)
+    matrix[np.arange(width) < lengths[:, None]] = flat
+    return matrix
+
+
+def get_metric_distributions(
+    recs: Union[DataFrame, EnrichedArrays],
+    columns: Dict[str, Tuple["Metric", int]],
+) -> AnyDataFrame:
+    """
+    Calculate per user values of several metrics in one pass
+    over Arrow batches of enriched recommendations.
+
+    :param recs: enriched recommendations shared by all metrics,
+        in-memory arrays are processed with numpy
+    :param columns: output column name mapped to ``(metric, k)``
+    :return: ``[user_id, *columns]``
+    """
+    if isinstance(recs, EnrichedArrays):
+        return numpy_backend.get_metric_distributions(recs, columns)
+    max_k = max(k for _, k in columns.values())
+    encoded = {}
+    calls = {}
+    for name, (metric, k) in columns.items():
+        encoding = metric._encode(max_k)
+        encoded.update(encoding)
+        # metric itself may hold DataFrames and is not serializable
+        calls[name] = (type(metric)._get_metric_values, k, list(encoding))
+
+    def calculate(batches: Iterable[pd.DataFrame]) -> Iterable[pd.DataFrame]:
+        for batch in batches:
+            arrays = {
+                name: to_matrix(batch[name], max_k)
+                if batch[name].dtype == object
+                else batch[name].to_numpy()
+                for name in encoded
+            }
+            result = pd.DataFrame({"user_id": batch["user_id"]})
+            for name, (func, k, args) in calls.items():
+                result[name] = func(
+                    k, **{arg: arrays[arg] for arg in args}
+                ).astype(np.float64)
+            yield result
+
+    user_type = recs.schema["user_id"].dataType.simpleString()
+    schema = ", ".join(
+        [f"user_id {user_type}"] + [f"`{name}` double" for name in columns]
+    )
+    return recs.select(
+        "user_id", *[column.alias(name) for name, column in encoded.items()]
+    ).mapInPandas(calculate, schema)
+
+
+MetricStatistics = Tuple[NumType, Optional[NumType], Optional[NumType]]
+
+
+def get_metric_statistics(
+    recs: Union[DataFrame, EnrichedArrays],
+    metrics: Dict["Metric", List[int]],
+    calc_median: bool = False,
+    calc_conf_interval: Optional[float] = None,
+) -> Dict[Tuple["Metric", int], MetricStatistics]:
+    """
+    Evaluation plan for several metrics sharing enriched recommendations.
+    Per user values for every ``(metric, k)`` pair are calculated
+    in one pass and all statistics are taken from a single aggregation.
+
+    :param recs: enriched recommendations
+    :param metrics: metric mapped to the list of depth cut-offs
+    :param calc_median: flag to calculate median value across users
+    :param calc_conf_interval: quantile value for the confidence interval
+    :return: ``(metric, k)`` mapped to ``(mean, median, conf_interval)``,
+        statistics that were not requested are ``None``
+    """
+    if isinstance(recs, EnrichedArrays):
+        return numpy_backend.get_metric_statistics(
+            recs, metrics, calc_median, calc_conf_interval
+        )
+    columns = {
+        f"value_{i}": pair
+        for i, pair in enumerate(
+            (metric, k) for metric, k_list in metrics.items() for k in k_list
+        )
+    }
+    stats = [sf.count("*").alias("count")]
+    for name in columns:
+        stats.append(sf.avg(name).alias(f"{name}_mean"))
+        if calc_median:
+            stats.append(
+                sf.expr(f"percentile_approx({name}, 0.5)").alias(
+                    f"{name}_median"
+                )
+            )
+        if calc_conf_interval is not None:
+            std = sf.stddev(name)
+            stats.append(
+                sf.when(sf.isnan(std), sf.lit(0.0))
+                .otherwise(std)
+                .cast("float")
+                .alias(f"{name}_std")
+            )
+    row = get_metric_distributions(recs, columns).agg(*stats).first()
+
+    res = {}
+    for name, pair in columns.items():
+        conf_interval = None
+        if calc_conf_interval is not None:
+            quantile = norm.ppf((1 + calc_conf_interval) / 2)
+            conf_interval = (
+                quantile * row[f"{name}_std"] / (row["count"] ** 0.5)
+            )
+        res[pair] = (
+            row[f"{name}_mean"],
+            row[f"{name}_median"] if calc_median else None,
+            conf_interval,
+        )
+    return res
+
+
 def get_enriched_recommendations(
     recommendations: AnyDataFrame, ground_truth: AnyDataFrame
 ) -> DataFrame:
@@ -51,15 +240,8 @@ def get_enriched_recommendations(
     true_items_by_users = ground_truth.groupby("user_id").agg(
         sf.collect_set("item_id").alias("ground_truth")
     )
-    sort_udf = sf.udf(
-        sorter,
-        returnType=st.ArrayType(ground_truth.schema["item_id"].dataType),
-    )
-    recommendations = (
-        recommendations.groupby("user_id")
-        .agg(sf.collect_list(sf.struct("relevance", "item_id")).alias("pred"))
-        .select("user_id", sort_udf(sf.col("pred")).alias("pred"))
-        .join(true_items_by_users, how="right", on=["user_id"])
+    recommendations = get_sorted_lists(recommendations).join(
+        true_items_by_users, how="right", on=["user_id"]
     )
 
     return recommendations.withColumn(
@@ -94,6 +276,10 @@ def process_k(func):
 class Metric(ABC):
     """Base metric class"""
 
+    #: calculate metric in memory with numpy,
+    #: by default it is used when all inputs are pandas DataFrames
+    use_numpy: Optional[bool] = None
+
     def __str__(self):
         return type(self).__name__
 
@@ -111,11 +297,46 @@ class Metric(ABC):
         :param k: depth cut-off. Truncates recommendation lists to top-k items.
         :return: metric value
         """
-        recs = get_enriched_recommendations(recommendations, ground_truth)
+        if self._numpy_backend(recommendations, ground_truth):
+            recs = self._get_enriched_arrays(recommendations, ground_truth)
+        else:
+            recs = get_enriched_recommendations(recommendations, ground_truth)
         return self._mean(recs, k)
 
+    def _numpy_backend(self, *data_frames: AnyDataFrame) -> bool:
+        """
+        :param data_frames: metric inputs
+        :return: whether metric should be calculated with numpy
+        """
+        if not self._vectorized:
+            return False
+        if self.use_numpy is None:
+            return all(
+                isinstance(data_frame, pd.DataFrame)
+                for data_frame in data_frames
+            )
+        return self.use_numpy
+
+    # pylint: disable=no-self-use
+    def _get_enriched_arrays(
+        self, recommendations: AnyDataFrame, ground_truth: AnyDataFrame
+    ) -> EnrichedArrays:
+        """
+        In-memory analogue of enriched recommendations for numpy backend.
+
+        :param recommendations: recommendation list
+        :param ground_truth: test data
+        :return: enriched arrays
+        """
+        return get_enriched_arrays(recommendations, ground_truth)
+
     @process_k
     def _conf_interval(self, recs: DataFrame, k_list: list, alpha: float):
+        if self._vectorized:
+            stats = get_metric_statistics(
+                recs, {self: k_list}, calc_conf_interval=alpha
+            )
+            return {k: stats[self, k][2] for k in k_list}
         res = {}
         quantile = norm.ppf((1 + alpha) / 2)
         for k in k_list:
@@ -139,6 +360,9 @@ class Metric(ABC):
 
     @process_k
     def _median(self, recs: DataFrame, k_list: list):
+        if self._vectorized:
+            stats = get_metric_statistics(recs, {self: k_list}, True)
+            return {k: stats[self, k][1] for k in k_list}
         res = {}
         for k in k_list:
             distribution = self._get_metric_distribution(recs, k)
@@ -150,6 +374,9 @@ class Metric(ABC):
 
     @process_k
     def _mean(self, recs: DataFrame, k_list: list):
+        if self._vectorized:
+            stats = get_metric_statistics(recs, {self: k_list})
+            return {k: stats[self, k][0] for k in k_list}
         res = {}
         for k in k_list:
             distribution = self._get_metric_distribution(recs, k)
@@ -165,6 +392,8 @@ class Metric(ABC):
         :param k: depth cut-off
         :return: metric distribution for different cut-offs and users
         """
+        if self._vectorized:
+            return get_metric_distributions(recs, {"value": (self, k)})
         cur_class = self.__class__
         distribution = recs.rdd.flatMap(
             # pylint: disable=protected-access
@@ -188,6 +417,56 @@ class Metric(ABC):
         :return: metric value for current user
         """
 
+    #: Vectorized metric calculation for a batch of users,
+    #: static method ``(k, **arrays) -> values of users``.
+    #: By default it receives ``hits`` matrix, showing whether
+    #: recommended item is relevant, and lengths of
+    #: recommendation lists ``pred_len`` and test lists ``gt_len``,
+    #: see ``_encode``. Metrics without it are calculated by user.
+    _get_metric_values: Optional[Callable[..., np.ndarray]] = None
+
+    @property
+    def _vectorized(self) -> bool:
+        """Whether metric implements ``_get_metric_values``"""
+        return type(self)._get_metric_values is not None
+
+    # pylint: disable=no-self-use
+    def _encode(self, max_k: int) -> Dict[str, Column]:
+        """
+        Columns of enriched recommendations passed to ``_get_metric_values``.
+        Arrays are padded with zeros to ``max_k`` elements.
+
+        :param max_k: the largest depth cut-off
+        :return: argument name mapped to a Spark column
+        """
+        return {
+            "hits": sf.expr(
+                f"transform(slice(pred, 1, {max_k}), "
+                "x -> array_contains(ground_truth, x))"
+            ),
+            "pred_len": sf.size("pred"),
+            "gt_len": sf.size("ground_truth"),
+        }
+
+    # pylint: disable=no-self-use
+    def _encode_arrays(
+        self, recs: EnrichedArrays, max_k: int
+    ) -> Dict[str, np.ndarray]:
+        """
+        Numpy analogue of ``_encode``.
+
+        :param recs: enriched arrays
+        :param max_k: the largest depth cut-off
+        :return: arguments of ``_get_metric_values``
+        """
+        return {
+            "hits": contains(
+                recs["ground_truth"], fit_width(recs["pred"], max_k, -1)
+            ),
+            "pred_len": recs["pred_len"],
+            "gt_len": recs["gt_len"],
+        }
+
     def user_distribution(
         self,
         log: AnyDataFrame,
@@ -204,6 +483,14 @@ class Metric(ABC):
         :param k: depth cut-off
         :return: pandas DataFrame
         """
+        if isinstance(k, int):
+            k_list = [k]
+        else:
+            k_list = k
+        if self._numpy_backend(log, recommendations, ground_truth):
+            return self._user_distribution_numpy(
+                log, recommendations, ground_truth, k_list
+            )
         log = convert2spark(log)
         count = log.groupBy("user_id").count()
         if hasattr(self, "_get_enriched_recommendations"):
@@ -212,10 +499,6 @@ class Metric(ABC):
             )
         else:
             recs = get_enriched_recommendations(recommendations, ground_truth)
-        if isinstance(k, int):
-            k_list = [k]
-        else:
-            k_list = k
         res = pd.DataFrame()
         for cut_off in k_list:
             dist = self._get_metric_distribution(recs, cut_off)
@@ -230,6 +513,28 @@ class Metric(ABC):
             res = res.append(val, ignore_index=True)
         return res
 
+    def _user_distribution_numpy(
+        self,
+        log: AnyDataFrame,
+        recommendations: AnyDataFrame,
+        ground_truth: AnyDataFrame,
+        k_list: list,
+    ) -> pd.DataFrame:
+        """Numpy version of ``user_distribution``"""
+        count = to_pandas(log).groupby("user_id").size().rename("count")
+        recs = self._get_enriched_arrays(recommendations, ground_truth)
+        res = pd.DataFrame()
+        for cut_off in k_list:
+            dist = self._get_metric_distribution(recs, cut_off)
+            val = (
+                dist.join(count, on="user_id", how="inner")
+                .groupby("count", as_index=False)["value"]
+                .mean()
+                .sort_values("count")[["count", "value"]]
+            )
+            res = res.append(val, ignore_index=True)
+        return res
+
 
 # pylint: disable=too-few-public-methods
 class RecOnlyMetric(Metric):
@@ -246,6 +551,24 @@ class RecOnlyMetric(Metric):
     ) -> DataFrame:
         pass
 
+    # pylint: disable=no-self-use
+    def _item_values(self) -> Optional[DataFrame]:
+        """
+        Values the metric needs for each recommended item.
+
+        :return: ``[item_id, value]`` or ``None``
+        """
+        return None
+
+    def _get_enriched_view(self, cache: "EnrichmentCache") -> DataFrame:
+        """
+        Enriched recommendations made from a shared cache.
+
+        :param cache: enrichment shared by several metrics
+        :return: same DataFrame as ``_get_enriched_recommendations``
+        """
+        return self._get_enriched_recommendations(cache.recommendations, None)
+
     def __call__(  # type: ignore
         self, recommendations: AnyDataFrame, k: IntOrList
     ) -> Union[Dict[int, NumType], NumType]:
@@ -255,7 +578,10 @@ class RecOnlyMetric(Metric):
         :param k: depth cut-off
         :return: metric value
         """
-        recs = self._get_enriched_recommendations(recommendations, None)
+        if self._numpy_backend(recommendations):
+            recs = self._get_enriched_arrays(recommendations, None)
+        else:
+            recs = self._get_enriched_recommendations(recommendations, None)
         return self._mean(recs, k)
 
     @staticmethod
@@ -269,3 +595,76 @@ class RecOnlyMetric(Metric):
             '''self._get_enriched_recommendations''' method
         :return: metric value for current user
         """
+
+
+class EnrichmentCache:
+    """
+    Enriched recommendations of several ``RecOnlyMetric`` made
+    from one cached frame. Per item values of all metrics are attached
+    with broadcast joins, and user lists are sorted once for all of them.
+    """
+
+    def __init__(
+        self,
+        recommendations: AnyDataFrame,
+        metrics: Iterable[RecOnlyMetric],
+        cache: bool = True,
+    ):
+        """
+        :param recommendations: predictions of a model,
+            DataFrame  ``[user_id, item_id, relevance]``
+        :param metrics: metrics to share enrichment
+        :param cache: flag to cache shared frames,
+            the frame of ``recommendations`` itself is never cached
+            or unpersisted as it may belong to the caller
+        """
+        self.recommendations = convert2spark(recommendations).select(
+            "user_id", "item_id", "relevance"
+        )
+        self.cache = cache
+        if cache:
+            self.recommendations = self.recommendations.cache()
+        self._columns: Dict[RecOnlyMetric, str] = {}
+        self._joined = self.recommendations
+        for metric in metrics:
+            item_values = metric._item_values()
+            if item_values is not None:
+                name = f"value_{len(self._columns)}"
+                self._joined = self._joined.join(
+                    sf.broadcast(item_values.toDF("item_id", name)),
+                    on="item_id",
+                    how="left",
+                )
+                self._columns[metric] = name
+        self._lists: Optional[DataFrame] = None
+
+    @property
+    def lists(self) -> DataFrame:
+        """
+        User lists ``[user_id, pred, *values]`` sorted by relevance,
+        values of a metric are in the column ``self.values(metric)``
+        """
+        if self._lists is None:
+            self._lists = get_sorted_lists(
+                self._joined, list(self._columns.values())
+            )
+            if self.cache:
+                self._lists = self._lists.cache()
+        return self._lists
+
+    def values(self, metric: RecOnlyMetric) -> str:
+        """
+        :param metric: metric that provided ``_item_values``
+        :return: column of ``self.lists`` with its values
+        """
+        return self._columns[metric]
+
+    def __getitem__(self, metric: RecOnlyMetric) -> DataFrame:
+        return metric._get_enriched_view(self)
+
+    def unpersist(self) -> None:
+        """Remove cached frames"""
+        if self._lists is not None:
+            self._lists.unpersist()
+        if self.cache:
+            self.recommendations.unpersist()
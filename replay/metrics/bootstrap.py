@@ -0,0 +1,114 @@
+"""
+Bootstrap of metrics averaged by users.
+Per user values are collected once as float32 matrices
+and resampled in memory with Poisson or multinomial weights.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+#: upper limit of weight matrix elements generated at once
+MAX_WEIGHTS = 2 ** 25
+
+
+def bootstrap_weights(
+    n_users: int, n_samples: int, method: str, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Weights of users in bootstrap samples.
+
+    :param n_users: number of users
+    :param n_samples: number of bootstrap samples
+    :param method: ``poisson`` for Poisson(1) weights or
+        ``multinomial`` for the classic resampling with replacement
+    :param rng: random generator
+    :return: float32 matrix ``n_samples x n_users``
+    """
+    if method == "poisson":
+        return rng.poisson(1.0, (n_samples, n_users)).astype(np.float32)
+    if method == "multinomial":
+        draws = rng.integers(0, n_users, (n_samples, n_users))
+        return np.stack(
+            [np.bincount(row, minlength=n_users) for row in draws]
+        ).astype(np.float32)
+    raise ValueError(f"Unknown bootstrap method {method}")
+
+
+def bootstrap_means(
+    values: np.ndarray,
+    n_samples: int = 1000,
+    method: str = "poisson",
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Means of bootstrap samples for each column.
+    Missing values are skipped.
+
+    >>> values = np.array([[0.0, 1.0], [1.0, np.nan], [1.0, 1.0]])
+    >>> samples = bootstrap_means(values, 5, seed=0)
+    >>> samples.shape
+    (5, 2)
+    >>> samples[:, 1]
+    array([1., 1., 1., 1., 1.], dtype=float32)
+
+    :param values: per user values ``n_users x n_columns``
+    :param n_samples: number of bootstrap samples
+    :param method: ``poisson`` or ``multinomial``
+    :param seed: random seed
+    :return: float32 matrix ``n_samples x n_columns``
+    """
+    values = np.asarray(values, dtype=np.float32)
+    present = (~np.isnan(values)).astype(np.float32)
+    values = np.nan_to_num(values)
+    rng = np.random.default_rng(seed)
+    batch_size = max(1, min(n_samples, MAX_WEIGHTS // max(len(values), 1)))
+    res = []
+    for start in range(0, n_samples, batch_size):
+        weights = bootstrap_weights(
+            len(values), min(batch_size, n_samples - start), method, rng
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            res.append((weights @ values) / (weights @ present))
+    return np.concatenate(res)
+
+
+def percentile_interval(
+    samples: np.ndarray, alpha: float = 0.95
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param samples: bootstrap means ``n_samples x n_columns``
+    :param alpha: confidence level
+    :return: lower and upper bounds for each column
+    """
+    low, high = np.nanquantile(
+        samples, [(1 - alpha) / 2, (1 + alpha) / 2], axis=0
+    )
+    return low, high
+
+
+def paired_p_values(
+    baseline: np.ndarray,
+    model: np.ndarray,
+    n_samples: int = 1000,
+    method: str = "poisson",
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Two-sided p-values of mean differences between two models
+    evaluated on the same users. The same users are resampled
+    for both models, and bootstrap differences are centered
+    at the observed difference.
+
+    :param baseline: per user values of baseline ``n_users x n_columns``
+    :param model: per user values of model for the same users
+    :param n_samples: number of bootstrap samples
+    :param method: ``poisson`` or ``multinomial``
+    :param seed: random seed
+    :return: p-value for each column
+    """
+    diff = np.asarray(model, dtype=np.float32) - np.asarray(
+        baseline, dtype=np.float32
+    )
+    observed = np.nanmean(diff, axis=0)
+    samples = bootstrap_means(diff, n_samples, method, seed)
+    return np.mean(np.abs(samples - observed) >= np.abs(observed), axis=0)
@@ -72,7 +72,25 @@ class Coverage(RecOnlyMetric):
                 "The resulting metric value can be more than 1.0 ¯\_(ツ)_/¯"
             )
 
-        best_positions = (
+        best_positions = self._best_positions(recs)
+        counts = best_positions.agg(
+            *[
+                sf.sum((sf.col("best_position") <= k).cast("long")).alias(
+                    str(k)
+                )
+                for k in k_list
+            ]
+        ).first()
+        return {k: (counts[str(k)] or 0) / self.item_count for k in k_list}
+
+    @staticmethod
+    def _best_positions(recs: DataFrame) -> DataFrame:
+        """
+        :param recs: recommendations
+        :return: the best position of each item
+            in recommendation lists ``[item_id, best_position]``
+        """
+        return (
             recs.withColumn(
                 "row_num",
                 sf.row_number().over(
@@ -82,17 +100,4 @@ class Coverage(RecOnlyMetric):
             .select("item_id", "row_num")
             .groupBy("item_id")
             .agg(sf.min("row_num").alias("best_position"))
-            .cache()
         )
-
-        res = {}
-        for current_k in k_list:
-            res[current_k] = (
-                best_positions.filter(
-                    sf.col("best_position") <= current_k
-                ).count()
-                / self.item_count
-            )
-
-        best_positions.unpersist()
-        return res
@@ -23,3 +23,8 @@ class HitRate(Metric):
             if i in ground_truth:
                 return 1
         return 0
+
+    # pylint: disable=arguments-differ, unused-argument
+    @staticmethod
+    def _get_metric_values(k, hits, pred_len, gt_len):
+        return hits[:, :k].astype(bool).any(axis=1)
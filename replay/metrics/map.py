@@ -1,3 +1,5 @@
+import numpy as np
+
 from replay.metrics.base_metric import Metric
 
 
@@ -28,3 +30,14 @@ class MAP(Metric):
                 tp_cum += 1
                 result += tp_cum / ((i + 1) * max_good)
         return result
+
+    # pylint: disable=arguments-differ, unused-argument
+    @staticmethod
+    def _get_metric_values(k, hits, pred_len, gt_len):
+        hits = hits[:, :k].astype(bool)
+        max_good = np.maximum(np.minimum(k, gt_len), 1)[:, None]
+        precision = np.cumsum(hits, axis=1) / (
+            np.arange(1, hits.shape[1] + 1) * max_good
+        )
+        result = np.cumsum(np.where(hits, precision, 0.0), axis=1)[:, -1]
+        return np.where((gt_len == 0) | (pred_len == 0), 0, result)
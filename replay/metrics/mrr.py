@@ -1,3 +1,5 @@
+import numpy as np
+
 from replay.metrics.base_metric import Metric
 
 
@@ -25,3 +27,11 @@ class MRR(Metric):
             if pred[i] in ground_truth:
                 return 1 / (1 + i)
         return 0
+
+    # pylint: disable=arguments-differ, unused-argument
+    @staticmethod
+    def _get_metric_values(k, hits, pred_len, gt_len):
+        hits = hits[:, :k].astype(bool)
+        return np.where(
+            hits.any(axis=1), 1 / (1 + np.argmax(hits, axis=1)), 0
+        )
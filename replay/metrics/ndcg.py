@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 from replay.metrics.base_metric import Metric
 
 
@@ -57,3 +59,11 @@ class NDCG(Metric):
         idcg = sum(denom[:ground_truth_len])
 
         return dcg / idcg
+
+    # pylint: disable=arguments-differ, unused-argument
+    @staticmethod
+    def _get_metric_values(k, hits, pred_len, gt_len):
+        denom = np.array([1 / math.log2(i + 2) for i in range(k)])
+        dcg = np.cumsum(hits[:, :k].astype(bool) * denom, axis=1)[:, -1]
+        idcg = np.concatenate([[0.0], np.cumsum(denom)])
+        return dcg / idcg[np.minimum(k, gt_len)]
@@ -0,0 +1,290 @@
+"""
+In-memory metric calculation for pandas inputs.
+Recommendations and ground truth are encoded as per user lists
+padded into numpy matrices and metrics are calculated
+with the same vectorized functions that Spark runs in Arrow batches.
+"""
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pyspark.sql import DataFrame
+from scipy.stats import norm
+
+from replay.constants import AnyDataFrame
+
+
+# pylint: disable=too-few-public-methods
+class EnrichedArrays:
+    """
+    Enriched recommendations kept in memory.
+    Lists of item codes are padded with ``-1``, lists of values with zeros.
+    """
+
+    def __init__(self, user_id: np.ndarray, **arrays: np.ndarray):
+        """
+        :param user_id: user of each row
+        :param arrays: per user matrices and vectors
+        """
+        self.user_id = user_id
+        self.arrays = arrays
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+
+def to_pandas(data_frame: AnyDataFrame) -> pd.DataFrame:
+    """
+    :param data_frame: pandas or Spark DataFrame
+    :return: pandas DataFrame
+    """
+    if isinstance(data_frame, DataFrame):
+        return data_frame.toPandas()
+    return data_frame
+
+
+def fit_width(matrix: np.ndarray, width: int, fill=0) -> np.ndarray:
+    """
+    Truncate or pad matrix columns to ``width``.
+
+    >>> fit_width(np.array([[1], [2]]), 3, -1)
+    array([[ 1, -1, -1],
+           [ 2, -1, -1]])
+    """
+    if matrix.shape[1] >= width:
+        return matrix[:, :width]
+    padding = np.full(
+        (matrix.shape[0], width - matrix.shape[1]), fill, dtype=matrix.dtype
+    )
+    return np.hstack([matrix, padding])
+
+
+def pad_groups(
+    rows: np.ndarray, values: np.ndarray, row_count: int, fill=0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack values grouped by rows into a padded matrix.
+
+    :param rows: row of each value, values of a row keep their order
+    :param values: values to pack
+    :param row_count: number of rows
+    :param fill: padding value
+    :return: matrix and number of values in each row
+    """
+    order = np.argsort(rows, kind="stable")
+    rows = rows[order]
+    lengths = np.bincount(rows, minlength=row_count)
+    starts = np.cumsum(lengths) - lengths
+    cols = np.arange(len(rows)) - np.repeat(starts, lengths)
+    matrix = np.full(
+        (row_count, lengths.max(initial=0)), fill, dtype=values.dtype
+    )
+    matrix[rows, cols] = values[order]
+    return matrix, lengths
+
+
+def sorted_lists(
+    recommendations: pd.DataFrame, users: pd.Index, value: str, fill=0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Analogue of ``get_sorted_lists``: per user lists of ``value``
+    sorted by relevance in descending order without duplicate items.
+    Sorting is stable, so ties keep the order of rows.
+
+    :param recommendations: ``[user_id, item_id, relevance, value]``
+    :param users: users to make lists for, others are skipped
+    :param value: column to take values from
+    :param fill: padding value
+    :return: matrix of values and list lengths
+    """
+    recs = (
+        recommendations[recommendations["user_id"].isin(users)]
+        .sort_values("relevance", ascending=False, kind="stable")
+        .drop_duplicates(["user_id", "item_id"])
+    )
+    return pad_groups(
+        users.get_indexer(recs["user_id"]),
+        recs[value].to_numpy(),
+        len(users),
+        fill,
+    )
+
+
+def _row_keys(
+    lists: np.ndarray, values: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    size = max(lists.max(initial=-1), values.max(initial=-1)) + 2
+    offsets = np.arange(len(lists), dtype=np.int64)[:, None] * size
+    return lists + offsets, values + offsets
+
+
+def contains(lists: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Check whether ``values[i, j]`` is present in ``lists[i]``.
+
+    >>> contains(np.array([[1, 2], [3, -1]]), np.array([[2, 3], [3, -1]]))
+    array([[ True, False],
+           [ True, False]])
+
+    :param lists: item codes padded with ``-1``
+    :param values: item codes padded with ``-1``
+    :return: boolean matrix shaped as ``values``
+    """
+    list_keys, value_keys = _row_keys(lists, values)
+    return np.isin(value_keys, list_keys[lists >= 0]) & (values >= 0)
+
+
+def positions(lists: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Analogue of ``array_position``: one-based position
+    of ``values[i, j]`` in ``lists[i]`` or zero if it is absent.
+
+    >>> positions(np.array([[1, 2], [3, -1]]), np.array([[2, 3], [3, -1]]))
+    array([[2, 0],
+           [1, 0]])
+
+    :param lists: item codes padded with ``-1``, without duplicates
+    :param values: item codes padded with ``-1``
+    :return: integer matrix shaped as ``values``
+    """
+    list_keys, value_keys = _row_keys(lists, values)
+    present = lists >= 0
+    keys = list_keys[present]
+    if len(keys) == 0:
+        return np.zeros(values.shape, dtype=np.int64)
+    places = np.nonzero(present)[1] + 1
+    order = np.argsort(keys)
+    keys, places = keys[order], places[order]
+    idx = np.minimum(np.searchsorted(keys, value_keys), len(keys) - 1)
+    found = (keys[idx] == value_keys) & (values >= 0)
+    return np.where(found, places[idx], 0)
+
+
+def get_enriched_arrays(
+    recommendations: AnyDataFrame, ground_truth: AnyDataFrame
+) -> EnrichedArrays:
+    """
+    Analogue of ``get_enriched_recommendations``
+    with items encoded as integer codes.
+
+    :param recommendations: recommendation list
+    :param ground_truth: test data
+    :return: arrays ``pred``, ``pred_len``, ``ground_truth``, ``gt_len``
+    """
+    recommendations = to_pandas(recommendations)
+    ground_truth = to_pandas(ground_truth)
+    users = pd.Index(pd.unique(ground_truth["user_id"]))
+    items = pd.Index(
+        pd.unique(
+            pd.concat([ground_truth["item_id"], recommendations["item_id"]])
+        )
+    )
+    pred, pred_len = sorted_lists(
+        recommendations.assign(
+            code=items.get_indexer(recommendations["item_id"])
+        ),
+        users,
+        "code",
+        -1,
+    )
+    true_items = ground_truth[["user_id", "item_id"]].drop_duplicates()
+    true_matrix, gt_len = pad_groups(
+        users.get_indexer(true_items["user_id"]),
+        items.get_indexer(true_items["item_id"]),
+        len(users),
+        -1,
+    )
+    return EnrichedArrays(
+        users.to_numpy(),
+        pred=pred,
+        pred_len=pred_len,
+        ground_truth=true_matrix,
+        gt_len=gt_len,
+    )
+
+
+def get_metric_distributions(
+    recs: EnrichedArrays, columns: Dict[str, tuple]
+) -> pd.DataFrame:
+    """
+    Analogue of ``base_metric.get_metric_distributions``.
+
+    :param recs: enriched arrays shared by all metrics
+    :param columns: output column name mapped to ``(metric, k)``
+    :return: ``[user_id, *columns]``
+    """
+    max_k = max(k for _, k in columns.values())
+    encoded = {}
+    res = pd.DataFrame({"user_id": recs.user_id})
+    for name, (metric, k) in columns.items():
+        if metric not in encoded:
+            encoded[metric] = metric._encode_arrays(recs, max_k)
+        res[name] = metric._get_metric_values(k, **encoded[metric]).astype(
+            np.float64
+        )
+    return res
+
+
+def percentile_approx(
+    values: np.ndarray, percentage: float
+) -> Optional[float]:
+    """
+    Value returned by Spark ``percentile_approx`` with default accuracy.
+    It is exact while there are less than 10000 values.
+
+    >>> percentile_approx(np.array([4.0, 1.0, 3.0, 2.0]), 0.5)
+    2.0
+
+    :param values: sample
+    :param percentage: percentage in ``[0, 1]``
+    :return: the smallest value with at least ``percentage``
+        of the sample less or equal to it
+    """
+    if len(values) == 0:
+        return None
+    rank = max(math.ceil(percentage * len(values)), 1)
+    return float(np.sort(values)[rank - 1])
+
+
+def get_metric_statistics(
+    recs: EnrichedArrays,
+    metrics: dict,
+    calc_median: bool = False,
+    calc_conf_interval: Optional[float] = None,
+) -> dict:
+    """
+    Analogue of ``base_metric.get_metric_statistics``.
+
+    :param recs: enriched arrays
+    :param metrics: metric mapped to the list of depth cut-offs
+    :param calc_median: flag to calculate median value across users
+    :param calc_conf_interval: quantile value for the confidence interval
+    :return: ``(metric, k)`` mapped to ``(mean, median, conf_interval)``
+    """
+    columns = {
+        f"value_{i}": pair
+        for i, pair in enumerate(
+            (metric, k) for metric, k_list in metrics.items() for k in k_list
+        )
+    }
+    dist = get_metric_distributions(recs, columns)
+    res = {}
+    for name, pair in columns.items():
+        values = dist[name].to_numpy()
+        median = None
+        if calc_median:
+            median = percentile_approx(values, 0.5)
+        conf_interval = None
+        if calc_conf_interval is not None and len(values) > 0:
+            std = values.std(ddof=1) if len(values) > 1 else 0.0
+            quantile = norm.ppf((1 + calc_conf_interval) / 2)
+            conf_interval = (
+                quantile * float(np.float32(std)) / (len(values) ** 0.5)
+            )
+        res[pair] = (
+            float(values.mean()) if len(values) else None,
+            median,
+            conf_interval,
+        )
+    return res
@@ -1,3 +1,5 @@
+import numpy as np
+
 from replay.metrics.base_metric import Metric
 
 
@@ -19,3 +21,11 @@ class Precision(Metric):
         if len(pred) == 0:
             return 0
         return len(set(pred[:k]) & set(ground_truth)) / len(pred[:k])
+
+    # pylint: disable=arguments-differ, unused-argument
+    @staticmethod
+    def _get_metric_values(k, hits, pred_len, gt_len):
+        tp = hits[:, :k].astype(bool).sum(axis=1)
+        return np.where(
+            pred_len == 0, 0, tp / np.maximum(np.minimum(k, pred_len), 1)
+        )
@@ -20,3 +20,8 @@ class Recall(Metric):
     @staticmethod
     def _get_metric_value_by_user(k, pred, ground_truth) -> float:
         return len(set(pred[:k]) & set(ground_truth)) / len(ground_truth)
+
+    # pylint: disable=arguments-differ, unused-argument
+    @staticmethod
+    def _get_metric_values(k, hits, pred_len, gt_len):
+        return hits[:, :k].astype(bool).sum(axis=1) / gt_len
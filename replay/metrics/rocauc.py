@@ -1,3 +1,5 @@
+import numpy as np
+
 from replay.metrics.base_metric import Metric
 
 
@@ -58,3 +60,16 @@ class RocAuc(Metric):
         if fp_cum == 0:
             return 1
         return 1 - fp_cum / (fp_cur * (length - fp_cur))
+
+    # pylint: disable=arguments-differ, unused-argument
+    @staticmethod
+    def _get_metric_values(k, hits, pred_len, gt_len):
+        hits = hits[:, :k].astype(bool)
+        length = np.minimum(k, pred_len)
+        misses_before = np.cumsum(~hits, axis=1) - ~hits
+        fp_cum = np.where(hits, misses_before, 0).sum(axis=1)
+        fp_cur = length - hits.sum(axis=1)
+        result = 1 - fp_cum / np.maximum(fp_cur * (length - fp_cur), 1)
+        result = np.where(fp_cum == 0, 1.0, result)
+        result = np.where(fp_cur == length, 0.0, result)
+        return np.where((gt_len == 0) | (pred_len == 0), 0.0, result)
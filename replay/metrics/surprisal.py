@@ -1,13 +1,17 @@
-from functools import partial
-
 import numpy as np
+import pandas as pd
 from pyspark.sql import DataFrame
 from pyspark.sql import functions as sf
-from pyspark.sql import types as st
 
 from replay.constants import AnyDataFrame
 from replay.utils import convert2spark
-from replay.metrics.base_metric import RecOnlyMetric, sorter
+from replay.metrics.base_metric import EnrichmentCache, RecOnlyMetric
+from replay.metrics.numpy_backend import (
+    EnrichedArrays,
+    fit_width,
+    sorted_lists,
+    to_pandas,
+)
 
 
 # pylint: disable=too-few-public-methods
@@ -56,6 +60,7 @@ class Surprisal(RecOnlyMetric):
                 / np.log2(n_users)
             ).alias("rec_weight")
         )
+        self._pandas_weights = None
 
     @staticmethod
     def _get_metric_value_by_user(k, *args):
@@ -65,21 +70,40 @@ class Surprisal(RecOnlyMetric):
     def _get_enriched_recommendations(
         self, recommendations: DataFrame, ground_truth: DataFrame
     ) -> DataFrame:
-        recommendations = convert2spark(recommendations)
-        sort_udf = sf.udf(
-            partial(sorter, index=2),
-            returnType=st.ArrayType(st.DoubleType()),
+        return self._get_enriched_view(
+            EnrichmentCache(recommendations, [self], cache=False)
         )
-        return (
-            recommendations.join(self.item_weights, on="item_id", how="left")
+
+    def _item_values(self):
+        return self.item_weights
+
+    def _get_enriched_view(self, cache):
+        return cache.lists.select(
+            "user_id",
+            sf.expr(
+                f"transform({cache.values(self)}, x -> coalesce(x, 1D))"
+            ).alias("rec_weight"),
+        )
+
+    def _get_enriched_arrays(self, recommendations, ground_truth):
+        if self._pandas_weights is None:
+            self._pandas_weights = self.item_weights.toPandas()
+        recommendations = (
+            to_pandas(recommendations)
+            .merge(self._pandas_weights, on="item_id", how="left")
             .fillna(1)
-            .groupby("user_id")
-            .agg(
-                sf.collect_list(
-                    sf.struct("relevance", "item_id", "rec_weight")
-                ).alias("rec_weight")
-            )
-            .select(
-                "user_id", sort_udf(sf.col("rec_weight")).alias("rec_weight")
-            )
         )
+        users = pd.Index(pd.unique(recommendations["user_id"]))
+        rec_weight, _ = sorted_lists(recommendations, users, "rec_weight")
+        return EnrichedArrays(users.to_numpy(), rec_weight=rec_weight)
+
+    def _encode_arrays(self, recs, max_k):
+        return {"weights": fit_width(recs["rec_weight"], max_k)}
+
+    def _encode(self, max_k):
+        return {"weights": sf.slice("rec_weight", 1, max_k)}
+
+    # pylint: disable=arguments-differ
+    @staticmethod
+    def _get_metric_values(k, weights):
+        return np.cumsum(weights[:, :k], axis=1)[:, -1] / k
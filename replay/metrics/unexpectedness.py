@@ -1,10 +1,23 @@
+import numpy as np
+import pandas as pd
 from pyspark.sql import DataFrame
 from pyspark.sql import functions as sf
 from pyspark.sql import types as st
 
 from replay.constants import AnyDataFrame
 from replay.utils import convert2spark
-from replay.metrics.base_metric import RecOnlyMetric, sorter
+from replay.metrics.base_metric import (
+    EnrichmentCache,
+    RecOnlyMetric,
+    get_sorted_lists,
+)
+from replay.metrics.numpy_backend import (
+    EnrichedArrays,
+    fit_width,
+    positions,
+    sorted_lists,
+    to_pandas,
+)
 
 
 # pylint: disable=too-few-public-methods
@@ -31,6 +44,8 @@ class Unexpectedness(RecOnlyMetric):
         :param pred: model predictions
         """
         self.pred = convert2spark(pred)
+        self._pandas_pred = pred if isinstance(pred, pd.DataFrame) else None
+        self._base_recs = None
 
     @staticmethod
     def _get_metric_value_by_user(k, *args) -> float:
@@ -43,40 +58,78 @@ class Unexpectedness(RecOnlyMetric):
     def _get_enriched_recommendations(
         self, recommendations: DataFrame, ground_truth: DataFrame
     ) -> DataFrame:
-        recommendations = convert2spark(recommendations)
-        base_pred = self.pred
-        sort_udf = sf.udf(
-            sorter,
-            returnType=st.ArrayType(base_pred.schema["item_id"].dataType),
-        )
-        base_recs = (
-            base_pred.groupby("user_id")
-            .agg(
-                sf.collect_list(sf.struct("relevance", "item_id")).alias(
-                    "base_pred"
-                )
-            )
-            .select(
-                "user_id", sort_udf(sf.col("base_pred")).alias("base_pred")
-            )
+        return self._get_enriched_view(
+            EnrichmentCache(recommendations, [self], cache=False)
         )
 
-        recommendations = (
-            recommendations.groupby("user_id")
-            .agg(
-                sf.collect_list(sf.struct("relevance", "item_id")).alias(
-                    "pred"
-                )
+    def _get_enriched_view(self, cache):
+        if self._base_recs is None:
+            self._base_recs = get_sorted_lists(self.pred).withColumnRenamed(
+                "pred", "base_pred"
             )
-            .select("user_id", sort_udf(sf.col("pred")).alias("pred"))
-            .join(base_recs, how="right", on=["user_id"])
+        recommendations = cache.lists.select("user_id", "pred").join(
+            self._base_recs, how="right", on=["user_id"]
         )
         return recommendations.withColumn(
             "pred",
             sf.coalesce(
                 "pred",
                 sf.array().cast(
-                    st.ArrayType(base_pred.schema["item_id"].dataType)
+                    st.ArrayType(self.pred.schema["item_id"].dataType)
                 ),
             ),
         )
+
+    def _get_enriched_arrays(self, recommendations, ground_truth):
+        if self._pandas_pred is None:
+            self._pandas_pred = self.pred.toPandas()
+        base_pred = self._pandas_pred
+        recommendations = to_pandas(recommendations)
+        users = pd.Index(pd.unique(base_pred["user_id"]))
+        items = pd.Index(
+            pd.unique(
+                pd.concat([base_pred["item_id"], recommendations["item_id"]])
+            )
+        )
+        pred, pred_len = sorted_lists(
+            recommendations.assign(
+                code=items.get_indexer(recommendations["item_id"])
+            ),
+            users,
+            "code",
+            -1,
+        )
+        base, _ = sorted_lists(
+            base_pred.assign(code=items.get_indexer(base_pred["item_id"])),
+            users,
+            "code",
+            -1,
+        )
+        return EnrichedArrays(
+            users.to_numpy(), pred=pred, pred_len=pred_len, base_pred=base
+        )
+
+    def _encode_arrays(self, recs, max_k):
+        return {
+            "base_pos": positions(
+                fit_width(recs["base_pred"], max_k, -1),
+                fit_width(recs["pred"], max_k, -1),
+            ),
+            "pred_len": recs["pred_len"],
+        }
+
+    def _encode(self, max_k):
+        return {
+            "base_pos": sf.expr(
+                f"transform(slice(pred, 1, {max_k}), "
+                f"x -> array_position(slice(base_pred, 1, {max_k}), x))"
+            ),
+            "pred_len": sf.size("pred"),
+        }
+
+    # pylint: disable=arguments-differ
+    @staticmethod
+    def _get_metric_values(k, base_pos, pred_len):
+        base_pos = base_pos[:, :k]
+        common = ((base_pos >= 1) & (base_pos <= k)).sum(axis=1)
+        return np.where(pred_len == 0, 0, 1.0 - common / k)
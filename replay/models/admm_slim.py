@@ -2,12 +2,11 @@ from typing import Optional, Tuple
 
 import numba as nb
 import numpy as np
-import pandas as pd
 from pyspark.sql import DataFrame
-from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse import coo_matrix
 
+from replay.arrow_transfer import sparse_to_spark
 from replay.models.base_rec import NeighbourRec
-from replay.session_handler import State
 
 
 # pylint: disable=too-many-arguments, too-many-locals
@@ -122,14 +121,7 @@ class ADMMSLIM(NeighbourRec):
         item_features: Optional[DataFrame] = None,
     ) -> None:
         self.logger.debug("Fitting ADMM SLIM")
-        pandas_log = log.select("user_idx", "item_idx", "relevance").toPandas()
-        interactions_matrix = csr_matrix(
-            (
-                pandas_log["relevance"],
-                (pandas_log["user_idx"], pandas_log["item_idx"]),
-            ),
-            shape=(self.users_count, self.items_count),
-        )
+        interactions_matrix = self._interaction_matrix(log).csr
         self.logger.debug("Gram matrix")
         xtx = (interactions_matrix.T @ interactions_matrix).toarray()
         self.logger.debug("Inverse matrix")
@@ -177,17 +169,8 @@ class ADMMSLIM(NeighbourRec):
             )
             self.logger.debug(result_message)
 
-        mat_c_sparse = coo_matrix(mat_c)
-        mat_c_pd = pd.DataFrame(
-            {
-                "item_id_one": mat_c_sparse.row.astype(np.int32),
-                "item_id_two": mat_c_sparse.col.astype(np.int32),
-                "similarity": mat_c_sparse.data,
-            }
-        )
-        self.similarity = State().session.createDataFrame(
-            mat_c_pd,
-            schema="item_id_one int, item_id_two int, similarity double",
+        self.similarity = sparse_to_spark(
+            coo_matrix(mat_c), ("item_id_one", "item_id_two", "similarity")
         )
         self.similarity.cache()
 
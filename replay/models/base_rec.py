@@ -24,6 +24,7 @@ from pyspark.sql import functions as sf
 from pyspark.sql.column import Column
 
 from replay.constants import AnyDataFrame
+from replay.interaction_matrix import InteractionMatrix, interaction_cache
 from replay.metrics import Metric, NDCG
 from replay.optuna_objective import SplitData, MainObjective
 from replay.session_handler import State
@@ -550,17 +551,32 @@ class BaseRecommender(ABC):
             )
         return res
 
-    def _reindex(self, entity: str, objects: DataFrame):
+    def extend_indexers(self, log: AnyDataFrame) -> None:
+        """
+        Add users and items of ``log`` missing in indexers of a fitted model,
+        so that the next ``fit`` with ``force_reindex=False``
+        keeps indexes of known users and items.
+
+        :param log: interactions ``[user_id, item_id, ...]``
+        """
+        log = convert2spark(log)
+        for entity in ["user", "item"]:
+            self._reindex(
+                entity, log.select(f"{entity}_id").distinct(), force=True
+            )
+
+    def _reindex(self, entity: str, objects: DataFrame, force: bool = False):
         """
         Reindex users or items. If recommender can process cold entities,
         indexer is updated with new entries.
 
         :param entity: user or item
         :param objects: unique users/items
+        :param force: update indexer with new entries in any case
         """
         indexer = getattr(self, f"{entity}_indexer")
         inv_indexer = getattr(self, f"inv_{entity}_indexer")
-        can_reindex = getattr(self, f"can_predict_cold_{entity}s")
+        can_reindex = force or getattr(self, f"can_predict_cold_{entity}s")
         new_objects = set(
             map(
                 str,
@@ -673,6 +689,33 @@ class BaseRecommender(ABC):
                 "Must run fit before calling this method"
             ) from error
 
+    def _interaction_matrix(
+        self,
+        log: DataFrame,
+        value_col: Optional[str] = "relevance",
+        dtype: Optional[Any] = None,
+    ) -> InteractionMatrix:
+        """
+        Get ``users_count x items_count`` matrix of indexed log
+        from the shared cache, so models trained on the same log
+        with the same indexers collect it only once.
+        The matrix is released in ``_clear_cache``.
+
+        :param log: indexed log ``[user_idx, item_idx, relevance]``
+        :param value_col: column with matrix values,
+            ``None`` means that all interactions are equal to 1
+        :param dtype: type of matrix values, e.g. ``np.float32``
+        :return: interaction matrix
+        """
+        return interaction_cache.get(
+            log,
+            shape=(self.users_count, self.items_count),
+            value_col=value_col,
+            dtype=dtype,
+            indexers=(self.user_indexer, self.item_indexer),
+            owner=self,
+        )
+
     def _fit_predict(
         self,
         log: AnyDataFrame,
@@ -697,8 +740,9 @@ class BaseRecommender(ABC):
 
     def _clear_cache(self):
         """
-        Clear spark cache
+        Clear spark cache and release cached interaction matrices
         """
+        interaction_cache.clear(owner=self)
 
     def _predict_pairs_wrap(
         self,
@@ -1391,6 +1435,7 @@ class NeighbourRec(Recommender, ABC):
         return {"similarity": self.similarity}
 
     def _clear_cache(self):
+        super()._clear_cache()
         if hasattr(self, "similarity"):
             self.similarity.unpersist()
 
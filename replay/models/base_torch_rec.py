@@ -1,9 +1,17 @@
+import io
+import os
+import socket
+import tempfile
+import uuid
 from abc import abstractmethod
-from typing import Any, Dict, Optional, Tuple, Union
+from copy import deepcopy
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 
 from ignite.contrib.handlers import LRScheduler
 from ignite.engine import Engine, Events
@@ -18,24 +26,352 @@ from pyspark.sql import functions as sf
 from torch import nn
 from torch.optim.optimizer import Optimizer  # pylint: disable=E0611
 from torch.optim.lr_scheduler import ReduceLROnPlateau, _LRScheduler
-from torch.utils.data import DataLoader
+from torch.utils.data import (
+    DataLoader,
+    DistributedSampler,
+    IterableDataset,
+    RandomSampler,
+)
 
 from replay.models.base_rec import Recommender
+from replay.models.torch_data import write_shards
 from replay.session_handler import State
 from replay.constants import IDX_REC_SCHEMA
 
 
+def _free_port() -> int:
+    """Find a free local port for process group initialization"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _SyncedLoader:
+    """
+    Stops iteration on all ranks as soon as one of them runs out of batches,
+    so that every rank makes the same number of gradient all-reduce calls.
+    """
+
+    def __init__(self, data_loader: Iterable):
+        self.data_loader = data_loader
+
+    def __iter__(self):
+        for batch in self.data_loader:
+            if not self._all_have_batch(True):
+                return
+            yield batch
+        self._all_have_batch(False)
+
+    @staticmethod
+    def _all_have_batch(has_batch: bool) -> bool:
+        flag = torch.tensor([int(has_batch)])
+        dist.all_reduce(flag, op=dist.ReduceOp.MIN)
+        return bool(flag.item())
+
+
+def _distributed_loader(
+    data_loader: DataLoader, split_iterable: bool = True
+) -> Iterable:
+    """
+    Give every rank its own part of data.
+    Map-style datasets get ``DistributedSampler``,
+    shard datasets read a subset of files.
+
+    :param data_loader: single-process data loader
+    :param split_iterable: split shard datasets between ranks,
+        otherwise every rank reads all shards
+    :return: data loader for the current rank
+    """
+    if not dist.is_initialized():
+        return data_loader
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    if isinstance(data_loader.dataset, IterableDataset):
+        if not split_iterable:
+            return data_loader
+        data_loader.dataset.set_rank(rank, world_size)
+        return _SyncedLoader(data_loader)
+    sampler = DistributedSampler(
+        data_loader.dataset,
+        num_replicas=world_size,
+        rank=rank,
+        shuffle=isinstance(data_loader.sampler, RandomSampler),
+    )
+    return DataLoader(
+        data_loader.dataset,
+        batch_size=data_loader.batch_size,
+        sampler=sampler,
+        num_workers=data_loader.num_workers,
+    )
+
+
+def _is_main_process() -> bool:
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+_EXECUTOR_MODELS: Dict[str, torch.jit.ScriptModule] = {}
+
+
+def _get_executor_model(key: str, model_bytes: Any) -> torch.jit.ScriptModule:
+    """
+    Load exported model once per python worker process
+    and reuse it in all tasks
+
+    :param key: unique export id
+    :param model_bytes: spark broadcast with serialized TorchScript module
+    :return: loaded module
+    """
+    if key not in _EXECUTOR_MODELS:
+        _EXECUTOR_MODELS.clear()
+        _EXECUTOR_MODELS[key] = torch.jit.load(
+            io.BytesIO(model_bytes.value), map_location="cpu"
+        )
+    return _EXECUTOR_MODELS[key]
+
+
 class TorchRecommender(Recommender):
     """Base class for neural recommenders"""
 
     model: Any
     device: torch.device
+    streaming: bool = False
+    num_shards: int = 16
+    prefetch_factor: int = 2
+    num_processes: int = 1
 
     def __init__(self):
         self.logger.info(
             "The model is neural network with non-distributed training"
         )
 
+    @abstractmethod
+    def _example_inputs(self) -> Tuple[torch.Tensor, ...]:
+        """
+        :return: example model inputs used to trace the model
+        """
+
+    def export_model(
+        self, path: Optional[str] = None, quantize: bool = False
+    ) -> torch.jit.ScriptModule:
+        """
+        Export trained model to TorchScript for CPU inference.
+        Exported model is used by ``predict`` and ``predict_pairs``
+        until the model is fitted again:
+        it is broadcasted once and loaded once per executor process.
+
+        :param path: file to save the module to, if provided
+        :param quantize: apply dynamic int8 quantization
+            to linear and embedding layers
+        :return: TorchScript module
+        """
+        model = deepcopy(self.model).cpu().eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(
+                model,
+                {
+                    nn.Linear: torch.quantization.default_dynamic_qconfig,
+                    nn.Embedding: torch.quantization.float_qparams_weight_only_qconfig,
+                },
+                dtype=torch.qint8,
+            )
+        with torch.no_grad():
+            scripted = torch.jit.trace(model, self._example_inputs())
+        scripted = torch.jit.freeze(scripted.eval())
+        buffer = io.BytesIO()
+        torch.jit.save(scripted, buffer)
+        if path is not None:
+            with open(path, "wb") as model_file:
+                model_file.write(buffer.getvalue())
+        self._exported_model = {
+            "source": self.model,
+            "key": uuid.uuid4().hex,
+            "bytes": buffer.getvalue(),
+            "broadcast": None,
+        }
+        return scripted
+
+    def _get_inference_model(self) -> Tuple[Optional[str], Any]:
+        """
+        :return: export id and broadcast of the exported model
+            if it is up to date, otherwise ``None`` and eager CPU model
+        """
+        exported = getattr(self, "_exported_model", None)
+        if exported is None or exported["source"] is not self.model:
+            return None, self.model.cpu()
+        if exported["broadcast"] is None:
+            exported["broadcast"] = State().session.sparkContext.broadcast(
+                exported["bytes"]
+            )
+        return exported["key"], exported["broadcast"]
+
+    def _run_trainer(
+        self, trainer: Engine, train_data_loader: DataLoader, max_epochs: int
+    ) -> None:
+        """
+        Run training in the current process or, if ``num_processes`` > 1,
+        in ``num_processes`` local CPU processes with gradient averaging.
+        Processes are forked from the driver and do not use Spark.
+        Streaming data needs at least a shard per data loader worker
+        of every process.
+
+        :param trainer: trainer created by ``_create_trainer_evaluator``
+        :param train_data_loader: data loader for training
+        :param max_epochs: number of epochs
+        """
+        if self.num_processes <= 1:
+            trainer.run(train_data_loader, max_epochs=max_epochs)
+            return
+
+        if self.device.type != "cpu":
+            raise ValueError(
+                "Data-parallel training with num_processes > 1 "
+                "is supported only on CPU"
+            )
+        if isinstance(train_data_loader.dataset, IterableDataset):
+            readers = self.num_processes * max(
+                train_data_loader.num_workers, 1
+            )
+            if len(train_data_loader.dataset.files) < readers:
+                raise ValueError(
+                    f"{len(train_data_loader.dataset.files)} shards "
+                    f"can't be split between {readers} readers, "
+                    "num_shards should be at least "
+                    "num_processes * num_workers"
+                )
+        result_path = os.path.join(
+            State().session.conf.get("spark.local.dir", tempfile.gettempdir()),
+            f"{type(self).__name__.lower()}_{uuid.uuid4().hex}.pt",
+        )
+        self.logger.debug(
+            "Training in %d processes with gloo backend", self.num_processes
+        )
+        # trainer closures can't be pickled for spawn, so the driver is forked.
+        # Intra-op thread pool is shrunk before that, because forking
+        # a process with live OpenMP threads can deadlock children.
+        num_threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        try:
+            mp.start_processes(
+                self._train_rank,
+                args=(
+                    self.num_processes,
+                    _free_port(),
+                    trainer,
+                    train_data_loader,
+                    max_epochs,
+                    result_path,
+                ),
+                nprocs=self.num_processes,
+                start_method="fork",
+            )
+        finally:
+            torch.set_num_threads(num_threads)
+        self.model.load_state_dict(torch.load(result_path))
+        os.remove(result_path)
+
+    # pylint: disable=too-many-arguments
+    def _train_rank(
+        self,
+        rank: int,
+        world_size: int,
+        port: int,
+        trainer: Engine,
+        train_data_loader: DataLoader,
+        max_epochs: int,
+        result_path: str,
+    ) -> None:
+        """
+        Training loop of a single data-parallel process
+
+        :param rank: process rank
+        :param world_size: number of processes
+        :param port: port used for process group initialization
+        :param trainer: trainer created by ``_create_trainer_evaluator``
+        :param train_data_loader: single-process data loader for training
+        :param max_epochs: number of epochs
+        :param result_path: rank 0 saves trained weights here
+        """
+        dist.init_process_group(
+            "gloo",
+            init_method=f"tcp://127.0.0.1:{port}",
+            rank=rank,
+            world_size=world_size,
+        )
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+        torch.manual_seed(torch.initial_seed() + rank)
+        self._init_rank(rank)
+        for param in self.model.parameters():
+            dist.broadcast(param.data, src=0)
+
+        trainer.run(
+            _distributed_loader(train_data_loader), max_epochs=max_epochs
+        )
+        if rank == 0:
+            torch.save(self.model.state_dict(), result_path)
+        dist.destroy_process_group()
+
+    def _init_rank(self, rank: int) -> None:
+        """
+        Prepare model state for a data-parallel process,
+        e.g. reseed random generators
+
+        :param rank: process rank
+        """
+
+    def _average_gradients(self) -> None:
+        world_size = dist.get_world_size()
+        for param in self.model.parameters():
+            if param.grad is not None:
+                dist.all_reduce(param.grad, op=dist.ReduceOp.SUM)
+                param.grad /= world_size
+
+    def _write_train_valid_shards(
+        self,
+        log: DataFrame,
+        valid_split_size: float,
+        seed: int,
+        group_by_user: bool = False,
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Split log into train and validation parts and save them
+        to parquet shards used by streaming data loaders.
+
+        :param log: indexed log ``[user_idx, item_idx]``
+        :param valid_split_size: fraction of data used for validation
+        :param seed: random seed
+        :param group_by_user: put all interactions of a user
+            into the same part and the same shard
+        :return: train and validation shard files
+        """
+        if group_by_user:
+            split_col = (
+                sf.abs(sf.hash("user_idx", sf.lit(seed))) % 10000
+            ) / 10000
+        else:
+            split_col = sf.rand(seed)
+        log = (
+            log.select("user_idx", "item_idx")
+            .withColumn("is_valid", split_col < valid_split_size)
+            .cache()
+        )
+        train_files = write_shards(
+            log.filter(~sf.col("is_valid")), self.num_shards, group_by_user
+        )
+        valid_files = write_shards(
+            log.filter(sf.col("is_valid")),
+            max(1, int(self.num_shards * valid_split_size)),
+            group_by_user,
+        )
+        log.unpersist()
+        return train_files, valid_files
+
+    @property
+    def _predict_kwargs(self) -> Dict[str, Any]:
+        """
+        Extra keyword arguments passed to ``_predict_by_user``
+        and ``_predict_by_user_pairs``
+        """
+        return {}
+
     # pylint: disable=too-many-arguments
     def _predict(
         self,
@@ -49,13 +385,23 @@ class TorchRecommender(Recommender):
     ) -> DataFrame:
         items_pd = items.toPandas()["item_idx"].values
         items_count = self.items_count
-        model = self.model.cpu()
+        model_key, model = self._get_inference_model()
         agg_fn = self._predict_by_user
+        predict_kwargs = self._predict_kwargs if model_key is None else {}
 
         def grouped_map(pandas_df: pd.DataFrame) -> pd.DataFrame:
-            return agg_fn(pandas_df, model, items_pd, k, items_count)[
-                ["user_idx", "item_idx", "relevance"]
-            ]
+            if model_key is None:
+                user_model = model
+            else:
+                user_model = _get_executor_model(model_key, model)
+            return agg_fn(
+                pandas_df,
+                user_model,
+                items_pd,
+                k,
+                items_count,
+                **predict_kwargs,
+            )[["user_idx", "item_idx", "relevance"]]
 
         self.logger.debug("Предсказание модели")
         recs = (
@@ -74,14 +420,22 @@ class TorchRecommender(Recommender):
         item_features: Optional[DataFrame] = None,
     ) -> DataFrame:
         items_count = self.items_count
-        model = self.model.cpu()
+        model_key, model = self._get_inference_model()
         agg_fn = self._predict_by_user_pairs
+        predict_kwargs = self._predict_kwargs if model_key is None else {}
         users = pairs.select("user_idx").distinct()
 
         def grouped_map(pandas_df: pd.DataFrame) -> pd.DataFrame:
-            return agg_fn(pandas_df, model, items_count)[
-                ["user_idx", "item_idx", "relevance"]
-            ]
+            if model_key is None:
+                user_model = model
+            else:
+                user_model = _get_executor_model(model_key, model)
+            return agg_fn(
+                pandas_df,
+                user_model,
+                items_count,
+                **predict_kwargs,
+            )[["user_idx", "item_idx", "relevance"]]
 
         self.logger.debug("Оценка релевантности для пар")
         user_history = (
@@ -177,6 +531,8 @@ class TorchRecommender(Recommender):
             else:
                 loss = self._loss(y_pred, y_true, **model_result[2])
             loss.backward()
+            if dist.is_initialized():
+                self._average_gradients()
             opt.step()
             return loss.item()
 
@@ -193,6 +549,23 @@ class TorchRecommender(Recommender):
         avg_output.attach(torch_trainer, "loss")
         Loss(self._loss).attach(torch_evaluator, "loss")
 
+        # pylint: disable=unused-variable
+        @torch_evaluator.on(Events.EPOCH_COMPLETED)
+        def average_validation_loss(evaluator):
+            if dist.is_initialized():
+                loss = torch.tensor([evaluator.state.metrics["loss"]])
+                dist.all_reduce(loss, op=dist.ReduceOp.SUM)
+                evaluator.state.metrics["loss"] = (
+                    loss.item() / dist.get_world_size()
+                )
+
+        # pylint: disable=unused-variable
+        @torch_trainer.on(Events.EPOCH_STARTED)
+        def set_sampler_epoch(trainer):
+            sampler = getattr(trainer.state.dataloader, "sampler", None)
+            if isinstance(sampler, DistributedSampler):
+                sampler.set_epoch(trainer.state.epoch)
+
         # pylint: disable=unused-variable
         @torch_trainer.on(Events.EPOCH_COMPLETED)
         def log_training_loss(trainer):
@@ -203,7 +576,9 @@ class TorchRecommender(Recommender):
         # pylint: disable=unused-variable
         @torch_trainer.on(Events.EPOCH_COMPLETED)
         def log_validation_results(trainer):
-            torch_evaluator.run(valid_data_loader)
+            torch_evaluator.run(
+                _distributed_loader(valid_data_loader, split_iterable=False)
+            )
             metrics = torch_evaluator.state.metrics
             debug_message = f"""Epoch[{trainer.state.epoch}] validation
 average loss: {metrics["loss"]:.5f}"""
@@ -256,16 +631,17 @@ average loss: {metrics["loss"]:.5f}"""
             global_step_transform=global_step_from_engine(torch_trainer),
         )
 
-        torch_evaluator.add_event_handler(
-            Events.EPOCH_COMPLETED,
-            checkpoint,
-            {type(self).__name__.lower(): self.model},
-        )
+        # pylint: disable=unused-variable
+        @torch_evaluator.on(Events.EPOCH_COMPLETED)
+        def save_checkpoint(engine):
+            if _is_main_process():
+                checkpoint(engine, {type(self).__name__.lower(): self.model})
 
         # pylint: disable=unused-argument,unused-variable
         @torch_trainer.on(Events.COMPLETED)
         def load_best_model(engine):
-            self.load_model(checkpoint.last_checkpoint)
+            if _is_main_process():
+                self.load_model(checkpoint.last_checkpoint)
 
     @staticmethod
     def _add_scheduler(scheduler, torch_trainer, torch_evaluator):
@@ -18,6 +18,8 @@ class ClusterRec(UserRecommender):
         "num_clusters": {"type": "int", "args": [2, 20]},
     }
     item_rel_in_cluster: DataFrame
+    cluster_top_items: DataFrame
+    top_n: int = 1000
 
     def __init__(self, num_clusters: int = 10):
         """
@@ -34,6 +36,10 @@ class ClusterRec(UserRecommender):
 
     def _load_model(self, path: str):
         self.model = KMeansModel.load(path)
+        if "cluster_top_items" not in self.__dict__:
+            self.cluster_top_items = self._top_items(
+                self.item_rel_in_cluster, self.top_n
+            )
 
     def _fit(
         self,
@@ -65,14 +71,73 @@ class ClusterRec(UserRecommender):
             "relevance", sf.col("item_count") / sf.col("max_count_in_cluster")
         ).drop("item_count", "max_count_in_cluster")
         self.item_rel_in_cluster.cache()
+        self.cluster_top_items = self._top_items(
+            self.item_rel_in_cluster, self.top_n
+        )
+        self.cluster_top_items.cache()
 
     def _clear_cache(self):
         if hasattr(self, "item_rel_in_cluster"):
             self.item_rel_in_cluster.unpersist()
+        if hasattr(self, "cluster_top_items"):
+            self.cluster_top_items.unpersist()
 
     @property
     def _dataframes(self):
-        return {"item_rel_in_cluster": self.item_rel_in_cluster}
+        return {
+            "item_rel_in_cluster": self.item_rel_in_cluster,
+            "cluster_top_items": self.cluster_top_items,
+        }
+
+    @staticmethod
+    def _top_items(item_rel_in_cluster: DataFrame, size: int) -> DataFrame:
+        """
+        Collect ``size`` most relevant items of every cluster
+
+        :param item_rel_in_cluster: dataframe
+            ``[cluster, item_idx, relevance]``
+        :param size: maximum number of items per cluster
+        :return: dataframe ``[cluster, top_items]``, where ``top_items``
+            is an array of ``(relevance, item_idx)`` sorted by relevance
+        """
+        return item_rel_in_cluster.groupBy("cluster").agg(
+            sf.slice(
+                sf.sort_array(
+                    sf.collect_list(sf.struct("relevance", "item_idx")),
+                    asc=False,
+                ),
+                1,
+                size,
+            ).alias("top_items")
+        )
+
+    def _candidate_top_items(self, items: DataFrame, size: int) -> DataFrame:
+        """
+        Get ``size`` most relevant candidate items of every cluster.
+        Precomputed lists are used unless a truncated list
+        does not contain enough candidates.
+        """
+        filtered_top = self._top_items(
+            self.cluster_top_items.select(
+                "cluster", sf.explode("top_items").alias("top")
+            )
+            .select("cluster", "top.relevance", "top.item_idx")
+            .join(items, on="item_idx"),
+            size,
+        )
+        incomplete = (
+            self.cluster_top_items.filter(
+                sf.size("top_items") >= self.top_n
+            )
+            .select("cluster")
+            .join(filtered_top, on="cluster", how="left")
+            .filter(sf.coalesce(sf.size("top_items"), sf.lit(0)) < size)
+        )
+        if incomplete.limit(1).count() > 0:
+            return self._top_items(
+                self.item_rel_in_cluster.join(items, on="item_idx"), size
+            )
+        return filtered_top
 
     @staticmethod
     def _transform_features(user_features):
@@ -98,6 +163,33 @@ class ClusterRec(UserRecommender):
             .select("user_idx", "prediction")
             .withColumnRenamed("prediction", "cluster")
         )
-        filtered_items = self.item_rel_in_cluster.join(items, on="item_idx")
-        pred = user_clusters.join(filtered_items, on="cluster").drop("cluster")
-        return pred
+        user_clusters = user_clusters.join(
+            users.select("user_idx"), on="user_idx"
+        )
+        if filter_seen_items and log is not None:
+            user_clusters = user_clusters.join(
+                log.groupBy("user_idx").agg(
+                    sf.countDistinct("item_idx").alias("seen_count")
+                ),
+                on="user_idx",
+                how="left",
+            ).fillna(0, subset=["seen_count"])
+        else:
+            user_clusters = user_clusters.withColumn("seen_count", sf.lit(0))
+        max_seen = (
+            user_clusters.select(sf.max("seen_count")).first()[0] or 0
+        )
+
+        top_items = self._candidate_top_items(items, k + max_seen)
+        return (
+            user_clusters.join(top_items, on="cluster")
+            .select(
+                "user_idx",
+                sf.explode(
+                    sf.expr(
+                        f"slice(top_items, 1, CAST(seen_count + {k} AS INT))"
+                    )
+                ).alias("top"),
+            )
+            .select("user_idx", "top.item_idx", "top.relevance")
+        )
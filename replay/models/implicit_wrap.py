@@ -1,12 +1,16 @@
-from typing import Optional
+from typing import Iterator, Optional
 
 import joblib
+import numpy as np
 import pandas as pd
 from pyspark.sql import DataFrame
+from scipy.sparse import csr_matrix
 
+from replay.arrow_transfer import spark_to_numpy
 from replay.models.base_rec import Recommender
-from replay.utils import to_csr
 from replay.constants import IDX_REC_SCHEMA
+from replay.session_handler import State
+from replay.utils import mask_seen, top_k_scores
 
 
 class ImplicitWrap(Recommender):
@@ -29,6 +33,8 @@ class ImplicitWrap(Recommender):
     0        1        3
     """
 
+    batch_size: int = 1000
+
     def __init__(self, model):
         """Provide initialized ``implicit`` model."""
         self.model = model
@@ -52,9 +58,19 @@ class ImplicitWrap(Recommender):
         user_features: Optional[DataFrame] = None,
         item_features: Optional[DataFrame] = None,
     ) -> None:
-        matrix = to_csr(log).T
+        matrix = self._interaction_matrix(log).csr.T
         self.model.fit(matrix)
 
+    def _drop_mask(self, log: DataFrame, items: DataFrame) -> np.ndarray:
+        """items from log which are not candidates"""
+        items_to_drop = spark_to_numpy(
+            log.select("item_idx").subtract(items.select("item_idx")),
+            ["item_idx"],
+        )["item_idx"]
+        mask = np.zeros(self.items_count, dtype=bool)
+        mask[items_to_drop] = True
+        return mask
+
     # pylint: disable=too-many-arguments
     def _predict(
         self,
@@ -66,10 +82,23 @@ class ImplicitWrap(Recommender):
         item_features: Optional[DataFrame] = None,
         filter_seen_items: bool = True,
     ) -> DataFrame:
+        user_item_data = self._interaction_matrix(log).csr
+        drop_mask = self._drop_mask(log, items)
+        item_factors = getattr(self.model, "item_factors", None)
+        if isinstance(item_factors, np.ndarray):
+            return self._predict_by_factors(
+                users, k, user_item_data, drop_mask, filter_seen_items
+            )
+
+        broadcast = State().session.sparkContext.broadcast(
+            (self.model, user_item_data, np.flatnonzero(drop_mask).tolist())
+        )
+
         def predict_by_user(pandas_df: pd.DataFrame) -> pd.DataFrame:
+            model, user_items, items_to_drop = broadcast.value
             user = int(pandas_df["user_idx"].iloc[0])
             res = model.recommend(
-                user, user_item_data, k, filter_seen_items, items_to_drop
+                user, user_items, k, filter_seen_items, items_to_drop
             )
             return pd.DataFrame(
                 {
@@ -79,17 +108,59 @@ class ImplicitWrap(Recommender):
                 }
             )
 
-        items_to_drop = (
-            log.select("item_idx")
-            .subtract(items)
-            .select("item_idx")
-            .toPandas()
-            .item_idx.to_list()
-        )
-        user_item_data = to_csr(log).tocsr()
-        model = self.model
         return (
             users.select("user_idx")
             .groupby("user_idx")
             .applyInPandas(predict_by_user, IDX_REC_SCHEMA)
         )
+
+    # pylint: disable=too-many-arguments
+    def _predict_by_factors(
+        self,
+        users: DataFrame,
+        k: int,
+        user_item_data: csr_matrix,
+        drop_mask: np.ndarray,
+        filter_seen_items: bool,
+    ) -> DataFrame:
+        """
+        Score blocks of ``batch_size`` users with one matrix product,
+        factors and interactions are broadcast once
+        """
+        broadcast = State().session.sparkContext.broadcast(
+            (
+                self.model.user_factors,
+                self.model.item_factors,
+                user_item_data,
+                drop_mask[: len(self.model.item_factors)],
+            )
+        )
+        batch_size = self.batch_size
+
+        def score_blocks(
+            iterator: Iterator[pd.DataFrame],
+        ) -> Iterator[pd.DataFrame]:
+            user_factors, item_factors, user_items, drop = broadcast.value
+            for pandas_df in iterator:
+                user_idx = pandas_df["user_idx"].values
+                user_idx = user_idx[user_idx < len(user_factors)]
+                for start in range(0, len(user_idx), batch_size):
+                    batch = user_idx[start : start + batch_size]
+                    scores = user_factors[batch] @ item_factors.T
+                    scores[:, drop] = -np.inf
+                    if filter_seen_items:
+                        mask_seen(scores, user_items[batch])
+                    rows, cols, values = top_k_scores(scores, k)
+                    yield pd.DataFrame(
+                        {
+                            "user_idx": batch[rows],
+                            "item_idx": cols,
+                            "relevance": values,
+                        }
+                    )
+
+        return (
+            users.select("user_idx")
+            .distinct()
+            .mapInPandas(score_blocks, IDX_REC_SCHEMA)
+        )
@@ -1,6 +1,7 @@
 import os
+from contextlib import nullcontext
 from os.path import join
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple
 
 import joblib
 import numpy as np
@@ -12,10 +13,26 @@ from pyspark.sql import DataFrame
 from scipy.sparse import csr_matrix, hstack, diags
 from sklearn.preprocessing import MinMaxScaler
 
-from replay.constants import IDX_REC_SCHEMA
+from replay.arrow_transfer import numpy_to_spark, spark_to_numpy
+from replay.constants import AnyDataFrame, IDX_REC_SCHEMA
 from replay.models.base_rec import HybridRecommender
-from replay.utils import to_csr, check_numeric
 from replay.session_handler import State
+from replay.utils import check_numeric, convert2spark, mask_seen, top_k_scores
+
+
+def _blas_limits(num_threads: int):
+    """
+    Limit BLAS threads with ``threadpoolctl`` if it is installed
+
+    :param num_threads: number of threads
+    :return: context manager
+    """
+    try:
+        # pylint: disable=import-outside-toplevel
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return nullcontext()
+    return threadpool_limits(limits=num_threads, user_api="blas")
 
 
 # pylint: disable=too-many-locals, too-many-instance-attributes
@@ -23,6 +40,7 @@ class LightFMWrap(HybridRecommender):
     """Wrapper for LightFM."""
 
     epochs: int = 10
+    batch_size: int = 1000
     _search_space = {
         "loss": {
             "type": "categorical",
@@ -117,28 +135,22 @@ class LightFMWrap(HybridRecommender):
                 feature_table.select(sf.max(idx_col_name)).collect()[0][0] + 1,
             )
 
-        features_np = (
-            feature_table.select(
-                idx_col_name,
-                # first column contains id, next contain features
-                *(
-                    sorted(
-                        list(
-                            set(feature_table.columns).difference(
-                                {idx_col_name}
-                            )
-                        )
-                    )
-                ),
-            )
-            .toPandas()
-            .to_numpy()
+        feature_columns = sorted(
+            set(feature_table.columns).difference({idx_col_name})
+        )
+        features_data = spark_to_numpy(
+            feature_table, [idx_col_name, *feature_columns]
         )
-        entities_ids = features_np[:, 0]
-        features_np = features_np[:, 1:]
+        entities_ids = features_data[idx_col_name]
+        features_np = np.column_stack(
+            [features_data[column] for column in feature_columns]
+            or [np.empty((len(entities_ids), 0))]
+        ).astype(np.float64)
         number_of_features = features_np.shape[1]
 
-        all_ids_list = log_ids_list.toPandas().to_numpy().ravel()
+        all_ids_list = spark_to_numpy(log_ids_list, [idx_col_name])[
+            idx_col_name
+        ]
         entities_seen_in_fit = all_ids_list[all_ids_list < num_entities_in_fit]
 
         entity_id_features = csr_matrix(
@@ -192,7 +204,7 @@ class LightFMWrap(HybridRecommender):
         self.num_of_warm_items = len(self.item_indexer.labels)
         self.num_of_warm_users = len(self.user_indexer.labels)
 
-        interactions_matrix = to_csr(log, self.users_count, self.items_count)
+        interactions_matrix = self._interaction_matrix(log).csr
         csr_item_features = self._feature_table_to_csr(
             log.select("item_idx").distinct(), item_features
         )
@@ -217,6 +229,107 @@ class LightFMWrap(HybridRecommender):
             user_features=csr_user_features,
         )
 
+    def partial_fit(
+        self,
+        log: AnyDataFrame,
+        user_features: Optional[AnyDataFrame] = None,
+        item_features: Optional[AnyDataFrame] = None,
+        epochs: Optional[int] = None,
+    ) -> None:
+        """
+        Update fitted model with new interactions keeping learnt embeddings.
+        New users and items get their own identity features,
+        numerical features are scaled with scalers fitted in ``fit``.
+
+        :param log: new interactions
+            ``[user_id, item_id, timestamp, relevance]``
+        :param user_features: user features
+            ``[user_id]`` + feature columns
+        :param item_features: item features
+            ``[item_id]`` + feature columns
+        :param epochs: number of epochs, ``epochs`` attribute by default
+        """
+        if getattr(self, "model", None) is None:
+            self.fit(log, user_features, item_features)
+            return
+        if self.can_predict_cold_users and user_features is None:
+            raise ValueError("User features are missing for partial fit")
+        if self.can_predict_cold_items and item_features is None:
+            raise ValueError("Item features are missing for partial fit")
+
+        log, user_features, item_features = [
+            convert2spark(df) for df in [log, user_features, item_features]
+        ]
+        self._reindex("user", log, force=True)
+        self._reindex("item", log, force=True)
+        log, user_features, item_features = [
+            self._convert_index(df)
+            for df in [log, user_features, item_features]
+        ]
+
+        self._grow_embeddings("user", self.num_of_warm_users, self.users_count)
+        self._grow_embeddings("item", self.num_of_warm_items, self.items_count)
+        self.num_of_warm_users = self.users_count
+        self.num_of_warm_items = self.items_count
+
+        interactions_matrix = self._interaction_matrix(log).csr
+        csr_item_features = self._feature_table_to_csr(
+            log.select("item_idx").distinct(), item_features
+        )
+        csr_user_features = self._feature_table_to_csr(
+            log.select("user_idx").distinct(), user_features
+        )
+        self.model.fit_partial(
+            interactions=interactions_matrix,
+            epochs=self.epochs if epochs is None else epochs,
+            num_threads=self.num_threads,
+            item_features=csr_item_features,
+            user_features=csr_user_features,
+        )
+
+    def _grow_embeddings(self, entity: str, old_count: int, new_count: int):
+        """
+        Insert parameters for new identity features of users or items
+        after the existing identity block, parameters of numerical features
+        are shifted accordingly. Initialization is the same as in LightFM.
+
+        :param entity: user or item
+        :param old_count: size of the current identity block
+        :param new_count: size of the identity block after update
+        """
+        count = new_count - old_count
+        if count <= 0:
+            return
+        model = self.model
+        no_components = model.no_components
+        gradient_init = 1.0 if model.learning_schedule == "adagrad" else 0.0
+        new_rows = {
+            "embeddings": (
+                model.random_state.rand(count, no_components) - 0.5
+            )
+            / no_components,
+            "embedding_gradients": np.full(
+                (count, no_components), gradient_init
+            ),
+            "embedding_momentum": np.zeros((count, no_components)),
+            "biases": np.zeros(count),
+            "bias_gradients": np.full(count, gradient_init),
+            "bias_momentum": np.zeros(count),
+        }
+        for name, rows in new_rows.items():
+            current = getattr(model, f"{entity}_{name}")
+            setattr(
+                model,
+                f"{entity}_{name}",
+                np.concatenate(
+                    [
+                        current[:old_count],
+                        rows.astype(current.dtype),
+                        current[old_count:],
+                    ]
+                ),
+            )
+
     def _predict_selected_pairs(
         self,
         pairs: DataFrame,
@@ -261,8 +374,73 @@ class LightFMWrap(HybridRecommender):
         item_features: Optional[DataFrame] = None,
         filter_seen_items: bool = True,
     ) -> DataFrame:
-        return self._predict_selected_pairs(
-            users.crossJoin(items), user_features, item_features
+        if self.can_predict_cold_users and user_features is None:
+            raise ValueError("User features are missing for predict")
+        if self.can_predict_cold_items and item_features is None:
+            raise ValueError("Item features are missing for predict")
+
+        user_biases, user_vectors = self.model.get_user_representations(
+            self._feature_table_to_csr(users, user_features)
+        )
+        item_biases, item_vectors = self.model.get_item_representations(
+            self._feature_table_to_csr(items, item_features)
+        )
+        item_ids = spark_to_numpy(items, ["item_idx"])["item_idx"]
+        item_ids = item_ids[item_ids < len(item_vectors)]
+        seen = None
+        if filter_seen_items and log is not None:
+            seen = self._interaction_matrix(log).csr[:, item_ids]
+
+        broadcast = State().session.sparkContext.broadcast(
+            (
+                user_biases,
+                user_vectors,
+                item_ids,
+                item_biases[item_ids],
+                item_vectors[item_ids],
+                seen,
+            )
+        )
+        batch_size = self.batch_size
+        num_threads = self.num_threads
+
+        def score_blocks(
+            iterator: Iterator[pd.DataFrame],
+        ) -> Iterator[pd.DataFrame]:
+            (
+                user_bias,
+                user_repr,
+                candidates,
+                item_bias,
+                item_repr,
+                seen_items,
+            ) = broadcast.value
+            with _blas_limits(num_threads):
+                for pandas_df in iterator:
+                    user_idx = pandas_df["user_idx"].values
+                    user_idx = user_idx[user_idx < len(user_repr)]
+                    for start in range(0, len(user_idx), batch_size):
+                        batch = user_idx[start : start + batch_size]
+                        scores = (
+                            user_repr[batch] @ item_repr.T
+                            + user_bias[batch, np.newaxis]
+                            + item_bias
+                        )
+                        if seen_items is not None:
+                            mask_seen(scores, seen_items[batch])
+                        rows, cols, values = top_k_scores(scores, k)
+                        yield pd.DataFrame(
+                            {
+                                "user_idx": batch[rows],
+                                "item_idx": candidates[cols],
+                                "relevance": values,
+                            }
+                        )
+
+        return (
+            users.select("user_idx")
+            .distinct()
+            .mapInPandas(score_blocks, IDX_REC_SCHEMA)
         )
 
     def _predict_pairs(
@@ -289,7 +467,7 @@ class LightFMWrap(HybridRecommender):
         :return: spark-dataframe с bias и векторами пользователей/объектов, размерность вектора
         """
         entity = "item" if "item_idx" in ids.columns else "user"
-        ids_list = ids.toPandas()[f"{entity}_idx"]
+        ids_list = spark_to_numpy(ids, [f"{entity}_idx"])[f"{entity}_idx"]
 
         # models without features use sparse matrix
         if features is None:
@@ -306,15 +484,11 @@ class LightFMWrap(HybridRecommender):
             sparse_features
         )
 
-        embed_list = list(
-            zip(
-                ids_list,
-                biases[ids_list].tolist(),
-                vectors[ids_list].tolist(),
-            )
-        )
-        lightfm_factors = State().session.createDataFrame(
-            embed_list,
-            schema=[f"{entity}_idx", f"{entity}_bias", f"{entity}_factors",],
+        lightfm_factors = numpy_to_spark(
+            {
+                f"{entity}_idx": ids_list,
+                f"{entity}_bias": biases[ids_list].astype(np.float64),
+                f"{entity}_factors": vectors[ids_list].astype(np.float64),
+            }
         )
         return lightfm_factors, self.model.no_components
@@ -2,7 +2,7 @@
 MultVAE implementation
 (Variational Autoencoders for Collaborative Filtering)
 """
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -17,9 +17,30 @@ from torch.optim.lr_scheduler import ReduceLROnPlateau
 from torch.utils.data import DataLoader, TensorDataset
 
 from replay.models.base_torch_rec import TorchRecommender
+from replay.models.torch_data import (
+    UserBatchDataset,
+    remove_shards,
+    streaming_loader,
+)
 from replay.session_handler import State
 
 
+def csr_to_sparse_tensor(matrix: csr_matrix) -> torch.Tensor:
+    """
+    Convert scipy csr matrix to torch sparse COO tensor
+
+    :param matrix: csr matrix
+    :return: sparse float tensor of the same shape
+    """
+    coo = matrix.tocoo()
+    return torch.sparse_coo_tensor(
+        np.vstack([coo.row, coo.col]).astype(np.int64),
+        coo.data,
+        coo.shape,
+        dtype=torch.float32,
+    )
+
+
 class VAE(nn.Module):
     """Base variational autoencoder"""
 
@@ -70,10 +91,15 @@ class VAE(nn.Module):
 
     def encode(self, batch: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         """Encode"""
-        hidden = F.normalize(batch, p=2, dim=1)
-        hidden = self.dropout(hidden)
+        if batch.is_sparse:
+            hidden = self._sparse_input_layer(batch)
+        else:
+            hidden = F.normalize(batch, p=2, dim=1)
+            hidden = self.dropout(hidden)
+            hidden = self.encoder[0](hidden)
+        hidden = self.activation(hidden)
 
-        for layer in self.encoder[:-1]:
+        for layer in self.encoder[1:-1]:
             hidden = layer(hidden)
             hidden = self.activation(hidden)
 
@@ -82,6 +108,28 @@ class VAE(nn.Module):
         logvar_latent = hidden[:, self.latent_dim :]
         return mu_latent, logvar_latent
 
+    def _sparse_input_layer(self, batch: torch.Tensor) -> torch.Tensor:
+        """
+        Apply normalization, dropout and the first encoder layer
+        to non-zero values of a sparse batch only
+
+        :param batch: sparse COO tensor ``users x items``
+        :return: dense output of the first encoder layer
+        """
+        batch = batch.coalesce()
+        indices = batch.indices()
+        values = batch.values()
+        norms = torch.zeros(
+            batch.shape[0], dtype=values.dtype, device=values.device
+        ).index_add_(0, indices[0], values.pow(2))
+        values = values / norms.sqrt().clamp_min(1e-12)[indices[0]]
+        values = self.dropout(values)
+        batch = torch.sparse_coo_tensor(indices, values, batch.shape)
+        first_layer = self.encoder[0]
+        return (
+            torch.sparse.mm(batch, first_layer.weight.t()) + first_layer.bias
+        )
+
     def reparameterize(
         self, mu_latent: torch.Tensor, logvar_latent: torch.Tensor
     ) -> torch.Tensor:
@@ -161,6 +209,7 @@ class MultVAE(TorchRecommender):
         anneal: float = 0.1,
         l2_reg: float = 0,
         gamma: float = 0.99,
+        sparse_input: bool = False,
     ):
         """
         :param learning_rate: learning rate
@@ -171,6 +220,8 @@ class MultVAE(TorchRecommender):
         :param anneal: anneal coefficient [0,1]
         :param l2_reg: l2 regularization term
         :param gamma: reduce learning rate by this coefficient per epoch
+        :param sparse_input: feed user batches to the encoder as sparse
+            tensors instead of dense rows of the whole item catalogue
         """
         super().__init__()
         self.device = State().device
@@ -182,6 +233,7 @@ class MultVAE(TorchRecommender):
         self.anneal = anneal
         self.l2_reg = l2_reg
         self.gamma = gamma
+        self.sparse_input = sparse_input
 
     @property
     def _init_args(self):
@@ -194,29 +246,22 @@ class MultVAE(TorchRecommender):
             "anneal": self.anneal,
             "l2_reg": self.l2_reg,
             "gamma": self.gamma,
+            "sparse_input": self.sparse_input,
         }
 
     def _get_data_loader(
-        self, data: pd.DataFrame, shuffle: bool = True
-    ) -> Tuple[csr_matrix, DataLoader, np.ndarray]:
-        """get data loader and matrix with data"""
-        users_count = data["user_idx"].value_counts().count()
-        user_idx = data["user_idx"].astype("category").cat  # type: ignore
-        user_batch = csr_matrix(
-            (
-                np.ones(len(data["user_idx"])),
-                ([user_idx.codes.values, data["item_idx"].values]),
-            ),
-            shape=(users_count, self.items_count),
-        )
+        self, matrix: csr_matrix, users: np.ndarray, shuffle: bool = True
+    ) -> Tuple[csr_matrix, DataLoader]:
+        """get data loader and matrix with data of ``users``"""
+        user_batch = matrix[users]
         data_loader = DataLoader(
-            TensorDataset(torch.arange(users_count).long()),
+            TensorDataset(torch.arange(len(users)).long()),
             batch_size=self.batch_size_users,
             shuffle=shuffle,
             num_workers=self.num_workers,
         )
 
-        return user_batch, data_loader, user_idx.categories.values
+        return user_batch, data_loader
 
     # pylint: disable=too-many-locals
     def _fit(
@@ -226,21 +271,46 @@ class MultVAE(TorchRecommender):
         item_features: Optional[DataFrame] = None,
     ) -> None:
         self.logger.debug("Creating batch:")
-        data = log.select("user_idx", "item_idx").toPandas()
-        splitter = GroupShuffleSplit(
-            n_splits=1, test_size=self.valid_split_size, random_state=self.seed
-        )
-        train_idx, valid_idx = next(
-            splitter.split(data, groups=data["user_idx"])
-        )
-        train_data, valid_data = data.iloc[train_idx], data.iloc[valid_idx]
+        shard_files: List[str] = []
+        if self.streaming:
+            train_files, valid_files = self._write_train_valid_shards(
+                log, self.valid_split_size, self.seed, group_by_user=True
+            )
+            shard_files = train_files + valid_files
+            train_data_loader = streaming_loader(
+                UserBatchDataset(
+                    train_files,
+                    self.batch_size_users,
+                    self.items_count,
+                    seed=self.seed,
+                ),
+                self.num_workers,
+                self.prefetch_factor,
+            )
+            valid_data_loader = streaming_loader(
+                UserBatchDataset(
+                    valid_files,
+                    self.batch_size_users,
+                    self.items_count,
+                    shuffle=False,
+                ),
+            )
+        else:
+            matrix = self._interaction_matrix(log, value_col=None).csr
+            users = np.flatnonzero(np.diff(matrix.indptr))
+            splitter = GroupShuffleSplit(
+                n_splits=1,
+                test_size=self.valid_split_size,
+                random_state=self.seed,
+            )
+            train_idx, valid_idx = next(splitter.split(users, groups=users))
 
-        self.train_user_batch, train_data_loader, _ = self._get_data_loader(
-            train_data
-        )
-        self.valid_user_batch, valid_data_loader, _ = self._get_data_loader(
-            valid_data, False
-        )
+            self.train_user_batch, train_data_loader = self._get_data_loader(
+                matrix, users[train_idx]
+            )
+            self.valid_user_batch, valid_data_loader = self._get_data_loader(
+                matrix, users[valid_idx], False
+            )
 
         self.logger.debug("Training VAE")
         self.model = VAE(
@@ -265,12 +335,37 @@ class MultVAE(TorchRecommender):
             self.n_saved,
         )
 
-        vae_trainer.run(train_data_loader, max_epochs=self.epochs)
+        try:
+            self._run_trainer(vae_trainer, train_data_loader, self.epochs)
+        finally:
+            remove_shards(shard_files)
+
+    def _example_inputs(self):
+        return (torch.zeros((2, self.items_count)),)
+
+    @property
+    def _predict_kwargs(self):
+        return {"sparse_input": self.sparse_input}
 
     # pylint: disable=arguments-differ
     def _loss(self, y_pred, y_true, mu_latent, logvar_latent):
         log_softmax_var = F.log_softmax(y_pred, dim=1)
-        bce = -(log_softmax_var * y_true).sum(dim=1).mean()
+        if y_true.is_sparse:
+            y_true = y_true.coalesce()
+            rows, cols = y_true.indices()
+            bce = (
+                -torch.zeros(
+                    y_pred.shape[0],
+                    dtype=log_softmax_var.dtype,
+                    device=log_softmax_var.device,
+                )
+                .index_add_(
+                    0, rows, log_softmax_var[rows, cols] * y_true.values()
+                )
+                .mean()
+            )
+        else:
+            bce = -(log_softmax_var * y_true).sum(dim=1).mean()
         kld = (
             -0.5
             * torch.sum(
@@ -281,13 +376,18 @@ class MultVAE(TorchRecommender):
         return bce + self.anneal * kld
 
     def _batch_pass(self, batch, model):
-        if model.training:
-            full_batch = self.train_user_batch
+        if isinstance(batch, csr_matrix):
+            csr_batch = batch
+        elif model.training:
+            csr_batch = self.train_user_batch[batch[0]]
         else:
-            full_batch = self.valid_user_batch
-        user_batch = torch.FloatTensor(full_batch[batch[0]].toarray()).to(
-            self.device
-        )
+            csr_batch = self.valid_user_batch[batch[0]]
+        if self.sparse_input:
+            user_batch = csr_to_sparse_tensor(csr_batch).to(self.device)
+        else:
+            user_batch = torch.FloatTensor(csr_batch.toarray()).to(
+                self.device
+            )
         pred_user_batch, latent_mu, latent_logvar = self.model.forward(
             user_batch
         )
@@ -305,11 +405,21 @@ class MultVAE(TorchRecommender):
         items_np_to_pred: np.ndarray,
         item_count: int,
         cnt: Optional[int] = None,
+        sparse_input: bool = False,
     ) -> DataFrame:
         model.eval()
         with torch.no_grad():
-            user_batch = torch.zeros((1, item_count))
-            user_batch[0, items_np_history] = 1
+            if sparse_input:
+                history = np.unique(items_np_history).astype(np.int64)
+                user_batch = torch.sparse_coo_tensor(
+                    np.vstack([np.zeros_like(history), history]),
+                    np.ones(len(history)),
+                    (1, item_count),
+                    dtype=torch.float32,
+                )
+            else:
+                user_batch = torch.zeros((1, item_count))
+                user_batch[0, items_np_history] = 1
             user_recs = F.softmax(model(user_batch)[0][0].detach(), dim=0)
             if cnt is not None:
                 best_item_idx = (
@@ -335,6 +445,7 @@ class MultVAE(TorchRecommender):
         items_np: np.ndarray,
         k: int,
         item_count: int,
+        sparse_input: bool = False,
     ) -> pd.DataFrame:
         return MultVAE._predict_pairs_inner(
             model=model,
@@ -343,11 +454,15 @@ class MultVAE(TorchRecommender):
             items_np_to_pred=items_np,
             item_count=item_count,
             cnt=min(len(pandas_df) + k, len(items_np)),
+            sparse_input=sparse_input,
         )
 
     @staticmethod
     def _predict_by_user_pairs(
-        pandas_df: pd.DataFrame, model: nn.Module, item_count: int,
+        pandas_df: pd.DataFrame,
+        model: nn.Module,
+        item_count: int,
+        sparse_input: bool = False,
     ) -> pd.DataFrame:
 
         items_np_history = np.array(
@@ -365,6 +480,7 @@ class MultVAE(TorchRecommender):
             items_np_to_pred=np.array(pandas_df["item_idx_to_pred"][0]),
             item_count=item_count,
             cnt=None,
+            sparse_input=sparse_input,
         )
 
     def _load_model(self, path: str):
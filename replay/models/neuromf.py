@@ -11,12 +11,21 @@ import torch.nn.functional as F
 import torch.optim
 from ignite.engine import Engine
 from pyspark.sql import DataFrame
+from pyspark.sql import functions as sf
 from sklearn.model_selection import train_test_split
 from torch import LongTensor, Tensor, nn
 from torch.optim.lr_scheduler import ExponentialLR
 from torch.utils.data import DataLoader, TensorDataset
 
 from replay.models.base_torch_rec import TorchRecommender
+from replay.models.torch_data import (
+    InteractionDataset,
+    read_column_memmap,
+    remove_shards,
+    streaming_loader,
+    write_shards,
+)
+from replay.sampling import NegativeSampler
 from replay.session_handler import State
 
 EMBED_DIM = 128
@@ -194,18 +203,13 @@ class NMF(nn.Module):
         :param item: item id batch
         :return: output
         """
-        batch_size = len(user)
+        vectors = []
         if self.gmf:
-            gmf_vector = self.gmf(user, item)
-        else:
-            gmf_vector = torch.zeros(batch_size, 0).to(user.device)
-
+            vectors.append(self.gmf(user, item))
         if self.mlp:
-            mlp_vector = self.mlp(user, item)
-        else:
-            mlp_vector = torch.zeros(batch_size, 0).to(user.device)
+            vectors.append(self.mlp(user, item))
 
-        merged_vector = torch.cat([gmf_vector, mlp_vector], dim=1)
+        merged_vector = torch.cat(vectors, dim=1)
         merged_vector = self.last_layer(merged_vector).squeeze()
         merged_vector = torch.sigmoid(merged_vector)
 
@@ -228,6 +232,7 @@ class NeuroMF(TorchRecommender):
     n_saved: int = 2
     valid_split_size: float = 0.1
     seed: int = 42
+    negative_sampler: NegativeSampler
     _search_space = {
         "embedding_gmf_dim": {"type": "int", "args": [EMBED_DIM, EMBED_DIM]},
         "embedding_mlp_dim": {"type": "int", "args": [EMBED_DIM, EMBED_DIM]},
@@ -248,6 +253,7 @@ class NeuroMF(TorchRecommender):
         l2_reg: float = 0,
         gamma: float = 0.99,
         count_negative_sample: int = 1,
+        negative_sampling_alpha: float = 0.0,
     ):
         """
         MLP or GMF model can be ignored if
@@ -262,6 +268,9 @@ class NeuroMF(TorchRecommender):
         :param l2_reg: l2 regularization term
         :param gamma: decrease learning rate by this coefficient per epoch
         :param count_negative_sample: number of negative samples to use
+        :param negative_sampling_alpha: negatives are sampled proportionally
+            to ``item popularity ** negative_sampling_alpha``,
+            ``0`` means uniform sampling
         """
         super().__init__()
         if not embedding_gmf_dim and not embedding_mlp_dim:
@@ -283,6 +292,7 @@ class NeuroMF(TorchRecommender):
         self.l2_reg = l2_reg
         self.gamma = gamma
         self.count_negative_sample = count_negative_sample
+        self.negative_sampling_alpha = negative_sampling_alpha
 
     @property
     def _init_args(self):
@@ -295,6 +305,7 @@ class NeuroMF(TorchRecommender):
             "l2_reg": self.l2_reg,
             "gamma": self.gamma,
             "count_negative_sample": self.count_negative_sample,
+            "negative_sampling_alpha": self.negative_sampling_alpha,
         }
 
     def _data_loader(
@@ -315,12 +326,38 @@ class NeuroMF(TorchRecommender):
         return loader
 
     def _get_neg_batch(self, batch: Tensor) -> Tensor:
-        negative_items = torch.randint(
-            0,
-            self.items_count - 1,
-            (batch.shape[0] * self.count_negative_sample,),
+        negative_items = self.negative_sampler.sample(
+            batch.numpy(), self.count_negative_sample
+        )
+        return torch.from_numpy(negative_items)
+
+    def _streaming_negative_sampler(self, log: DataFrame) -> NegativeSampler:
+        """
+        Sort keys of positive pairs in Spark and read them shard by shard
+        into a memory-mapped array, so the log is never collected
+        to the driver
+        """
+        key_files = write_shards(
+            log.select(
+                (
+                    sf.col("user_idx").cast("long") * self.items_count
+                    + sf.col("item_idx")
+                ).alias("key")
+            ).distinct(),
+            self.num_shards,
+            columns=("key",),
+            sort_by="key",
+        )
+        try:
+            keys = read_column_memmap(key_files, "key")
+        finally:
+            remove_shards(key_files)
+        return NegativeSampler.from_sorted_keys(
+            keys,
+            self.items_count,
+            alpha=self.negative_sampling_alpha,
+            seed=self.seed,
         )
-        return negative_items
 
     def _fit(
         self,
@@ -337,14 +374,42 @@ class NeuroMF(TorchRecommender):
         ).to(self.device)
 
         self.logger.debug("Create batch")
-        tensor_data = log.select("user_idx", "item_idx").toPandas()
-        train_tensor_data, valid_tensor_data = train_test_split(
-            tensor_data,
-            test_size=self.valid_split_size,
-            random_state=self.seed,
-        )
-        train_data_loader = self._data_loader(train_tensor_data)
-        val_data_loader = self._data_loader(valid_tensor_data)
+        shard_files: List[str] = []
+        if self.streaming:
+            train_files, valid_files = self._write_train_valid_shards(
+                log, self.valid_split_size, self.seed
+            )
+            shard_files = train_files + valid_files
+            self.negative_sampler = self._streaming_negative_sampler(log)
+            train_data_loader = streaming_loader(
+                InteractionDataset(
+                    train_files, self.batch_size_users, seed=self.seed
+                ),
+                self.num_workers,
+                self.prefetch_factor,
+            )
+            val_data_loader = streaming_loader(
+                InteractionDataset(
+                    valid_files, self.batch_size_users, shuffle=False
+                ),
+            )
+        else:
+            tensor_data = log.select("user_idx", "item_idx").toPandas()
+            self.negative_sampler = NegativeSampler.from_pairs(
+                tensor_data["user_idx"].values,
+                tensor_data["item_idx"].values,
+                self.users_count,
+                self.items_count,
+                alpha=self.negative_sampling_alpha,
+                seed=self.seed,
+            )
+            train_tensor_data, valid_tensor_data = train_test_split(
+                tensor_data,
+                test_size=self.valid_split_size,
+                random_state=self.seed,
+            )
+            train_data_loader = self._data_loader(train_tensor_data)
+            val_data_loader = self._data_loader(valid_tensor_data)
 
         self.logger.debug("Train NeuroMF")
         optimizer = torch.optim.Adam(
@@ -361,7 +426,16 @@ class NeuroMF(TorchRecommender):
             self.n_saved,
         )
 
-        nmf_trainer.run(train_data_loader, max_epochs=self.epochs)
+        try:
+            self._run_trainer(nmf_trainer, train_data_loader, self.epochs)
+        finally:
+            remove_shards(shard_files)
+
+    def _example_inputs(self):
+        return LongTensor([0, 1]), LongTensor([0, 1])
+
+    def _init_rank(self, rank: int) -> None:
+        self.negative_sampler.rng = np.random.default_rng([self.seed, rank])
 
     # pylint: disable=arguments-differ
     def _loss(self, y_pred, y_true):
@@ -1,9 +1,12 @@
-from typing import Optional
+from typing import Optional, Tuple
 
-from pyspark.sql import DataFrame, Window
+import numpy as np
+from pyspark.sql import DataFrame
 from pyspark.sql import functions as sf
 
+from replay.arrow_transfer import spark_to_numpy
 from replay.models.base_rec import Recommender
+from replay.session_handler import State
 
 
 class PopRec(Recommender):
@@ -57,7 +60,9 @@ class PopRec(Recommender):
     """
 
     item_popularity: DataFrame
+    item_ranking: Tuple[np.ndarray, np.ndarray]
     can_predict_cold_users = True
+    ranking_size: int = 10000
 
     def __init__(self, use_relevance: bool = False):
         """
@@ -99,11 +104,59 @@ class PopRec(Recommender):
                 )
             )
         self.item_popularity.cache()
+        self._fit_ranking()
 
     def _clear_cache(self):
         if hasattr(self, "item_popularity"):
             self.item_popularity.unpersist()
 
+    @staticmethod
+    def _rank_items(
+        item_popularity: DataFrame, size: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get ``size`` most popular items
+
+        :param item_popularity: dataframe ``[item_idx, relevance]``
+        :param size: number of items
+        :return: items and their relevance sorted by relevance
+        """
+        top = spark_to_numpy(
+            item_popularity.orderBy(
+                sf.col("relevance").desc(), "item_idx"
+            ).limit(size),
+            ["item_idx", "relevance"],
+        )
+        return top["item_idx"], top["relevance"]
+
+    def _fit_ranking(self) -> None:
+        """Save top of the popularity ranking to the driver"""
+        self.item_ranking = self._rank_items(
+            self.item_popularity, self.ranking_size
+        )
+
+    def _load_model(self, path: str):
+        self._fit_ranking()
+
+    def _candidate_ranking(
+        self, items: DataFrame, size: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get ``size`` most popular candidate items,
+        the saved ranking is used if it has enough candidates
+        """
+        item_ids, relevance = self.item_ranking
+        candidates = spark_to_numpy(items, ["item_idx"])["item_idx"]
+        is_candidate = np.isin(item_ids, candidates)
+        if is_candidate.sum() >= size or len(item_ids) < self.ranking_size:
+            return (
+                item_ids[is_candidate][:size],
+                relevance[is_candidate][:size],
+            )
+        return self._rank_items(
+            self.item_popularity.join(items, on="item_idx"), size
+        )
+
     # pylint: disable=too-many-arguments
     def _predict(
         self,
@@ -115,40 +168,52 @@ class PopRec(Recommender):
         item_features: Optional[DataFrame] = None,
         filter_seen_items: bool = True,
     ) -> DataFrame:
-        selected_item_popularity = self.item_popularity.join(
-            items, on="item_idx", how="inner",
-        ).withColumn(
-            "rank",
-            sf.row_number().over(Window.orderBy(sf.col("relevance").desc())),
-        )
-
-        if not filter_seen_items:
-            return users.crossJoin(
-                selected_item_popularity.filter(sf.col("rank") <= k)
-            ).drop("rank")
-
-        log_by_user = (
-            log.join(users, on="user_idx")
-            .groupBy("user_idx")
-            .agg(sf.countDistinct("item_idx").alias("items_count"))
+        empty = sf.array().cast("array<int>")
+        users = users.select("user_idx")
+        if filter_seen_items:
+            seen = (
+                log.join(users, on="user_idx")
+                .groupBy("user_idx")
+                .agg(sf.collect_set("item_idx").alias("seen"))
+            )
+            max_seen = seen.select(sf.max(sf.size("seen"))).first()[0] or 0
+            users = users.join(seen, on="user_idx", how="left")
+        else:
+            max_seen = 0
+            users = users.withColumn("seen", empty)
+
+        item_ids, relevance = self._candidate_ranking(items, max_seen + k)
+        ranking = State().session.createDataFrame(
+            [
+                (
+                    item_ids.tolist(),
+                    dict(zip(item_ids.tolist(), relevance.tolist())),
+                )
+            ],
+            "ranking array<int>, ranking_relevance map<int,double>",
         )
-        max_history_len = log_by_user.select(sf.max("items_count")).collect()[
-            0
-        ][0]
-        cropped_item_popularity = selected_item_popularity.filter(
-            sf.col("rank") <= max_history_len + k
+        return (
+            users.crossJoin(sf.broadcast(ranking))
+            .select(
+                "user_idx",
+                "ranking_relevance",
+                sf.explode(
+                    sf.slice(
+                        sf.array_except(
+                            "ranking", sf.coalesce("seen", empty)
+                        ),
+                        1,
+                        k,
+                    )
+                ).alias("item_idx"),
+            )
+            .select(
+                "user_idx",
+                "item_idx",
+                sf.expr("ranking_relevance[item_idx]").alias("relevance"),
+            )
         )
 
-        log_by_user_with_new_users = log_by_user.join(
-            users, on="user_idx", how="right"
-        ).fillna(0)
-        recs = log_by_user_with_new_users.join(
-            cropped_item_popularity,
-            on=sf.col("rank") <= sf.col("items_count") + sf.lit(k),
-        ).drop("rank", "items_count")
-
-        return recs
-
     def _predict_pairs(
         self,
         pairs: DataFrame,
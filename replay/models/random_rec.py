@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Iterator, Optional
 
 import numpy as np
 import pandas as pd
@@ -9,6 +9,8 @@ from pyspark.sql import functions as sf
 
 from replay.models.base_rec import Recommender
 from replay.constants import IDX_REC_SCHEMA
+from replay.sampling import gumbel_top_k
+from replay.session_handler import State
 
 
 class RandomRec(Recommender):
@@ -72,22 +74,22 @@ class RandomRec(Recommender):
     +-------+-------+------------------+
     |user_id|item_id|         relevance|
     +-------+-------+------------------+
-    |      1|      3|               1.0|
-    |      2|      1|               0.5|
+    |      1|      3|0.3333333333333333|
+    |      2|      1|0.3333333333333333|
     |      3|      2|               1.0|
-    |      3|      1|               0.5|
-    |      4|      2|               1.0|
-    |      4|      1|0.3333333333333333|
+    |      3|      1|0.3333333333333333|
+    |      4|      1|               0.5|
+    |      4|      2|0.3333333333333333|
     +-------+-------+------------------+
     <BLANKLINE>
     >>> recs = random_pop.predict(log, 2, users=[1], items=[7, 8])
-    >>> recs.show()
-    +-------+-------+---------+
-    |user_id|item_id|relevance|
-    +-------+-------+---------+
-    |      1|      8|      1.0|
-    |      1|      7|      0.5|
-    +-------+-------+---------+
+    >>> recs.select("user_id", "item_id").orderBy("item_id").show()
+    +-------+-------+
+    |user_id|item_id|
+    +-------+-------+
+    |      1|      7|
+    |      1|      8|
+    +-------+-------+
     <BLANKLINE>
     >>> random_pop = RandomRec(seed=555)
     >>> random_pop.fit(log)
@@ -114,6 +116,9 @@ class RandomRec(Recommender):
 
     item_popularity: DataFrame
     fill: float
+    batch_size: int = 1000
+    #: upper bound on the size of ``users x items`` matrix sampled at once
+    max_batch_cells: int = 10 ** 7
 
     def __init__(
         self,
@@ -246,26 +251,43 @@ class RandomRec(Recommender):
         ).fillna(self.fill)
 
         items_np, probs_np = self._get_ids_and_probs_pd(filtered_popularity)
+        if probs_np is None:
+            log_probs = np.zeros(len(items_np))
+        else:
+            with np.errstate(divide="ignore"):
+                log_probs = np.log(probs_np)
+        broadcast = State().session.sparkContext.broadcast(
+            (items_np, log_probs)
+        )
         seed = self.seed
+        # keep a dense ``batch_size x n_items`` matrix of scores bounded
+        max_rows = self.max_batch_cells // max(len(items_np), 1)
+        batch_size = max(1, min(self.batch_size, max_rows))
 
-        def grouped_map(pandas_df: pd.DataFrame) -> pd.DataFrame:
-            user_idx = pandas_df["user_idx"][0]
-            cnt = pandas_df["cnt"][0]
-            if seed is not None:
-                local_rng = default_rng(seed + user_idx)
-            else:
-                local_rng = default_rng()
-            items_idx = local_rng.choice(
-                items_np, size=cnt, p=probs_np, replace=False,
-            )
-            relevance = 1 / np.arange(1, cnt + 1)
-            return pd.DataFrame(
-                {
-                    "user_idx": cnt * [user_idx],
-                    "item_idx": items_idx,
-                    "relevance": relevance,
-                }
-            )
+        def sample_blocks(
+            iterator: Iterator[pd.DataFrame],
+        ) -> Iterator[pd.DataFrame]:
+            items, item_log_probs = broadcast.value
+            rng = default_rng()
+            for pandas_df in iterator:
+                for start in range(0, len(pandas_df), batch_size):
+                    batch = pandas_df.iloc[start : start + batch_size]
+                    user_idx = batch["user_idx"].values
+                    rows, cols, ranks = gumbel_top_k(
+                        item_log_probs,
+                        batch["cnt"].values,
+                        user_idx,
+                        items,
+                        seed,
+                        rng,
+                    )
+                    yield pd.DataFrame(
+                        {
+                            "user_idx": user_idx[rows],
+                            "item_idx": items[cols],
+                            "relevance": 1 / (ranks + 1),
+                        }
+                    )
 
         recs = (
             log.join(users, how="right", on="user_idx")
@@ -275,8 +297,7 @@ class RandomRec(Recommender):
             .selectExpr(
                 "user_idx", f"LEAST(cnt + {k}, {items_np.shape[0]}) AS cnt",
             )
-            .groupby("user_idx")
-            .applyInPandas(grouped_map, IDX_REC_SCHEMA)
+            .mapInPandas(sample_blocks, IDX_REC_SCHEMA)
         )
 
         return recs
@@ -3,12 +3,10 @@ from typing import Optional
 import numpy as np
 import pandas as pd
 from pyspark.sql import DataFrame
-from pyspark.sql import types as st
-from scipy.sparse import csc_matrix
 from sklearn.linear_model import ElasticNet
 
+from replay.arrow_transfer import numpy_to_spark
 from replay.models.base_rec import NeighbourRec
-from replay.session_handler import State
 
 
 class SLIM(NeighbourRec):
@@ -47,16 +45,10 @@ class SLIM(NeighbourRec):
         user_features: Optional[DataFrame] = None,
         item_features: Optional[DataFrame] = None,
     ) -> None:
-        pandas_log = log.select("user_idx", "item_idx", "relevance").toPandas()
-
-        interactions_matrix = csc_matrix(
-            (pandas_log.relevance, (pandas_log.user_idx, pandas_log.item_idx)),
-            shape=(self.users_count, self.items_count),
-        )
-        similarity = (
-            State()
-            .session.createDataFrame(pandas_log.item_idx, st.IntegerType())
-            .withColumnRenamed("value", "item_id_one")
+        interactions_matrix = self._interaction_matrix(log).csc
+        log_items = np.flatnonzero(np.diff(interactions_matrix.indptr))
+        similarity = numpy_to_spark(
+            {"item_id_one": log_items.astype(np.int32)}
         )
 
         alpha = self.beta + self.lambda_
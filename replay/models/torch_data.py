@@ -0,0 +1,353 @@
+"""
+Streaming training data for neural models.
+
+Indexed log is written once into parquet shards
+and read by ``torch`` data loader workers batch by batch,
+so the whole log is never collected to the driver.
+"""
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import fs as pafs
+import torch
+from pyspark.sql import DataFrame
+from scipy.sparse import csr_matrix
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from replay.session_handler import State
+
+
+def _hadoop_path(path: str):
+    """
+    :param path: local path or file system URI
+    :return: hadoop ``Path`` and its ``FileSystem``
+    """
+    session = State().session
+    # pylint: disable=protected-access
+    hadoop_path = session._jvm.org.apache.hadoop.fs.Path(path)
+    return (
+        hadoop_path,
+        hadoop_path.getFileSystem(session._jsc.hadoopConfiguration()),
+    )
+
+
+def _local_dir() -> str:
+    """
+    :return: first ``spark.local.dir`` or a temporary directory
+    """
+    return (
+        State()
+        .session.conf.get("spark.local.dir", tempfile.gettempdir())
+        .split(",")[0]
+    )
+
+
+def _open(file: str) -> Union[str, pa.NativeFile]:
+    """
+    :param file: local path or file system URI
+    :return: object accepted by ``pyarrow.parquet`` readers
+    """
+    if "://" not in file:
+        return file
+    filesystem, path = pafs.FileSystem.from_uri(file)
+    return filesystem.open_input_file(path)
+
+
+def read_shards(files: List[str], columns: Sequence[str]) -> pa.Table:
+    """
+    Read shards written with ``write_shards`` into one table
+
+    :param files: shard files
+    :param columns: columns to read
+    :return: pyarrow table
+    """
+    return pa.concat_tables(
+        [pq.read_table(_open(file), columns=list(columns)) for file in files]
+    )
+
+
+def read_column_memmap(files: List[str], column: str) -> np.ndarray:
+    """
+    Read a numeric column of shards into a memory-mapped array
+    backed by an anonymous temporary file.
+    Shards are read one at a time,
+    so the column does not have to fit into driver memory.
+
+    :param files: shard files
+    :param column: column to read
+    :return: column values in the order of ``files``
+    """
+    sizes = [pq.ParquetFile(_open(file)).metadata.num_rows for file in files]
+    dtype = (
+        pq.read_schema(_open(files[0])).field(column).type.to_pandas_dtype()
+    )
+    if sum(sizes) == 0:
+        return np.empty(0, dtype=dtype)
+    with tempfile.TemporaryFile(dir=_local_dir()) as handle:
+        values = np.memmap(handle, dtype=dtype, mode="w+", shape=sum(sizes))
+    start = 0
+    for file, size in zip(files, sizes):
+        values[start : start + size] = (
+            pq.read_table(_open(file), columns=[column])
+            .column(column)
+            .to_numpy()
+        )
+        start += size
+    return values
+
+
+# pylint: disable=too-many-arguments
+def write_shards(
+    log: DataFrame,
+    num_shards: int,
+    group_by_user: bool = False,
+    columns: Sequence[str] = ("user_idx", "item_idx"),
+    path: Optional[str] = None,
+    sort_by: Optional[str] = None,
+) -> List[str]:
+    """
+    Save log to parquet shards
+
+    :param log: indexed log ``[user_idx, item_idx, ...]``
+    :param num_shards: number of files to write
+    :param group_by_user: put all interactions of a user into the same shard
+        sorted by ``user_idx``, otherwise rows are distributed randomly
+    :param columns: columns to save
+    :param path: directory shared by the driver and executors,
+        required unless Spark runs in local mode.
+        New directory in ``spark.local.dir`` or a temporary directory
+        is used in local mode by default.
+    :param sort_by: column to sort shards by,
+        so that rows of the returned files are sorted globally
+    :return: list of shard files
+    """
+    session = State().session
+    if path is None:
+        if not session.sparkContext.master.startswith("local"):
+            raise ValueError(
+                "path shared by the driver and executors is required "
+                "to write shards outside of local mode"
+            )
+        path = os.path.join(_local_dir(), f"shards_{uuid.uuid4().hex}")
+    data = log.select(*columns)
+    if sort_by is not None:
+        data = data.repartitionByRange(
+            num_shards, sort_by
+        ).sortWithinPartitions(sort_by)
+    elif group_by_user:
+        data = data.repartition(num_shards, "user_idx").sortWithinPartitions(
+            "user_idx"
+        )
+    else:
+        data = data.repartition(num_shards)
+    data.write.mode("overwrite").parquet(path)
+    hadoop_path, filesystem = _hadoop_path(path)
+    files = []
+    for status in filesystem.listStatus(hadoop_path):
+        uri = status.getPath().toUri()
+        if uri.getPath().endswith(".parquet"):
+            scheme = uri.getScheme()
+            files.append(
+                uri.getPath() if scheme in (None, "file") else uri.toString()
+            )
+    if not files:
+        raise ValueError(
+            f"No shards found in {path}, "
+            "it should be readable by the driver"
+        )
+    return sorted(files)
+
+
+def remove_shards(files: List[str]) -> None:
+    """
+    Delete shards written with ``write_shards``
+
+    :param files: shard files
+    """
+    if not files:
+        return
+    if "://" not in files[0]:
+        shutil.rmtree(os.path.dirname(files[0]), ignore_errors=True)
+    else:
+        hadoop_path, filesystem = _hadoop_path(files[0])
+        filesystem.delete(hadoop_path.getParent(), True)
+
+
+class _ShardDataset(IterableDataset):
+    """Base class splitting shards between data loader workers"""
+
+    def __init__(
+        self, files: List[str], shuffle: bool = True, seed: int = 42,
+    ):
+        """
+        :param files: parquet shards
+        :param shuffle: shuffle shards and rows inside them on every epoch
+        :param seed: random seed
+        """
+        super().__init__()
+        self.files = files
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.rank = 0
+        self.world_size = 1
+
+    def set_rank(self, rank: int, world_size: int) -> None:
+        """
+        Read only a part of shards in distributed training
+
+        :param rank: process rank
+        :param world_size: number of processes
+        """
+        self.rank = rank
+        self.world_size = world_size
+
+    def _worker_files(self) -> Tuple[List[str], np.random.Generator]:
+        worker_info = get_worker_info()
+        worker_id = 0 if worker_info is None else worker_info.id
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+        reader_id = self.rank * num_workers + worker_id
+        rng = np.random.default_rng([self.seed, self.epoch, reader_id])
+        files = list(self.files)
+        if self.shuffle:
+            np.random.default_rng([self.seed, self.epoch]).shuffle(files)
+        self.epoch += 1
+        return files[reader_id :: self.world_size * num_workers], rng
+
+
+class InteractionDataset(_ShardDataset):
+    """
+    Yields shuffled batches of ``(user_idx, item_idx)`` tensors.
+    Rows are shuffled within a buffer of ``shuffle_buffer`` batches.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        files: List[str],
+        batch_size: int,
+        shuffle: bool = True,
+        seed: int = 42,
+        shuffle_buffer: int = 10,
+    ):
+        """
+        :param files: parquet shards with ``[user_idx, item_idx]``
+        :param batch_size: number of rows in a batch
+        :param shuffle: shuffle data on every epoch
+        :param seed: random seed
+        :param shuffle_buffer: number of batches read before shuffling
+        """
+        super().__init__(files, shuffle, seed)
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+
+    def _buffers(self, files: List[str]) -> Iterator[np.ndarray]:
+        buffer: List[np.ndarray] = []
+        buffer_rows = 0
+        for file in files:
+            for record_batch in pq.ParquetFile(_open(file)).iter_batches(
+                batch_size=self.batch_size, columns=["user_idx", "item_idx"]
+            ):
+                buffer.append(
+                    np.stack(
+                        [
+                            record_batch.column(0).to_numpy(),
+                            record_batch.column(1).to_numpy(),
+                        ],
+                        axis=1,
+                    )
+                )
+                buffer_rows += record_batch.num_rows
+                if buffer_rows >= self.batch_size * self.shuffle_buffer:
+                    yield np.concatenate(buffer)
+                    buffer, buffer_rows = [], 0
+        if buffer:
+            yield np.concatenate(buffer)
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        files, rng = self._worker_files()
+        for rows in self._buffers(files):
+            if self.shuffle:
+                rows = rows[rng.permutation(len(rows))]
+            for start in range(0, len(rows), self.batch_size):
+                batch = torch.from_numpy(
+                    rows[start : start + self.batch_size].astype(np.int64)
+                )
+                yield batch[:, 0], batch[:, 1]
+
+
+class UserBatchDataset(_ShardDataset):
+    """
+    Yields ``csr_matrix`` batches of ``batch_size`` users.
+    Shards must be written with ``group_by_user=True``.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        files: List[str],
+        batch_size: int,
+        items_count: int,
+        shuffle: bool = True,
+        seed: int = 42,
+    ):
+        """
+        :param files: parquet shards with ``[user_idx, item_idx]``
+        :param batch_size: number of users in a batch
+        :param items_count: number of columns in a batch
+        :param shuffle: shuffle users on every epoch
+        :param seed: random seed
+        """
+        super().__init__(files, shuffle, seed)
+        self.batch_size = batch_size
+        self.items_count = items_count
+
+    def __iter__(self) -> Iterator[csr_matrix]:
+        files, rng = self._worker_files()
+        for file in files:
+            table = pq.read_table(
+                _open(file), columns=["user_idx", "item_idx"]
+            )
+            if table.num_rows == 0:
+                continue
+            users = table.column("user_idx").to_numpy()
+            items = table.column("item_idx").to_numpy()
+            _, codes = np.unique(users, return_inverse=True)
+            matrix = csr_matrix(
+                (np.ones(len(items), dtype=np.float32), (codes, items)),
+                shape=(codes.max() + 1, self.items_count),
+            )
+            order = np.arange(matrix.shape[0])
+            if self.shuffle:
+                rng.shuffle(order)
+            for start in range(0, len(order), self.batch_size):
+                yield matrix[order[start : start + self.batch_size]]
+
+
+def streaming_loader(
+    dataset: _ShardDataset, num_workers: int = 0, prefetch_factor: int = 2,
+) -> DataLoader:
+    """
+    Wrap a shard dataset into ``DataLoader``.
+    Datasets form batches themselves, so automatic batching is disabled.
+
+    :param dataset: shard dataset
+    :param num_workers: number of worker processes
+    :param prefetch_factor: number of batches loaded in advance by each worker
+    :return: data loader
+    """
+    if num_workers > 0:
+        return DataLoader(
+            dataset,
+            batch_size=None,
+            num_workers=num_workers,
+            prefetch_factor=prefetch_factor,
+            persistent_workers=True,
+        )
+    return DataLoader(dataset, batch_size=None)
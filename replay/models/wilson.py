@@ -73,3 +73,4 @@ class Wilson(PopRec):
 
         self.item_popularity = items_counts.drop("pos", "total")
         self.item_popularity.cache()
+        self._fit_ranking()
@@ -0,0 +1,347 @@
+"""
+Vectorized sampling helpers:
+
+- alias tables for sampling from discrete distributions in O(1) per draw
+- negative sampler excluding items the user interacted with
+- Gumbel-top-k sampling without replacement for batches of users
+"""
+from typing import Optional, Tuple
+
+import numba as nb
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from replay.utils import top_k_scores
+
+_KEYS_CHUNK = 1 << 24
+
+
+@nb.njit
+def _build_alias_table(
+    probs: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:  # pragma: no cover
+    size = len(probs)
+    scaled = probs * size
+    prob = np.ones(size)
+    alias = np.arange(size)
+    small = np.empty(size, dtype=np.int64)
+    large = np.empty(size, dtype=np.int64)
+    small_count = 0
+    large_count = 0
+    for i in range(size):
+        if scaled[i] < 1.0:
+            small[small_count] = i
+            small_count += 1
+        else:
+            large[large_count] = i
+            large_count += 1
+
+    while small_count > 0 and large_count > 0:
+        small_count -= 1
+        less = small[small_count]
+        large_count -= 1
+        more = large[large_count]
+        prob[less] = scaled[less]
+        alias[less] = more
+        scaled[more] = scaled[more] + scaled[less] - 1.0
+        if scaled[more] < 1.0:
+            small[small_count] = more
+            small_count += 1
+        else:
+            large[large_count] = more
+            large_count += 1
+
+    return prob, alias
+
+
+def build_alias_table(weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build Vose alias table for a discrete distribution
+
+    >>> prob, alias = build_alias_table(np.array([1., 1., 2.]))
+    >>> prob.round(2)
+    array([0.75, 0.75, 1.  ])
+    >>> alias
+    array([2, 2, 2])
+
+    :param weights: non-negative weights of outcomes, not necessarily normalized
+    :return: acceptance probabilities and alias outcomes
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    return _build_alias_table(weights / weights.sum())
+
+
+def sample_alias(
+    prob: np.ndarray,
+    alias: np.ndarray,
+    size: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    Draw samples with replacement from an alias table
+
+    :param prob: acceptance probabilities from ``build_alias_table``
+    :param alias: alias outcomes from ``build_alias_table``
+    :param size: number of samples
+    :param rng: numpy random generator
+    :return: sampled outcomes
+    """
+    idx = rng.integers(0, len(prob), size=size)
+    return np.where(rng.random(size) < prob[idx], idx, alias[idx])
+
+
+class NegativeSampler:
+    """
+    Samples negative items for users excluding their positives.
+
+    Positives are stored as a CSR matrix with sorted indices,
+    so checking a batch of candidates takes a single ``searchsorted``.
+    Items are drawn uniformly or proportionally to ``popularity ** alpha``
+    with an alias table.
+
+    >>> sampler = NegativeSampler.from_pairs(
+    ...     np.array([0, 0, 1]), np.array([0, 1, 2]), 2, 3, seed=42
+    ... )
+    >>> sampler.sample(np.array([0, 0, 0]), 2)
+    array([2, 2, 2, 2, 2, 2])
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        positives: csr_matrix,
+        alpha: float = 0.0,
+        max_tries: int = 10,
+        seed: Optional[int] = None,
+    ):
+        """
+        :param positives: ``users x items`` matrix of interactions
+        :param alpha: popularity exponent, ``0`` means uniform sampling
+        :param max_tries: number of resampling rounds for rejected candidates,
+            candidates still rejected after the last round are kept
+        :param seed: random seed
+        """
+        positives = positives.tocsr()
+        positives.sum_duplicates()
+        positives.sort_indices()
+        rows = np.repeat(
+            np.arange(positives.shape[0], dtype=np.int64),
+            np.diff(positives.indptr),
+        )
+        self._init_keys(
+            rows * positives.shape[1] + positives.indices,
+            positives.shape[1],
+            alpha,
+            max_tries,
+            seed,
+        )
+
+    # pylint: disable=too-many-arguments
+    def _init_keys(
+        self,
+        keys: np.ndarray,
+        items_count: int,
+        alpha: float,
+        max_tries: int,
+        seed: Optional[int],
+    ) -> None:
+        self.items_count = items_count
+        self.max_tries = max_tries
+        self.rng = np.random.default_rng(seed)
+        self._keys = keys
+        self._alias: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        if alpha != 0:
+            popularity = np.zeros(items_count, dtype=np.int64)
+            # keys may be memory-mapped, read them in chunks
+            for start in range(0, len(keys), _KEYS_CHUNK):
+                popularity += np.bincount(
+                    keys[start : start + _KEYS_CHUNK] % items_count,
+                    minlength=items_count,
+                )
+            self._alias = build_alias_table(
+                np.power(popularity.astype(np.float64), alpha)
+            )
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def from_pairs(
+        cls,
+        user_idx: np.ndarray,
+        item_idx: np.ndarray,
+        users_count: int,
+        items_count: int,
+        alpha: float = 0.0,
+        max_tries: int = 10,
+        seed: Optional[int] = None,
+    ) -> "NegativeSampler":
+        """
+        Create sampler from arrays of positive pairs
+
+        :param user_idx: users of positive pairs
+        :param item_idx: items of positive pairs
+        :param users_count: number of users
+        :param items_count: number of items
+        :param alpha: popularity exponent, ``0`` means uniform sampling
+        :param max_tries: number of resampling rounds for rejected candidates
+        :param seed: random seed
+        :return: negative sampler
+        """
+        positives = csr_matrix(
+            (np.ones(len(user_idx), dtype=np.int8), (user_idx, item_idx)),
+            shape=(users_count, items_count),
+        )
+        return cls(positives, alpha, max_tries, seed)
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def from_sorted_keys(
+        cls,
+        keys: np.ndarray,
+        items_count: int,
+        alpha: float = 0.0,
+        max_tries: int = 10,
+        seed: Optional[int] = None,
+    ) -> "NegativeSampler":
+        """
+        Create sampler from sorted unique keys of positive pairs
+        ``user_idx * items_count + item_idx``.
+        Keys are not copied, so they can be a ``np.memmap``
+        that does not fit into memory.
+
+        >>> sampler = NegativeSampler.from_sorted_keys(
+        ...     np.array([0, 1, 5]), 3, seed=42
+        ... )
+        >>> sampler.sample(np.array([0, 0, 0]), 2)
+        array([2, 2, 2, 2, 2, 2])
+
+        :param keys: sorted unique keys of positive pairs
+        :param items_count: number of items
+        :param alpha: popularity exponent, ``0`` means uniform sampling
+        :param max_tries: number of resampling rounds for rejected candidates
+        :param seed: random seed
+        :return: negative sampler
+        """
+        sampler = cls.__new__(cls)
+        sampler._init_keys(keys, items_count, alpha, max_tries, seed)
+        return sampler
+
+    def _draw(self, size: int) -> np.ndarray:
+        if self._alias is None:
+            return self.rng.integers(0, self.items_count, size=size)
+        return sample_alias(*self._alias, size, self.rng)
+
+    def is_positive(self, users: np.ndarray, items: np.ndarray) -> np.ndarray:
+        """
+        Check which pairs are positive
+
+        :param users: user indexes
+        :param items: item indexes
+        :return: boolean mask
+        """
+        keys = users.astype(np.int64) * self.items_count + items
+        pos = np.searchsorted(self._keys, keys)
+        pos[pos == len(self._keys)] = 0
+        return self._keys[pos] == keys if len(self._keys) else pos < 0
+
+    def sample(self, users: np.ndarray, count: int = 1) -> np.ndarray:
+        """
+        Sample ``count`` negatives for every user in a batch
+
+        :param users: user indexes of a batch
+        :param count: number of negatives per user
+        :return: array of ``len(users) * count`` items aligned with
+            ``np.tile(users, count)``
+        """
+        users = np.tile(users, count)
+        items = self._draw(len(users))
+        rejected = np.flatnonzero(self.is_positive(users, items))
+        for _ in range(self.max_tries):
+            if len(rejected) == 0:
+                break
+            items[rejected] = self._draw(len(rejected))
+            rejected = rejected[
+                self.is_positive(users[rejected], items[rejected])
+            ]
+        return items
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(
+        0xBF58476D1CE4E5B9
+    )
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(
+        0x94D049BB133111EB
+    )
+    return values ^ (values >> np.uint64(31))
+
+
+def hash_uniform(
+    seed: int, row_keys: np.ndarray, col_keys: np.ndarray
+) -> np.ndarray:
+    """
+    Matrix of uniform numbers from ``(0, 1)`` determined only by
+    ``seed`` and the keys of a row and a column,
+    so results do not depend on batching or ordering
+
+    >>> first = hash_uniform(42, np.array([1, 2]), np.array([5, 6, 7]))
+    >>> first.shape
+    (2, 3)
+    >>> np.allclose(first[1], hash_uniform(42, np.array([2]), np.array([5, 6, 7])))
+    True
+
+    :param seed: random seed
+    :param row_keys: integer keys of rows
+    :param col_keys: integer keys of columns
+    :return: ``len(row_keys) x len(col_keys)`` array
+    """
+    seed_key = _splitmix64(np.array([seed & 0xFFFFFFFFFFFFFFFF], np.uint64))
+    rows = _splitmix64(row_keys.astype(np.uint64) ^ seed_key)
+    bits = _splitmix64(rows[:, np.newaxis] ^ col_keys.astype(np.uint64))
+    return ((bits >> np.uint64(11)).astype(np.float64) + 0.5) / 2.0 ** 53
+
+
+# pylint: disable=too-many-arguments
+def gumbel_top_k(
+    log_probs: np.ndarray,
+    counts: np.ndarray,
+    user_keys: np.ndarray,
+    item_keys: np.ndarray,
+    seed: Optional[int] = None,
+    rng: Optional[np.random.Generator] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sample ``counts[i]`` items without replacement for every user in a batch.
+    Items with the largest ``log_probs + Gumbel noise`` are taken,
+    which is equivalent to sequential sampling proportionally
+    to probabilities. With ``seed`` the noise depends only on
+    ``(seed, user key, item key)``, so every user gets the same sample
+    regardless of the batch it is processed in.
+
+    >>> rows, cols, ranks = gumbel_top_k(
+    ...     np.log([0.5, 0.3, 0.2]), np.array([3, 1]),
+    ...     np.array([10, 11]), np.arange(3), seed=1
+    ... )
+    >>> rows, ranks
+    (array([0, 0, 0, 1]), array([0, 1, 2, 0]))
+
+    :param log_probs: logarithms of item probabilities,
+        items with ``-inf`` are never sampled
+    :param counts: number of items to sample for every user
+    :param user_keys: integer keys of users
+    :param item_keys: integer keys of items
+    :param seed: random seed
+    :param rng: random generator used when ``seed`` is not set
+    :return: user positions in a batch, sampled item positions
+        and their ranks in the sample
+    """
+    if seed is None:
+        rng = rng or np.random.default_rng()
+        uniform = rng.random((len(user_keys), len(log_probs)))
+    else:
+        uniform = hash_uniform(seed, user_keys, item_keys)
+    keys = log_probs - np.log(-np.log(uniform))
+    rows, cols, _ = top_k_scores(keys, int(counts.max(initial=0)))
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = ranks < counts[rows]
+    return rows[keep], cols[keep], ranks[keep]
@@ -11,5 +11,10 @@ from replay.splitters.log_splitter import (
     ColdUserRandomSplitter,
     DateSplitter,
     RandomSplitter,
+    RollingDateSplitter,
+)
+from replay.splitters.user_log_splitter import (
+    UserSplitter,
+    assign_folds,
+    k_folds,
 )
-from replay.splitters.user_log_splitter import UserSplitter, k_folds
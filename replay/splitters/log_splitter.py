@@ -7,16 +7,18 @@ These kind of splitters process log as a whole:
 
 """
 
-from datetime import datetime
-from typing import Optional, Union
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Union
 
 import pyspark.sql.functions as sf
-from pyspark.sql import DataFrame, Window
+from pyspark.sql import Column, DataFrame, Window
 
+from replay.constants import AnyDataFrame
 from replay.splitters.base_splitter import (
     Splitter,
     SplitterReturnType,
 )
+from replay.utils import convert2spark
 
 
 # pylint: disable=too-few-public-methods
@@ -61,6 +63,143 @@ class DateSplitter(Splitter):
         return train, test
 
 
+class RollingDateSplitter:
+    """
+    Rolling origin split by a sequence of dates.
+    Window ``i`` trains on all records before ``cut_dates[i]``
+    and tests on records from ``cut_dates[i]`` up to the next cut date
+    or for ``test_duration``.
+
+    Log is cached once sorted by timestamp inside partitions,
+    so every window reads only cached batches with matching dates.
+    Windows themselves are not cached, and the log is released
+    after the last window.
+
+    >>> import pandas as pd
+    >>> data_frame = pd.DataFrame({"user_id": [1, 1, 2, 2, 3],
+    ...    "item_id": [1, 2, 1, 3, 2],
+    ...    "relevance": [1, 1, 1, 1, 1],
+    ...    "timestamp": [1, 2, 3, 4, 5]})
+    >>> splitter = RollingDateSplitter([2, 4])
+    >>> [(train.count(), test.count()) for train, test in splitter.split(data_frame)]
+    [(1, 2), (3, 2)]
+    """
+
+    def __init__(
+        self,
+        cut_dates: List[Union[datetime, str, int]],
+        test_duration: Optional[timedelta] = None,
+        drop_cold_items: bool = False,
+        drop_cold_users: bool = False,
+    ):
+        """
+        :param cut_dates: test start dates in ascending order,
+            strings ``yyyy-mm-dd``, int unix timestamps or datetimes
+        :param test_duration: length of test period,
+            test lasts until the next cut date by default
+        :param drop_cold_items: flag to drop cold items from test
+        :param drop_cold_users: flag to drop cold users from test
+        """
+        if not cut_dates:
+            raise ValueError("At least one cut date is required")
+        self.cut_dates = list(cut_dates)
+        self.test_duration = test_duration
+        self.drop_cold_items = drop_cold_items
+        self.drop_cold_users = drop_cold_users
+
+    @staticmethod
+    def _cache(log: AnyDataFrame) -> DataFrame:
+        return convert2spark(log).sortWithinPartitions("timestamp").cache()
+
+    @staticmethod
+    def _date(log: DataFrame, date, duration=None) -> Column:
+        """
+        :param log: log with ``timestamp`` column
+        :param date: date of any supported type
+        :param duration: time to add to ``date``
+        :return: date as a literal of ``timestamp`` type
+        """
+        date = sf.lit(date).cast("timestamp")
+        if duration is not None:
+            date = date + sf.expr(
+                f"INTERVAL {duration.total_seconds()} SECONDS"
+            )
+        return date.cast(dict(log.dtypes)["timestamp"])
+
+    def _window(self, log: DataFrame, i: int) -> SplitterReturnType:
+        """
+        :param log: cached log
+        :param i: number of window
+        :return: train and test DataFrames
+        """
+        start = self._date(log, self.cut_dates[i])
+        train = log.filter(sf.col("timestamp") < start)
+        test = log.filter(sf.col("timestamp") >= start)
+        if self.test_duration is not None:
+            end = self._date(log, self.cut_dates[i], self.test_duration)
+            test = test.filter(sf.col("timestamp") < end)
+        elif i + 1 < len(self.cut_dates):
+            end = self._date(log, self.cut_dates[i + 1])
+            test = test.filter(sf.col("timestamp") < end)
+        # pylint: disable=protected-access
+        test = Splitter._drop_cold_items_and_users(
+            train, test, self.drop_cold_items, self.drop_cold_users
+        )
+        return train, Splitter._filter_zero_relevance(test)
+
+    def split(self, log: AnyDataFrame) -> Iterator[SplitterReturnType]:
+        """
+        Splits input DataFrame for each cut date
+
+        :param log: input DataFrame ``[timestamp, user_id, item_id, relevance]``
+        :return: yields train and test DataFrames by windows
+        """
+        log = self._cache(log)
+        try:
+            for i in range(len(self.cut_dates)):
+                yield self._window(log, i)
+        finally:
+            log.unpersist()
+
+    def fit_windows(
+        self, model, log: AnyDataFrame, incremental: bool = False
+    ) -> Iterator[SplitterReturnType]:
+        """
+        Fits ``model`` on train of each window before yielding it.
+        Indexers of the previous window are kept and extended
+        only with users and items of records added since the previous
+        cut date, so they are not rebuilt from the whole train.
+
+        :param model: recommender to fit
+        :param log: input DataFrame ``[timestamp, user_id, item_id, relevance]``
+        :param incremental: update models with ``partial_fit``
+            on records added since the previous cut date
+            instead of fitting them on the whole train again
+        :return: yields train and test DataFrames by windows
+        """
+        log = self._cache(log)
+        try:
+            for i in range(len(self.cut_dates)):
+                train, test = self._window(log, i)
+                if i == 0:
+                    model.fit(train)
+                else:
+                    start = self._date(log, self.cut_dates[i - 1])
+                    end = self._date(log, self.cut_dates[i])
+                    added = log.filter(
+                        (sf.col("timestamp") >= start)
+                        & (sf.col("timestamp") < end)
+                    )
+                    if incremental and hasattr(model, "partial_fit"):
+                        model.partial_fit(added)
+                    else:
+                        model.extend_indexers(added)
+                        model.fit(train, force_reindex=False)
+                yield train, test
+        finally:
+            log.unpersist()
+
+
 # pylint: disable=too-few-public-methods
 class RandomSplitter(Splitter):
     """Assign records into train and test at random."""
@@ -1,15 +1,19 @@
 """
 This splitter split data for each user separately
 """
-from typing import Optional, Union
+import random
+from typing import List, Optional, Union
 
 import pyspark.sql.functions as sf
-from pyspark.sql import DataFrame, Window
+from pyspark.sql import Column, DataFrame, Window
 
 from replay.constants import AnyDataFrame
 from replay.splitters.base_splitter import Splitter, SplitterReturnType
 from replay.utils import convert2spark
 
+#: hashes are taken modulo this value to get uniform numbers in ``[0, 1)``
+HASH_RANGE = 2 ** 53
+
 
 # pylint: disable=too-few-public-methods
 class UserSplitter(Splitter):
@@ -79,6 +83,11 @@ class UserSplitter(Splitter):
     >>> UserSplitter(user_test_size=0.5, item_test_size=2, seed=42).split(data_frame)[-1].toPandas().user_id.nunique()
     1
 
+    ``use_hash`` takes users and random items by hashes of ids and ``seed``,
+    so split is the same for any partitioning and needs a single shuffle
+
+    >>> UserSplitter(item_test_size=2, use_hash=True, seed=42).split(data_frame)[-1].count()
+    4
     """
 
     # pylint: disable=too-many-arguments
@@ -90,6 +99,7 @@ class UserSplitter(Splitter):
         drop_cold_items: bool = False,
         drop_cold_users: bool = False,
         seed: Optional[int] = None,
+        use_hash: bool = False,
     ):
         """
         :param item_test_size: fraction or a number of items per user
@@ -100,6 +110,9 @@ class UserSplitter(Splitter):
         :param drop_cold_items: flag to drop cold items from test
         :param drop_cold_users: flag to drop cold users from test
         :param seed: random seed
+        :param use_hash: pick test users and random items by ``xxhash64``
+            of ids and ``seed`` instead of ``rand`` and sorting.
+            Fractional ``user_test_size`` is kept approximately then.
         """
         super().__init__(
             drop_cold_items=drop_cold_items, drop_cold_users=drop_cold_users
@@ -108,6 +121,7 @@ class UserSplitter(Splitter):
         self.user_test_size = user_test_size
         self.shuffle = shuffle
         self.seed = seed
+        self.use_hash = use_hash
 
     def _get_test_users(self, log: DataFrame,) -> DataFrame:
         """
@@ -216,11 +230,90 @@ class UserSplitter(Splitter):
         ).drop("rand", "row_num", "test_user")
         return train, test
 
+    def _hash_test_users(self, log: DataFrame, seed: int) -> Column:
+        """
+        :param log: input DataFrame
+        :param seed: random seed
+        :return: condition which is true for test users
+        """
+        user_hash = sf.xxhash64("user_id", sf.lit(seed))
+        if self.user_test_size is None:
+            return sf.lit(True)
+        if isinstance(self.user_test_size, int):
+            hashes = [
+                row[0]
+                for row in log.select(user_hash.alias("hash"))
+                .distinct()
+                .orderBy("hash")
+                .limit(self.user_test_size + 1)
+                .collect()
+            ]
+            if 1 <= self.user_test_size < len(hashes):
+                return user_hash <= hashes[self.user_test_size - 1]
+        elif 1 > self.user_test_size > 0:
+            return (
+                sf.pmod(user_hash, sf.lit(HASH_RANGE)) / HASH_RANGE
+                < self.user_test_size
+            )
+        raise ValueError(
+            f"""
+                Invalid value for user_test_size: {self.user_test_size}
+                """
+        )
+
+    def _split_hash(self, log: DataFrame) -> SplitterReturnType:
+        """
+        Split with hashes instead of random numbers.
+        Ranks and counts are calculated in one window.
+
+        :param log: input DataFrame `[timestamp, user_id, item_id, relevance]`
+        :return: train and test DataFrames
+        """
+        seed = random.randrange(2 ** 31) if self.seed is None else self.seed
+        row_hash = sf.xxhash64(*_hash_keys(log), sf.lit(seed))
+        if self.shuffle:
+            order = [row_hash]
+        else:
+            order = [sf.col("timestamp").desc(), row_hash]
+        window = Window.partitionBy("user_id").orderBy(*order)
+        res = (
+            log.withColumn(
+                "test_user", sf.when(self._hash_test_users(log, seed), 1)
+            )
+            .withColumn("row_num", sf.row_number().over(window))
+            .withColumn(
+                "count",
+                sf.count("*").over(
+                    window.rowsBetween(
+                        Window.unboundedPreceding, Window.unboundedFollowing
+                    )
+                ),
+            )
+        )
+        if self.item_test_size < 1:
+            is_test = sf.col("row_num") / sf.col("count") <= sf.lit(
+                self.item_test_size
+            )
+        else:
+            is_test = sf.col("row_num") <= sf.lit(self.item_test_size)
+        is_test = is_test & sf.col("test_user").isNotNull()
+        train = res.filter(~is_test).drop("row_num", "count", "test_user")
+        test = res.filter(is_test).drop("row_num", "count", "test_user")
+        return train, test
+
     def _core_split(self, log: DataFrame) -> SplitterReturnType:
         if 0 <= self.item_test_size < 1.0:
-            train, test = self._split_proportion(log)
+            train, test = (
+                self._split_hash(log)
+                if self.use_hash
+                else self._split_proportion(log)
+            )
         elif self.item_test_size >= 1 and isinstance(self.item_test_size, int):
-            train, test = self._split_quantity(log)
+            train, test = (
+                self._split_hash(log)
+                if self.use_hash
+                else self._split_quantity(log)
+            )
         else:
             raise ValueError(
                 "`test_size` value must be [0, 1) or "
@@ -265,6 +358,43 @@ class UserSplitter(Splitter):
         return res
 
 
+def _hash_keys(dataframe: DataFrame) -> List[str]:
+    """
+    :param dataframe: input DataFrame
+    :return: columns identifying records to hash
+    """
+    return [
+        column
+        for column in ["user_id", "item_id", "timestamp"]
+        if column in dataframe.columns
+    ]
+
+
+def assign_folds(
+    log: AnyDataFrame, n_folds: int = 5, seed: Optional[int] = None,
+) -> DataFrame:
+    """
+    Adds ``fold`` column with a fold number from ``0`` to ``n_folds - 1``.
+    Fold is a hash of ``user_id``, ``item_id``, ``timestamp`` and ``seed``,
+    so it is computed without sorting and does not depend on partitioning.
+    Records with the same keys get into the same fold.
+
+    :param log: input DataFrame
+    :param n_folds: number of folds
+    :param seed: random seed
+    :return: log with ``fold`` column
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    dataframe = convert2spark(log)
+    return dataframe.withColumn(
+        "fold",
+        sf.pmod(
+            sf.xxhash64(*_hash_keys(dataframe), sf.lit(seed)), sf.lit(n_folds)
+        ),
+    )
+
+
 def k_folds(
     log: AnyDataFrame,
     n_folds: Optional[int] = 5,
@@ -272,7 +402,12 @@ def k_folds(
     splitter: Optional[str] = "user",
 ) -> SplitterReturnType:
     """
-    Splits log inside each user into folds at random
+    Splits log inside each user into folds at random.
+    Folds are assigned once with ``assign_folds`` and cached,
+    records are sorted by fold inside partitions
+    so each fold reads only the cached batches it needs.
+    Cache is released after the last fold, folds used later
+    are recomputed from ``log`` with the same assignment.
 
     :param log: input DataFrame
     :param n_folds: number of folds
@@ -283,13 +418,15 @@ def k_folds(
     if splitter not in {"user"}:
         raise ValueError(f"Wrong splitter parameter: {splitter}")
     if splitter == "user":
-        dataframe = convert2spark(log).withColumn("rand", sf.rand(seed))
-        dataframe = dataframe.withColumn(
-            "fold",
-            sf.row_number().over(Window.partitionBy("user_id").orderBy("rand"))
-            % n_folds,
-        ).drop("rand")
-        for i in range(n_folds):
-            train = dataframe.filter(f"fold != {i}").drop("fold")
-            test = dataframe.filter(f"fold == {i}").drop("fold")
-            yield train, test
+        dataframe = (
+            assign_folds(log, n_folds, seed)
+            .sortWithinPartitions("fold")
+            .cache()
+        )
+        try:
+            for i in range(n_folds):
+                train = dataframe.filter(f"fold != {i}").drop("fold")
+                test = dataframe.filter(f"fold == {i}").drop("fold")
+                yield train, test
+        finally:
+            dataframe.unpersist()
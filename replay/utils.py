@@ -1,4 +1,4 @@
-from typing import Any, List, Optional, Set, Union
+from typing import Any, List, Optional, Set, Tuple, Union
 
 import numpy as np
 import pyspark.sql.types as st
@@ -7,6 +7,7 @@ from pyspark.ml.linalg import DenseVector, Vectors, VectorUDT
 from pyspark.sql import Column, DataFrame, Window, functions as sf
 from scipy.sparse import csr_matrix
 
+from replay.interaction_matrix import interaction_cache
 from replay.constants import NumType, AnyDataFrame
 from replay.session_handler import State
 
@@ -352,7 +353,9 @@ def to_csr(
     item_count: Optional[int] = None,
 ) -> csr_matrix:
     """
-    Convert DataFrame to csr matrix
+    Convert DataFrame to csr matrix.
+    The matrix is taken from the shared interaction cache
+    and must not be modified in place.
 
     >>> import pandas as pd
     >>> from replay.utils import convert2spark
@@ -368,24 +371,64 @@ def to_csr(
     :param user_count: number of rows in resulting matrix
     :param item_count: number of columns in resulting matrix
     """
-    pandas_df = log.select("user_idx", "item_idx", "relevance").toPandas()
-    row_count = int(
-        user_count
-        if user_count is not None
-        else pandas_df["user_idx"].max() + 1
-    )
-    col_count = int(
-        item_count
-        if item_count is not None
-        else pandas_df["item_idx"].max() + 1
-    )
-    return csr_matrix(
-        (
-            pandas_df["relevance"],
-            (pandas_df["user_idx"], pandas_df["item_idx"]),
-        ),
-        shape=(row_count, col_count),
-    )
+    return interaction_cache.get(log, shape=(user_count, item_count)).csr
+
+
+def mask_seen(scores: np.ndarray, seen: csr_matrix) -> None:
+    """
+    Set scores of seen items to ``-inf`` in place
+
+    >>> scores = np.ones((2, 3))
+    >>> mask_seen(scores, csr_matrix(np.array([[1, 0, 0], [0, 0, 1]])))
+    >>> scores
+    array([[-inf,   1.,   1.],
+           [  1.,   1., -inf]])
+
+    :param scores: ``users x items`` scores of a batch
+    :param seen: ``users x items`` matrix of interactions of the same users,
+        items outside ``scores`` are ignored
+    """
+    rows = np.repeat(np.arange(seen.shape[0]), np.diff(seen.indptr))
+    cols = seen.indices
+    inside = cols < scores.shape[1]
+    scores[rows[inside], cols[inside]] = -np.inf
+
+
+def top_k_scores(
+    scores: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Select ``k`` best items in every row of a score matrix
+    with ``argpartition``. Items with ``-inf`` scores are skipped.
+
+    >>> rows, cols, values = top_k_scores(
+    ...     np.array([[0.1, 0.5, 0.3], [-np.inf, 0.2, -np.inf]]), 2
+    ... )
+    >>> rows
+    array([0, 0, 1])
+    >>> cols
+    array([1, 2, 1])
+    >>> values
+    array([0.5, 0.3, 0.2])
+
+    :param scores: ``users x items`` scores of a batch
+    :param k: number of items to select
+    :return: row indexes, column indexes and scores of selected items,
+        sorted by score within a row
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=scores.dtype)
+    cols = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(scores, cols, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    cols = np.take_along_axis(cols, order, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    rows = np.repeat(np.arange(scores.shape[0]), k)
+    cols, values = cols.ravel(), values.ravel()
+    finite = np.isfinite(values)
+    return rows[finite], cols[finite], values[finite]
 
 
 def horizontal_explode(
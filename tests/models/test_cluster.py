@@ -39,3 +39,25 @@ def test_base_predict_pairs(model):
     )
     assert res.count() == 1
     assert res.select("item_id").collect()[0][0] == 1
+
+
+@pytest.mark.parametrize("top_n", [1, 1000])
+def test_top_items(model, top_n):
+    model.top_n = top_n
+    model.num_clusters = 2
+    log = pd.concat([train, pd.DataFrame({"user_id": [1], "item_id": [2]})])
+    model.fit(log, user_features)
+    assert (
+        model.cluster_top_items.selectExpr("max(size(top_items))").first()[0]
+        <= top_n
+    )
+    full = model.predict(user_features, k=3, filter_seen_items=False)
+    seen = model.predict(user_features, k=1, log=log)
+    recs = full.toPandas()
+    for user_id, user_recs in seen.toPandas().groupby("user_id"):
+        user_seen = set(log[log.user_id == user_id].item_id)
+        assert not set(user_recs.item_id) & user_seen
+        expected = recs[
+            (recs.user_id == user_id) & ~recs.item_id.isin(user_seen)
+        ].relevance.max()
+        assert user_recs.relevance.iloc[0] == expected
@@ -0,0 +1,46 @@
+# pylint: disable=redefined-outer-name, missing-function-docstring, unused-import
+import numpy as np
+import pytest
+from implicit.als import AlternatingLeastSquares
+from implicit.nearest_neighbours import CosineRecommender
+
+from replay.models import ImplicitWrap
+from tests.utils import log, spark
+
+
+@pytest.fixture
+def model():
+    return ImplicitWrap(
+        AlternatingLeastSquares(factors=2, iterations=5, random_state=42)
+    )
+
+
+def test_predict_batches_match_recommend(log, model):
+    model.batch_size = 2
+    model.fit(log)
+    recs = model._convert_index(model.predict(log, k=2)).toPandas()
+    user_items = model._interaction_matrix(model._convert_index(log)).csr
+    for user_idx, user_recs in recs.groupby("user_idx"):
+        expected = model.model.recommend(int(user_idx), user_items, 2)
+        assert user_recs.sort_values(
+            "relevance", ascending=False
+        ).item_idx.tolist() == [item for item, _ in expected]
+        assert np.allclose(
+            user_recs.relevance.sort_values(ascending=False),
+            [score for _, score in expected],
+        )
+
+
+def test_items_filter(log, model):
+    model.fit(log)
+    items = log.select("item_id").distinct().limit(2)
+    recs = model.predict(log, k=3, items=items, filter_seen_items=False)
+    allowed = {row.item_id for row in items.collect()}
+    assert {row.item_id for row in recs.collect()} <= allowed
+
+
+def test_non_factor_model(log):
+    model = ImplicitWrap(CosineRecommender())
+    model.fit(log)
+    recs = model.predict(log, k=1)
+    assert recs.count() > 0
@@ -184,3 +184,52 @@ def test_enrich_with_features(log, user_features, item_features, model):
                 item_f,
                 test_pair,
             )
+
+
+def test_partial_fit(log, spark, model):
+    model.fit(log.filter(sf.col("user_id") != "u3"))
+    embeddings = model.model.user_embeddings.copy()
+    assert embeddings.shape[0] == 2
+    new_log = spark.createDataFrame(
+        data=[["u3", "i3", datetime(2019, 1, 2), 2.0]], schema=LOG_SCHEMA
+    )
+    model.partial_fit(new_log, epochs=1)
+    assert model.num_of_warm_users == 3
+    assert model.num_of_warm_items == 3
+    assert model.model.user_embeddings.shape[0] == 3
+    assert model.model.item_embeddings.shape[0] == 3
+    assert np.allclose(model.model.user_embeddings[:2], embeddings)
+    pred = model.predict(log=log, k=1, users=["u3"], filter_seen_items=False)
+    assert pred.count() == 1
+
+
+def test_partial_fit_keeps_scalers(log, user_features, item_features, model):
+    model.fit(log, user_features, item_features)
+    scalers = model.user_feat_scaler, model.item_feat_scaler
+    model.partial_fit(log, user_features, item_features, epochs=1)
+    assert (model.user_feat_scaler, model.item_feat_scaler) == scalers
+    with pytest.raises(ValueError, match="User features are missing.*"):
+        model.partial_fit(log, None, item_features)
+
+
+def test_predict_matches_pairs(log, user_features, item_features, model):
+    model.batch_size = 2
+    model.fit(log, user_features, item_features)
+    recs = model.predict(
+        log=log,
+        k=3,
+        user_features=user_features,
+        item_features=item_features,
+        filter_seen_items=False,
+    )
+    pairs = model.predict_pairs(
+        recs.select("user_id", "item_id"),
+        user_features=user_features,
+        item_features=item_features,
+    )
+    joined = recs.join(
+        pairs.withColumnRenamed("relevance", "pair_relevance"),
+        on=["user_id", "item_id"],
+    ).toPandas()
+    assert len(joined) == recs.count()
+    assert np.allclose(joined["relevance"], joined["pair_relevance"])
@@ -8,6 +8,7 @@ import numpy as np
 from replay.constants import LOG_SCHEMA
 from replay.models import NeuroMF
 from replay.models.neuromf import NMF
+from replay.models.torch_data import read_shards, remove_shards, write_shards
 from tests.utils import del_files_by_pattern, find_file_by_pattern, spark
 
 
@@ -92,6 +93,24 @@ def test_predict(log, model):
     )
 
 
+def test_streaming_fit(log, model):
+    model.streaming = True
+    model.num_shards = 2
+    model.fit(log)
+    pred = model.predict(log=log, k=1)
+    assert pred.count() == 3
+
+
+def test_streaming_negative_sampler(log, model):
+    model.fit(log)
+    keys = np.asarray(model.negative_sampler._keys)
+    model.streaming = True
+    model.num_shards = 2
+    model.fit(log)
+    assert isinstance(model.negative_sampler._keys, np.memmap)
+    assert np.array_equal(model.negative_sampler._keys, keys)
+
+
 def test_check_gmf_only(log):
     params = {"learning_rate": 0.5, "epochs": 1, "embedding_gmf_dim": 2}
     model = NeuroMF(**params)
@@ -163,3 +182,41 @@ def test_embeddings_size():
 def test_negative_dims_exception():
     with pytest.raises(ValueError):
         NeuroMF(embedding_gmf_dim=-2, embedding_mlp_dim=-1)
+
+
+def test_data_parallel_fit(log, model):
+    model.num_processes = 2
+    model.fit(log)
+    pred = model.predict(log=log, k=1)
+    assert pred.count() == 3
+
+
+def test_export_predict(log, model, tmp_path):
+    model.fit(log)
+    eager = model.predict(log=log, k=1).toPandas()
+    path = str(tmp_path / "neuromf.pt")
+    model.export_model(path, quantize=True)
+    scripted = torch.jit.load(path)
+    assert scripted(torch.LongTensor([0, 1]), torch.LongTensor([0, 1])).shape == (2,)
+    exported = model.predict(log=log, k=1).toPandas()
+    assert exported.shape == eager.shape
+
+
+def test_data_parallel_few_shards(log, model):
+    model.streaming = True
+    model.num_shards = 1
+    model.num_processes = 2
+    with pytest.raises(ValueError):
+        model.fit(log)
+
+
+def test_write_shards(spark, tmp_path):
+    log = spark.createDataFrame(
+        [(0, 1), (1, 0), (2, 2)], schema="user_idx int, item_idx int"
+    )
+    files = write_shards(log, 2, path=str(tmp_path / "shards"))
+    assert 1 <= len(files) <= 2
+    table = read_shards(files, ["user_idx", "item_idx"])
+    assert sorted(table.column("user_idx").to_pylist()) == [0, 1, 2]
+    remove_shards(files)
+    assert not (tmp_path / "shards").exists()
@@ -44,6 +44,21 @@ def test_works(log, model):
         pytest.fail()
 
 
+def test_short_ranking(log, model):
+    model.ranking_size = 1
+    model.fit(log)
+    assert len(model.item_ranking[0]) == 1
+    pred = model.predict(log, k=1)
+    assert list(pred.toPandas().sort_values("user_id")["item_id"]) == [
+        "i3",
+        "i4",
+        "i1",
+    ]
+    pred = model.predict(log, k=2, items=["i1", "i4"], filter_seen_items=False)
+    assert pred.count() == 6
+    assert set(pred.toPandas()["item_id"]) == {"i1", "i4"}
+
+
 def test_clear_cache(model):
     try:
         model._clear_cache()
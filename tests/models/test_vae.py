@@ -111,3 +111,45 @@ def test_save_load(log, model, spark):
             old_params[i],
             atol=1.0e-3,
         )
+
+
+def test_sparse_input_encode():
+    vae = VAE(item_count=3, latent_dim=1, hidden_dim=2)
+    vae.eval()
+    dense = torch.FloatTensor([[1, 0, 1], [0, 0, 2]])
+    assert np.allclose(
+        vae.encode(dense)[0].detach().numpy(),
+        vae.encode(dense.to_sparse())[0].detach().numpy(),
+        atol=1.0e-5,
+    )
+
+
+def test_sparse_input_predict(log, other_log, model):
+    model.sparse_input = True
+    assert model._init_args["sparse_input"]
+    model.fit(log)
+    recs = model.predict(other_log, k=1)
+    assert recs.count() == 2
+
+
+def test_streaming_fit(log, other_log, model):
+    model.streaming = True
+    model.num_shards = 2
+    model.fit(log)
+    recs = model.predict(other_log, k=1)
+    assert recs.count() == 2
+
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_export_predict(log, other_log, model, quantize):
+    model.fit(log)
+    eager = model.predict(other_log, k=1).toPandas()
+    model.export_model(quantize=quantize)
+    exported = model.predict(other_log, k=1).toPandas()
+    assert exported.shape == eager.shape
+    if not quantize:
+        assert np.allclose(
+            eager.sort_values("user_id")["relevance"].values,
+            exported.sort_values("user_id")["relevance"].values,
+            atol=1.0e-5,
+        )
@@ -1,11 +1,12 @@
 # pylint: disable-all
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pytest
 import numpy as np
 
 from replay.constants import LOG_SCHEMA
-from replay.splitters import DateSplitter
+from replay.models import LightFMWrap, PopRec
+from replay.splitters import DateSplitter, RollingDateSplitter
 from tests.utils import spark
 
 
@@ -103,3 +104,55 @@ def test_drop_cold_users(log, split_date):
     test_users = test.toPandas().user_id
 
     assert np.isin(test_users, train_users).all()
+
+
+@pytest.mark.parametrize("test_duration", [None, timedelta(days=1)])
+def test_rolling_split(log, test_duration):
+    dates = [datetime(2019, 9, 13), datetime(2019, 9, 15)]
+    splitter = RollingDateSplitter(dates, test_duration)
+    windows = [
+        (train.toPandas(), test.toPandas())
+        for train, test in splitter.split(log)
+    ]
+    assert [len(train) for train, _ in windows] == [1, 3]
+    if test_duration is None:
+        assert [len(test) for _, test in windows] == [2, 3]
+    else:
+        assert [len(test) for _, test in windows] == [1, 1]
+    for (train, test), date in zip(windows, dates):
+        assert train.timestamp.max() < date <= test.timestamp.min()
+
+
+def test_rolling_fit(log):
+    model = PopRec()
+    splitter = RollingDateSplitter(["2019-09-13", "2019-09-15"])
+    labels = []
+    for _ in splitter.fit_windows(model, log):
+        labels.append(list(model.user_indexer.labels))
+    assert labels[0] == ["user1"]
+    assert labels[1][:1] == ["user1"] and sorted(labels[1]) == [
+        "user1",
+        "user2",
+    ]
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_rolling_partial_fit(log, incremental):
+    model = LightFMWrap(no_components=2, random_state=0)
+    splitter = RollingDateSplitter(["2019-09-13", "2019-09-15"])
+    windows = splitter.fit_windows(model, log, incremental=incremental)
+    next(windows)
+    lightfm = model.model
+    assert lightfm.user_embeddings.shape[0] == 1
+    next(windows)
+    assert (model.model is lightfm) == incremental
+    assert model.model.user_embeddings.shape[0] == 2
+    assert list(model.user_indexer.labels)[:1] == ["user1"]
+
+
+def test_rolling_release_cache(spark, log):
+    spark.catalog.clearCache()
+    splitter = RollingDateSplitter(["2019-09-13", "2019-09-15"])
+    for train, test in splitter.split(log):
+        assert train.count() + test.count() <= log.count()
+    assert spark._jsparkSession.sharedState().cacheManager().isEmpty()
@@ -2,7 +2,8 @@
 import pytest
 import pandas as pd
 
-from replay.splitters.user_log_splitter import k_folds
+from replay.session_handler import State
+from replay.splitters.user_log_splitter import assign_folds, k_folds
 
 
 @pytest.fixture
@@ -22,3 +23,23 @@ def test_sum(df):
 def test_wrong_type(df):
     with pytest.raises(ValueError):
         next(k_folds(df, splitter="totally not user"))
+
+
+def test_assign_folds(df):
+    folds = assign_folds(df, n_folds=3, seed=1337)
+    res = folds.toPandas().sort_values(["user_id", "item_id"])
+    other = (
+        assign_folds(folds.drop("fold").repartition(4), n_folds=3, seed=1337)
+        .toPandas()
+        .sort_values(["user_id", "item_id"])
+    )
+    assert res["fold"].between(0, 2).all()
+    assert (res["fold"].to_numpy() == other["fold"].to_numpy()).all()
+
+
+def test_release_cache(df):
+    spark = State().session
+    spark.catalog.clearCache()
+    for train, test in k_folds(df, n_folds=2, seed=1337):
+        assert train.count() + test.count() == len(df)
+    assert spark._jsparkSession.sharedState().cacheManager().isEmpty()
@@ -140,11 +140,13 @@ def log2(spark):
     )
 
 
-def test_split_quantity(log2):
+@pytest.mark.parametrize("use_hash", [False, True])
+def test_split_quantity(log2, use_hash):
     splitter = UserSplitter(
         drop_cold_items=False,
         drop_cold_users=False,
         item_test_size=2,
+        use_hash=use_hash,
     )
     train, test = splitter.split(log2)
     num_items = test.toPandas().user_id.value_counts()
@@ -152,13 +154,33 @@ def test_split_quantity(log2):
     assert num_items.unique()[0] == 2
 
 
-def test_split_proportion(log2):
+@pytest.mark.parametrize("use_hash", [False, True])
+def test_split_proportion(log2, use_hash):
     splitter = UserSplitter(
         drop_cold_items=False,
         drop_cold_users=False,
         item_test_size=0.4,
+        use_hash=use_hash,
     )
     train, test = splitter.split(log2)
     num_items = test.toPandas().user_id.value_counts()
     assert num_items["2"] == 2
     assert num_items["1"] == 1 and num_items["3"] == 1
+
+
+@pytest.mark.parametrize("user_test_size", [2, 0.5])
+def test_hash_split_partitions(big_log, user_test_size):
+    splitter = UserSplitter(
+        item_test_size=2,
+        user_test_size=user_test_size,
+        shuffle=True,
+        seed=1234,
+        use_hash=True,
+    )
+    train, test = splitter.split(big_log)
+    assert train.count() + test.count() == big_log.count()
+    if isinstance(user_test_size, int):
+        assert test.select("user_id").distinct().count() == user_test_size
+    other = splitter.split(big_log.repartition(3))[1]
+    assert test.exceptAll(other).count() == 0
+    assert other.exceptAll(test).count() == 0
@@ -0,0 +1,98 @@
+# pylint: disable-all
+import numpy as np
+import pandas as pd
+import pytest
+
+from replay.metrics import NDCG, Coverage, Surprisal
+from replay.metrics.accumulators import (
+    CoverageAccumulator,
+    MetricAccumulator,
+    MomentsAccumulator,
+    QuantileSketch,
+)
+from tests.utils import spark
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    recs = pd.DataFrame(
+        {
+            "user_id": rng.integers(0, 100, 1000),
+            "item_id": rng.integers(0, 30, 1000),
+            "relevance": rng.random(1000),
+        }
+    )
+    true = pd.DataFrame(
+        {
+            "user_id": rng.integers(0, 100, 400),
+            "item_id": rng.integers(0, 30, 400),
+            "relevance": 1.0,
+        }
+    )
+    return recs, true
+
+
+def test_moments_merge():
+    values = np.random.default_rng(0).normal(size=1000)
+    acc = MomentsAccumulator()
+    for chunk in np.array_split(values, 7):
+        acc.merge(MomentsAccumulator().update(chunk))
+    assert acc.count == 1000
+    assert np.isclose(acc.mean, values.mean())
+    assert np.isclose(acc.variance, values.var(ddof=1))
+    assert MomentsAccumulator().update([]).conf_interval() is None
+    assert MetricAccumulator(NDCG(), [1, 3]).conf_interval() == {
+        1: None,
+        3: None,
+    }
+
+
+def test_quantile_sketch():
+    values = np.random.default_rng(0).random(100000)
+    sketches = [
+        QuantileSketch(seed=i).update(chunk)
+        for i, chunk in enumerate(np.array_split(values, 10))
+    ]
+    sketch = sketches[0]
+    for other in sketches[1:]:
+        sketch.merge(other)
+    assert sketch.count == 100000
+    assert sum(len(level) for level in sketch.levels) < 1000
+    for percentage in [0.1, 0.5, 0.9]:
+        assert abs(sketch.quantile(percentage) - percentage) < 0.02
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_metric_accumulator(data, use_numpy):
+    recs, true = data
+    metric = NDCG()
+    metric.use_numpy = use_numpy
+    acc = MetricAccumulator(metric, [1, 5])
+    for users in np.array_split(np.arange(100), 3):
+        acc.update(
+            recs[recs.user_id.isin(users)], true[true.user_id.isin(users)]
+        )
+    expected = metric(recs, true, [1, 5])
+    for k in [1, 5]:
+        assert np.isclose(acc.mean()[k], expected[k])
+
+
+def test_rec_only_accumulator(data):
+    recs, true = data
+    metric = Surprisal(true)
+    first = MetricAccumulator(metric, 3).update(recs[recs.user_id < 50])
+    second = MetricAccumulator(metric, 3).update(recs[recs.user_id >= 50])
+    assert np.isclose(first.merge(second).mean(), metric(recs, 3))
+
+
+def test_coverage_accumulator(data):
+    recs, true = data
+    metric = Coverage(true)
+    acc = CoverageAccumulator(metric, [1, 5])
+    acc.update(recs[recs.user_id < 50])
+    other = CoverageAccumulator(metric, [1, 5])
+    acc.merge(other.update(recs[recs.user_id >= 50]))
+    expected = metric(recs, [1, 5])
+    for k in [1, 5]:
+        assert np.isclose(acc.mean()[k], expected[k])
@@ -0,0 +1,39 @@
+# pylint: disable-all
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+from replay.arrow_transfer import (
+    numpy_to_spark,
+    sparse_to_spark,
+    spark_to_csr,
+    spark_to_numpy,
+)
+from tests.utils import spark
+
+
+def test_numpy_round_trip(spark):
+    columns = {
+        "item_idx": np.arange(5, dtype=np.int32),
+        "bias": np.linspace(0, 1, 5),
+        "factors": np.arange(10, dtype=np.float64).reshape(5, 2),
+    }
+    df = numpy_to_spark(columns, chunk_size=2)
+    assert df.count() == 5
+    result = spark_to_numpy(df.orderBy("item_idx"))
+    for name, values in columns.items():
+        assert np.allclose(result[name], values)
+
+
+def test_sparse_round_trip(spark):
+    matrix = csr_matrix(np.array([[0, 1.0, 0], [2.0, 0, 3.0]]))
+    df = sparse_to_spark(matrix, chunk_size=2)
+    assert df.count() == 3
+    assert np.allclose(spark_to_csr(df, (2, 3)).toarray(), matrix.toarray())
+
+
+def test_wrong_dimensions(spark):
+    with pytest.raises(ValueError):
+        numpy_to_spark({"a": np.zeros((2, 2, 2))})
+    with pytest.raises(ValueError):
+        numpy_to_spark({"a": np.zeros(2), "b": np.zeros(3)})
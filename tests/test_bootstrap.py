@@ -0,0 +1,121 @@
+# pylint: disable-all
+import numpy as np
+import pandas as pd
+import pytest
+
+from replay.experiment import Experiment
+from replay.metrics import NDCG, Coverage, HitRate
+from replay.metrics.bootstrap import (
+    bootstrap_means,
+    paired_p_values,
+    percentile_interval,
+)
+from tests.utils import spark
+
+
+@pytest.fixture
+def values():
+    return np.random.default_rng(0).random((1000, 2))
+
+
+@pytest.mark.parametrize("method", ["poisson", "multinomial"])
+def test_bootstrap_means(values, method):
+    samples = bootstrap_means(values, 200, method, seed=0)
+    assert samples.shape == (200, 2)
+    assert samples.dtype == np.float32
+    assert np.allclose(samples.mean(axis=0), values.mean(axis=0), atol=0.01)
+    std = values.std(axis=0) / len(values) ** 0.5
+    assert np.allclose(samples.std(axis=0), std, rtol=0.2)
+    low, high = percentile_interval(samples)
+    assert (low < values.mean(axis=0)).all()
+    assert (values.mean(axis=0) < high).all()
+
+
+def test_bootstrap_method():
+    with pytest.raises(ValueError):
+        bootstrap_means(np.ones((3, 1)), method="jackknife")
+
+
+def test_paired_p_values(values):
+    p_values = paired_p_values(values, values, 100, seed=0)
+    assert (p_values == 1).all()
+    p_values = paired_p_values(values, values + 0.1, 100, seed=0)
+    assert (p_values == 0).all()
+
+
+@pytest.fixture
+def log():
+    rng = np.random.default_rng(0)
+    recs = pd.DataFrame(
+        {
+            "user_id": rng.integers(0, 100, 1000),
+            "item_id": rng.integers(0, 30, 1000),
+            "relevance": rng.random(1000),
+        }
+    )
+    test = pd.DataFrame(
+        {
+            "user_id": rng.integers(0, 100, 400),
+            "item_id": rng.integers(0, 15, 400),
+            "relevance": 1.0,
+        }
+    )
+    return recs, test
+
+
+def test_experiment_bootstrap(log):
+    recs, test = log
+    experiment = Experiment(test, {NDCG(): [1, 5], HitRate(): 5})
+    experiment.add_result("model", recs)
+    with pytest.raises(ValueError):
+        experiment.bootstrap_intervals()
+    experiment = Experiment(
+        test, {NDCG(): [1, 5], HitRate(): 5}, bootstrap=200
+    )
+    experiment.add_results({"model": recs, "copy": recs})
+    assert np.allclose(
+        experiment.user_values["model"].mean().sort_index(),
+        experiment.results.loc["model"].sort_index().astype(float),
+    )
+    intervals = experiment.bootstrap_intervals(0.9)
+    assert set(intervals.columns) == {
+        f"{column}_0.9_{side}"
+        for column in experiment.results.columns
+        for side in ["low", "high"]
+    }
+    assert (intervals.loc["model"] == intervals.loc["copy"]).all()
+    p_values = experiment._add_p_values(
+        experiment.results.astype(object), "model"
+    )
+    assert (p_values.loc["copy", "NDCG@5_p_value"]) == 1
+
+
+@pytest.mark.parametrize("bootstrap", [None, 50])
+def test_experiment_coverage(spark, log, bootstrap, caplog):
+    recs, test = log
+    experiment = Experiment(
+        test,
+        {NDCG(): [1, 5], Coverage(spark.createDataFrame(recs)): 5},
+        bootstrap=bootstrap,
+    )
+    experiment.add_result("model", recs)
+    assert set(experiment.results.columns) == {
+        "NDCG@1",
+        "NDCG@5",
+        "Coverage@5",
+    }
+    assert experiment.results.loc["model", "Coverage@5"] > 0
+    if bootstrap is not None:
+        assert list(experiment.user_values["model"].columns) == [
+            "NDCG@1",
+            "NDCG@5",
+        ]
+        intervals = experiment.bootstrap_intervals()
+        assert set(intervals.columns) == {
+            f"{column}_0.95_{side}"
+            for column in ["NDCG@1", "NDCG@5", "Coverage@5"]
+            for side in ["low", "high"]
+        }
+        assert intervals.loc["model", "NDCG@5_0.95_low"] > 0
+        assert np.isnan(intervals.loc["model", "Coverage@5_0.95_low"])
+        assert "Coverage@5" in caplog.text
@@ -0,0 +1,153 @@
+# pylint: disable-all
+import pandas as pd
+import pytest
+
+from replay.filters import (
+    FilterPipeline,
+    filter_between_dates,
+    filter_by_duration,
+    filter_by_user_duration,
+    filter_user_interactions,
+    k_core,
+    min_entries,
+    min_rating,
+)
+from tests.utils import spark
+
+
+@pytest.fixture
+def k_core_log():
+    return pd.DataFrame(
+        {
+            "user_id": ["u1", "u1", "u2", "u2", "u3", "u3", "u4"],
+            "item_id": ["i1", "i2", "i1", "i2", "i1", "i3", "i3"],
+        }
+    )
+
+
+def test_k_core(k_core_log):
+    filtered, rounds = k_core(k_core_log, 2, 2)
+    assert sorted(filtered.toPandas().itertuples(index=False)) == [
+        ("u1", "i1"),
+        ("u1", "i2"),
+        ("u2", "i1"),
+        ("u2", "i2"),
+    ]
+    assert rounds["interactions"].sum() == 3
+    assert rounds["interactions"].iloc[-1] == 0
+
+
+def test_k_core_nulls(spark, k_core_log):
+    log = spark.createDataFrame(
+        pd.concat(
+            [k_core_log, pd.DataFrame({"user_id": [None], "item_id": ["i1"]})]
+        )
+    )
+    filtered, _ = k_core(log, 2, 2)
+    assert filtered.count() == 4
+
+
+def test_k_core_releases_rounds(spark, k_core_log):
+    persistent = spark.sparkContext._jsc.getPersistentRDDs().size()
+    _, rounds = k_core(k_core_log, 2, 2)
+    assert len(rounds) > 1
+    assert spark.sparkContext._jsc.getPersistentRDDs().size() == persistent + 1
+
+
+@pytest.fixture
+def log(spark):
+    return spark.createDataFrame(
+        pd.DataFrame(
+            {
+                "user_id": ["u1", "u1", "u1", "u2", "u2"]
+                + ["u3", "u3", "u3", "u4"],
+                "item_id": ["i1", "i2", "i3", "i3", "i1"]
+                + ["i1", "i2", "i4", "i4"],
+                "relevance": [1.0, 0.5, 3.0, 2.0, 0.0, 1.0, 4.0, 2.0, 1.0],
+                "timestamp": pd.to_datetime(
+                    ["2020-01-01", "2020-01-03", "2020-01-10"]
+                    + ["2020-01-02", "2020-01-02"]
+                    + ["2020-01-05", "2020-01-06", "2020-01-20"]
+                    + ["2020-01-15"]
+                ),
+            }
+        )
+    )
+
+
+def rows(data_frame, columns):
+    return sorted(
+        data_frame.select(*columns).toPandas().itertuples(index=False)
+    )
+
+
+@pytest.mark.parametrize(
+    "add_filter, apply_filter",
+    [
+        (lambda p: p.min_entries(2), lambda log: min_entries(log, 2)),
+        (lambda p: p.min_rating(1), lambda log: min_rating(log, 1)),
+        (
+            lambda p: p.filter_user_interactions(2),
+            lambda log: filter_user_interactions(log, 2),
+        ),
+        (
+            lambda p: p.filter_user_interactions(2, first=False),
+            lambda log: filter_user_interactions(log, 2, first=False),
+        ),
+        (
+            lambda p: p.filter_by_user_duration(3),
+            lambda log: filter_by_user_duration(log, 3),
+        ),
+        (
+            lambda p: p.filter_by_user_duration(3, first=False),
+            lambda log: filter_by_user_duration(log, 3, first=False),
+        ),
+        (
+            lambda p: p.filter_between_dates("2020-01-02", "2020-01-10"),
+            lambda log: filter_between_dates(log, "2020-01-02", "2020-01-10"),
+        ),
+        (
+            lambda p: p.filter_between_dates(start_date="2020-01-03"),
+            lambda log: filter_between_dates(log, start_date="2020-01-03"),
+        ),
+        (
+            lambda p: p.filter_by_duration(5),
+            lambda log: filter_by_duration(log, 5),
+        ),
+        (
+            lambda p: p.filter_by_duration(5, first=False),
+            lambda log: filter_by_duration(log, 5, first=False),
+        ),
+        (lambda p: p.k_core(2, 2), lambda log: k_core(log, 2, 2)[0]),
+    ],
+)
+def test_pipeline_matches_functions(log, add_filter, apply_filter):
+    expected = rows(apply_filter(log), log.columns)
+    assert expected
+    assert rows(add_filter(FilterPipeline()).transform(log), log.columns) == (
+        expected
+    )
+
+
+def test_pipeline_min_item_entries(log):
+    data = log.toPandas()
+    counts = data.groupby("item_id")["user_id"].transform("count")
+    expected = sorted(data[counts >= 2].itertuples(index=False))
+    result = FilterPipeline().min_item_entries(2).transform(log)
+    assert rows(result, log.columns) == expected
+
+
+def test_pipeline_statistics_on_same_log(log):
+    pipeline = FilterPipeline().filter_user_interactions(1).min_item_entries(2)
+    result = rows(pipeline.transform(log), ["user_id", "item_id"])
+    assert result == [("u1", "i1"), ("u2", "i1"), ("u3", "i1"), ("u4", "i4")]
+    chained = filter_user_interactions(log, 1)
+    items = (
+        chained.groupBy("item_id")
+        .count()
+        .filter("count >= 2")
+        .select("item_id")
+    )
+    assert ("u4", "i4") not in rows(
+        chained.join(items, on="item_id"), ["user_id", "item_id"]
+    )
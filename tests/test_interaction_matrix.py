@@ -0,0 +1,88 @@
+# pylint: disable-all
+import numpy as np
+import pandas as pd
+import pytest
+
+from replay.interaction_matrix import InteractionMatrixCache
+from replay.utils import convert2spark
+from tests.utils import spark
+
+
+@pytest.fixture
+def indexed_log(spark):
+    return convert2spark(
+        pd.DataFrame(
+            {
+                "user_idx": [0, 0, 1, 2],
+                "item_idx": [0, 2, 1, 2],
+                "relevance": [1.0, 2.0, 3.0, 4.0],
+            }
+        )
+    )
+
+
+def test_cache_reuse(indexed_log):
+    cache = InteractionMatrixCache()
+    matrix = cache.get(indexed_log, shape=(3, 4))
+    assert matrix.shape == (3, 4)
+    assert matrix.csr[0, 2] == 2.0
+    assert np.allclose(matrix.csc.toarray(), matrix.csr.toarray())
+    assert cache.get(indexed_log, shape=(3, 4)) is matrix
+    assert cache.get(indexed_log, shape=(3, 4), dtype=np.float32) is not matrix
+    binary = cache.get(indexed_log, value_col=None)
+    assert binary.shape == (3, 3)
+    assert binary.csr.sum() == 4
+    assert len(cache) == 3
+
+
+def test_different_logs(indexed_log):
+    cache = InteractionMatrixCache()
+    other = indexed_log.filter("user_idx > 0")
+    assert cache.get(indexed_log) is not cache.get(other)
+
+
+@pytest.mark.parametrize("spill", [True, False])
+def test_eviction(indexed_log, spill, tmp_path):
+    cache = InteractionMatrixCache(
+        max_bytes=1, spill=spill, spill_dir=str(tmp_path)
+    )
+    first = cache.get(indexed_log)
+    expected = first.csr.toarray()
+    cache.get(indexed_log, value_col=None)
+    assert len(cache) == (2 if spill else 1)
+    if spill:
+        assert first.spill_dir is not None
+        assert first.nbytes == 0
+        assert np.allclose(cache.get(indexed_log).csr.toarray(), expected)
+    cache.clear()
+    assert not list(tmp_path.iterdir())
+
+
+class Owner:
+    pass
+
+
+def test_release_by_owner(indexed_log):
+    cache = InteractionMatrixCache()
+    first, second = Owner(), Owner()
+    matrix = cache.get(indexed_log, owner=first)
+    assert cache.get(indexed_log, owner=second) is matrix
+    cache.clear(owner=first)
+    assert len(cache) == 1
+    cache.clear(owner=second)
+    assert len(cache) == 0
+    cache.get(indexed_log, owner=first)
+    del first
+    cache.get(indexed_log, value_col=None)
+    assert len(cache) == 1
+
+
+def test_overwritten_files(spark, indexed_log, tmp_path):
+    path = str(tmp_path / "log")
+    cache = InteractionMatrixCache()
+    indexed_log.write.parquet(path)
+    first = cache.get(spark.read.parquet(path), shape=(3, 3))
+    indexed_log.filter("user_idx > 0").write.mode("overwrite").parquet(path)
+    second = cache.get(spark.read.parquet(path), shape=(3, 3))
+    assert second is not first
+    assert second.csr.sum() == first.csr.sum() - 3
@@ -4,7 +4,14 @@ import numpy as np
 from replay.metrics import *
 
 from replay.distributions import item_distribution
-from replay.metrics.base_metric import sorter
+from replay.experiment import Experiment
+from replay.metrics.base_metric import (
+    EnrichmentCache,
+    RecOnlyMetric,
+    get_enriched_recommendations,
+    get_metric_statistics,
+    sorter,
+)
 from tests.utils import *
 
 
@@ -227,6 +234,94 @@ def test_duplicate_recs(quality_metrics, duplicate_recs, recs, true):
         )
 
 
+def test_enriched_recommendations(duplicate_recs, true):
+    enriched = get_enriched_recommendations(duplicate_recs, true)
+    pred = {row.user_id: row.pred for row in enriched.collect()}
+    assert pred == {
+        "user1": ["item1", "item2", "item3"],
+        "user2": ["item2", "item1", "item5"],
+        "user3": ["item1", "item4", "item3"],
+    }
+
+
+@pytest.mark.parametrize("k", [1, 2, 4])
+def test_vectorized_distribution(quality_metrics, recs, true, k):
+    enriched = get_enriched_recommendations(recs, true)
+    rows = enriched.collect()
+    for metric in quality_metrics:
+        dist = metric._get_metric_distribution(enriched, k).toPandas()
+        expected = {
+            row.user_id: float(
+                metric._get_metric_value_by_user(
+                    k, row.pred, row.ground_truth
+                )
+            )
+            for row in rows
+        }
+        assert dict(zip(dist.user_id, dist.value)) == expected, str(metric)
+
+
+def test_metric_statistics(quality_metrics, recs, true):
+    enriched = get_enriched_recommendations(recs, true)
+    rows = enriched.collect()
+    stats = get_metric_statistics(
+        enriched, {metric: [1, 3] for metric in quality_metrics}, True, 0.95
+    )
+    for metric in quality_metrics:
+        for k in [1, 3]:
+            values = [
+                metric._get_metric_value_by_user(
+                    k, row.pred, row.ground_truth
+                )
+                for row in rows
+            ]
+            mean, median, conf_interval = stats[metric, k]
+            assert_allclose(mean, np.mean(values), err_msg=str(metric))
+            assert median in values
+            assert_allclose(
+                conf_interval,
+                1.959964 * np.std(values, ddof=1) / np.sqrt(len(values)),
+                rtol=1e-5,
+                err_msg=str(metric),
+            )
+
+
+@pytest.mark.parametrize("k", [1, 3])
+def test_numpy_backend(quality_metrics, duplicate_recs, true, k):
+    pred, test = duplicate_recs.toPandas(), true.toPandas()
+    for metric in quality_metrics + [Surprisal(true), Unexpectedness(true)]:
+        if isinstance(metric, RecOnlyMetric):
+            args, spark_args = (pred,), (duplicate_recs,)
+        else:
+            args, spark_args = (pred, test), (duplicate_recs, true)
+        assert metric._numpy_backend(*args)
+        assert not metric._numpy_backend(*spark_args)
+        assert_allclose(
+            metric(*args, k), metric(*spark_args, k), err_msg=str(metric)
+        )
+
+
+def test_numpy_user_distribution(log, recs, true):
+    metric = HitRate()
+    expected = metric.user_distribution(log, recs, true, [1, 3])
+    metric.use_numpy = True
+    result = metric.user_distribution(log, recs, true, [1, 3])
+    assert_allclose(result["count"], expected["count"])
+    assert_allclose(result["value"], expected["value"])
+
+
+def test_enrichment_cache(true, recs):
+    metrics = [Surprisal(true), Unexpectedness(true), Coverage(true)]
+    recs = recs.cache()
+    cache = EnrichmentCache(recs, metrics)
+    for metric in metrics:
+        assertDictAlmostEqual(
+            metric._mean(cache[metric], [1, 3]), metric(recs, [1, 3])
+        )
+    cache.unpersist()
+    assert recs.is_cached
+
+
 def test_sorter():
     result = sorter(((1, 2), (2, 3), (3, 2)))
     assert result == [2, 3]
@@ -235,3 +330,22 @@ def test_sorter():
 def test_sorter_index():
     result = sorter([(1, 2, 3), (2, 3, 4), (3, 3, 5)], index=2)
     assert result == [5, 3]
+
+
+def test_add_results(true, recs, recs2):
+    metrics = {
+        NDCG(): [1, 3],
+        HitRate(): 3,
+        Coverage(true): 3,
+        Surprisal(true): [1, 3],
+        Unexpectedness(recs): 3,
+    }
+    sequential = Experiment(true, metrics, calc_median=True)
+    sequential.add_result("first", recs)
+    sequential.add_result("second", recs2)
+    concurrent = Experiment(true, metrics, calc_median=True)
+    concurrent.add_results({"first": recs, "second": recs2}, n_jobs=2)
+    pd.testing.assert_frame_equal(
+        sequential.results.sort_index(axis=1),
+        concurrent.results.sort_index(axis=1),
+    )
@@ -0,0 +1,89 @@
+# pylint: disable-all
+import numpy as np
+
+from replay.sampling import (
+    NegativeSampler,
+    build_alias_table,
+    gumbel_top_k,
+    sample_alias,
+)
+
+
+def test_alias_table_distribution():
+    weights = np.array([1.0, 5.0, 3.0, 0.0, 1.0])
+    prob, alias = build_alias_table(weights)
+    samples = sample_alias(prob, alias, 100000, np.random.default_rng(0))
+    assert np.allclose(
+        np.bincount(samples, minlength=5) / 100000,
+        weights / weights.sum(),
+        atol=0.01,
+    )
+
+
+def test_negative_sampler_excludes_positives():
+    users = np.array([0, 0, 1, 2])
+    items = np.array([0, 1, 2, 3])
+    sampler = NegativeSampler.from_pairs(users, items, 3, 10, seed=0)
+    batch = np.array([0, 1, 2] * 100)
+    negatives = sampler.sample(batch, 3)
+    assert negatives.shape == (900,)
+    assert not sampler.is_positive(np.tile(batch, 3), negatives).any()
+    assert negatives.max() == 9
+
+
+def test_negative_sampler_popularity():
+    sampler = NegativeSampler.from_pairs(
+        np.array([0, 1, 2, 2]), np.array([0, 0, 1, 2]), 4, 4, alpha=1.0, seed=0
+    )
+    negatives = sampler.sample(np.array([3] * 1000))
+    assert set(np.unique(negatives)) == {0, 1, 2}
+    assert (negatives == 0).mean() > 0.4
+
+
+def test_negative_sampler_from_sorted_keys(tmp_path):
+    users = np.array([0, 1, 2, 2])
+    items = np.array([0, 0, 1, 2])
+    from_pairs = NegativeSampler.from_pairs(
+        users, items, 4, 4, alpha=1.0, seed=0
+    )
+    keys = np.memmap(tmp_path / "keys", np.int64, "w+", shape=4)
+    keys[:] = np.sort(users * 4 + items)
+    from_keys = NegativeSampler.from_sorted_keys(keys, 4, alpha=1.0, seed=0)
+    assert np.array_equal(
+        from_keys.sample(np.arange(4), 10), from_pairs.sample(np.arange(4), 10)
+    )
+    assert np.array_equal(from_keys._alias[0], from_pairs._alias[0])
+
+
+def test_gumbel_top_k_batch_independent():
+    log_probs = np.log(np.array([0.4, 0.3, 0.2, 0.1]))
+    users = np.arange(6)
+    counts = np.array([1, 2, 3, 4, 4, 2])
+    rows, cols, ranks = gumbel_top_k(
+        log_probs, counts, users, np.arange(4), seed=7
+    )
+    assert np.array_equal(np.bincount(rows), counts)
+    for user in users:
+        single = gumbel_top_k(
+            log_probs, counts[[user]], users[[user]], np.arange(4), seed=7
+        )
+        assert np.array_equal(single[1], cols[rows == user])
+        assert np.array_equal(single[2], ranks[rows == user])
+        assert len(np.unique(cols[rows == user])) == counts[user]
+
+
+def test_gumbel_top_k_distribution():
+    probs = np.array([0.5, 0.3, 0.2])
+    _, cols, _ = gumbel_top_k(
+        np.log(probs), np.ones(20000, dtype=int), np.arange(20000),
+        np.arange(3), seed=1,
+    )
+    assert np.allclose(np.bincount(cols) / 20000, probs, atol=0.02)
+
+
+def test_gumbel_top_k_skips_impossible_items():
+    _, cols, _ = gumbel_top_k(
+        np.array([-np.inf, 0.0]), np.array([2]), np.array([0]),
+        np.arange(2), seed=1,
+    )
+    assert cols.tolist() == [1]
@@ -55,6 +55,18 @@ def test_equal_preds(long_log_with_features, recommender, tmp_path):
     sparkDataFrameEqual(base_pred, new_pred)
 
 
+def test_sparse_vae(long_log_with_features, tmp_path):
+    path = (tmp_path / "vae").resolve()
+    model = MultVAE(epochs=1, sparse_input=True)
+    model.fit(long_log_with_features)
+    base_pred = model.predict(long_log_with_features, 5)
+    save(model, path)
+    m = load(path)
+    assert m.sparse_input
+    new_pred = m.predict(long_log_with_features, 5)
+    sparkDataFrameEqual(base_pred, new_pred)
+
+
 def test_random(long_log_with_features, tmp_path):
     path = (tmp_path / "random").resolve()
     model = RandomRec(seed=1)